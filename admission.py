@@ -0,0 +1,314 @@
+'''
+Admission control for the flask app: per route concurrency limits, per client token buckets and early load
+shedding by priority class, all answered (503/429 with Retry-After) before a request touches the database
+
+In-flight counts live in shared memory allocated by create_app, so with gunicorn's preload_app (the default)
+every forked worker shares them and ADMISSION_ROUTE_LIMITS caps a route across the whole server (without
+preloading each worker counts on its own). Each worker writes a row of its own, and gunicorn.conf.py's
+child_exit zeroes the row of a worker that died (killed on timeout, say) so its requests stop counting.
+Token buckets are per worker, each with a 1/workers share of ADMISSION_RATE, and the pool wait is too.
+'''
+import math
+import multiprocessing
+import threading
+import time
+from collections import OrderedDict
+
+from flask import g, jsonify, request
+
+CRITICAL = 'critical'
+NORMAL = 'normal'
+BULK = 'bulk'
+
+#point lookups (and the ops routes) keep flowing under load, scans, exports and streams are shed first
+CRITICAL_ROUTES = {'select_vehicle', 'hello', 'prometheus_metrics', 'db_pool_stats', 'vehicle_cache_stats'}
+BULK_ROUTES = {'list_vehicles', 'list_sold_vehicles', 'export_vehicles', 'export_sold_vehicles', 'vehicle_changes'}
+
+#the share of each shedding threshold at which a class is turned away (critical requests never are)
+SHED_AT = {NORMAL: 1.0, BULK: 0.5}
+
+
+def route_priority(endpoint, method):
+    '''returns a request's priority class from its endpoint and method'''
+
+    if endpoint == 'bulk_create_vehicles' or (method == 'GET' and endpoint in BULK_ROUTES):
+        return BULK
+    if (method in ('GET', 'HEAD') and endpoint in CRITICAL_ROUTES) or endpoint == 'batch_get_vehicles':
+        return CRITICAL
+    return NORMAL
+
+
+def limit_key(endpoint, method):
+    '''
+    Returns the route limit (and in-flight counter) a request counts against: its endpoint for reads,
+    "<METHOD> <endpoint>" for writes, so creates never wait behind the scans of the same url
+    '''
+    return endpoint if method in ('GET', 'HEAD') else f'{method} {endpoint}'
+
+
+def parse_route_limits(value):
+    '''reads route limits written as "list_vehicles=2,export_vehicles=1,POST bulk_create_vehicles=1" (see limit_key)'''
+
+    limits = {}
+    for item in (value or '').split(','):
+        if item.strip():
+            endpoint, _, limit = item.partition('=')
+            limits[endpoint.strip()] = int(limit)
+    return limits
+
+
+def client_address(remote_addr, forwarded_for, trusted_proxies):
+    '''
+    Returns the address a request came from: with trusted_proxies proxies in front of the app, the address
+    the outermost of them saw in X-Forwarded-For (the client can forge anything further left)
+    '''
+    if trusted_proxies and forwarded_for:
+        addresses = [address.strip() for address in forwarded_for.split(',') if address.strip()]
+        if addresses:
+            return addresses[-min(trusted_proxies, len(addresses))]
+    return remote_addr
+
+
+def queue_seconds(header, now):
+    '''
+    Returns how long a request waited before reaching the app, from a proxy's X-Request-Start header
+    ("t=<unix time>" in seconds, milliseconds or microseconds, None when missing or malformed)
+    '''
+    if not header:
+        return None
+    try:
+        start = float(header.strip().removeprefix('t='))
+    except ValueError:
+        return None
+    if start > 1e14:
+        start /= 1e6
+    elif start > 1e11:
+        start /= 1e3
+    return max(0.0, now - start)
+
+
+class TokenBucket:
+    '''
+    Refills rate tokens a second up to burst, every admitted request takes one
+    '''
+
+    def __init__(self, rate, burst, now):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = now
+
+    def take(self, now):
+        '''takes a token, returning 0 or (when empty) the seconds until the next one'''
+
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+
+class RateLimiter:
+    '''
+    A token bucket per client (the least recently seen clients are forgotten beyond max_clients)
+    '''
+
+    def __init__(self, rate, burst, max_clients=10000):
+        self.rate = rate
+        self.burst = burst
+        self.max_clients = max_clients
+        self.buckets = OrderedDict()
+        self.lock = threading.Lock()
+
+    def take(self, client):
+        now = time.monotonic()
+        with self.lock:
+            bucket = self.buckets.get(client)
+            if bucket is None:
+                bucket = self.buckets[client] = TokenBucket(self.rate, self.burst, now)
+                if len(self.buckets) > self.max_clients:
+                    self.buckets.popitem(last=False)
+            else:
+                self.buckets.move_to_end(client)
+            return bucket.take(now)
+
+
+class InFlight:
+    '''
+    In-flight request counters, one per limited route plus a total, with a row per gunicorn worker in shared
+    memory: a worker only ever writes its own row (under a thread lock of its own, so a worker killed mid
+    request leaves no lock held) and counts sum every row, child_exit zeroes the rows of workers that died
+
+    Attributes:
+        rows (RawArray): worker_slots rows of len(routes) + 1 counters, the total first
+        row (int): the row this process writes (None for a worker that found no free slot, which then
+            counts its own requests alone)
+    '''
+
+    def __init__(self, routes, worker_slots=1):
+        self.columns = {route: index + 1 for index, route in enumerate(routes)}
+        self.width = len(routes) + 1
+        self.rows = multiprocessing.RawArray('i', self.width * worker_slots)
+        self.worker_slots = worker_slots
+        self.row = 0
+        self.own = [0] * self.width
+        self.lock = threading.Lock()
+
+    def claim(self, slot):
+        '''makes a freshly forked worker write the row of its slot'''
+
+        self.row = slot if slot is not None and 0 <= slot < self.worker_slots else None
+        self.own = [0] * self.width
+
+    def reset(self, slot):
+        '''zeroes a dead worker's row (requests it never finished stop counting)'''
+
+        for column in range(self.width):
+            self.rows[slot * self.width + column] = 0
+
+    def _sum(self, column):
+        others = sum(
+            self.rows[row * self.width + column] for row in range(self.worker_slots) if row != self.row
+        )
+        return others + self.own[column]
+
+    def _add(self, column, delta):
+        self.own[column] += delta
+        if self.row is not None:
+            self.rows[self.row * self.width + column] = self.own[column]
+
+    def total(self):
+        return self._sum(0)
+
+    def count(self, route):
+        return self._sum(self.columns[route]) if route in self.columns else None
+
+    def acquire(self, route, limit):
+        '''
+        Counts a request in, unless its route already has limit requests in flight (counted in first, then
+        checked, so workers racing for the last slot may both back off but never both get it)
+        '''
+        column = self.columns.get(route)
+        with self.lock:
+            self._add(0, 1)
+            if column is None:
+                return True
+            self._add(column, 1)
+            if limit is not None and self._sum(column) > limit:
+                self._add(column, -1)
+                self._add(0, -1)
+                return False
+        return True
+
+    def release(self, route):
+        column = self.columns.get(route)
+        with self.lock:
+            if column is not None:
+                self._add(column, -1)
+            self._add(0, -1)
+
+
+class AdmissionController:
+    '''
+    Decides whether a request runs now
+
+    Attributes:
+        in_flight (InFlight): requests being served, per limited route and in total
+        rejected (dict): reason -> the number of requests turned away by this worker
+    '''
+
+    def __init__(self, config, pool_stats):
+        self.config = config
+        self.pool_stats = pool_stats
+        self.route_limits = config['ADMISSION_ROUTE_LIMITS']
+        self.in_flight = InFlight(list(self.route_limits), config['ADMISSION_WORKER_SLOTS'])
+        self.rate_limiter = RateLimiter(config['ADMISSION_RATE'], config['ADMISSION_BURST']) if config['ADMISSION_RATE'] > 0 else None
+        self.rejected = {'rate_limited': 0, 'shed': 0, 'route_limited': 0}
+
+    def join_worker(self, slot, workers):
+        '''
+        Sets up a freshly forked gunicorn worker: it counts in-flight requests in its slot's row, and its
+        token buckets get a 1/workers share of the client rate limit (requests spread over the workers)
+        '''
+        self.in_flight.claim(slot)
+        if self.rate_limiter is not None:
+            self.rate_limiter = RateLimiter(
+                self.config['ADMISSION_RATE'] / workers, max(1, self.config['ADMISSION_BURST'] // workers)
+            )
+
+    def overloaded(self, priority, queue_time):
+        '''returns why a request of a priority class should be shed (None while the server keeps up)'''
+
+        if priority == CRITICAL:
+            return None
+        share = SHED_AT[priority]
+        if self.in_flight.total() >= self.config['ADMISSION_MAX_IN_FLIGHT'] * share:
+            return 'too many requests in flight'
+        if self.pool_stats.recent_wait_seconds() > self.config['ADMISSION_MAX_POOL_WAIT'] * share:
+            return 'database connections are saturated'
+        if queue_time is not None and queue_time > self.config['ADMISSION_MAX_QUEUE_TIME'] * share:
+            return 'requests are queueing'
+        return None
+
+    def admit(self, endpoint, method, client, queue_time):
+        '''
+        Counts a request in (under limit_key(endpoint, method), which release takes back), or returns the
+        (status, message, retry after seconds) it is turned away with
+        '''
+        if self.rate_limiter is not None:
+            wait = self.rate_limiter.take(client)
+            if wait:
+                self.rejected['rate_limited'] += 1
+                return 429, "rate limit exceeded", wait
+
+        reason = self.overloaded(route_priority(endpoint, method), queue_time)
+        if reason is not None:
+            self.rejected['shed'] += 1
+            return 503, f"server is overloaded ({reason}), retry later", self.config['ADMISSION_RETRY_AFTER']
+
+        key = limit_key(endpoint, method)
+        if not self.in_flight.acquire(key, self.route_limits.get(key)):
+            self.rejected['route_limited'] += 1
+            return 503, f"too many concurrent '{key}' requests, retry later", self.config['ADMISSION_RETRY_AFTER']
+        return None
+
+    def release(self, key):
+        self.in_flight.release(key)
+
+
+def admission_control(app, pool_stats):
+    '''
+    Registers the admission checks on the app (register it after the metrics hooks so rejected requests are
+    still timed and counted), returning the controller
+    '''
+    controller = AdmissionController(app.config, pool_stats)
+
+    @app.before_request
+    def admit_request():
+        if request.endpoint is None or request.endpoint == 'static':
+            return None
+
+        header = app.config['ADMISSION_CLIENT_HEADER']
+        client = (request.headers.get(header) if header else None) or client_address(
+            request.remote_addr, request.headers.get('X-Forwarded-For'), app.config['ADMISSION_TRUSTED_PROXIES']
+        )
+        rejection = controller.admit(
+            request.endpoint, request.method, client,
+            queue_seconds(request.headers.get('X-Request-Start'), time.time())
+        )
+        if rejection is not None:
+            status, message, retry_after = rejection
+            response = jsonify({"error": message})
+            response.headers['Retry-After'] = str(max(1, math.ceil(retry_after)))
+            return response, status
+        g.admitted = limit_key(request.endpoint, request.method)
+
+    @app.teardown_request
+    def release_request(error=None):
+        #runs once the response (streamed ones included) is done, g.admitted guards against a second call
+        key = g.pop('admitted', None)
+        if key is not None:
+            controller.release(key)
+
+    return controller
@@ -1,13 +1,48 @@
+import math
 import os
+import threading
+import time
+
+import click
+from datetime import datetime
 
 from dotenv import load_dotenv
-from flask import Flask, request, jsonify
+from flask import Flask, Response, g, request, jsonify, stream_with_context, url_for
 from flask_migrate import Migrate
 from flask_sqlalchemy import SQLAlchemy
-from helper import validate_vehicle_request
+from sqlalchemy import DDL, event, insert
+from sqlalchemy.exc import IntegrityError, SQLAlchemyError
+from admission import admission_control, parse_route_limits
+from cache import create_cache
+from coalescing import WriteBatcher
+from content_encoding import compress_responses
+from export import EXPORT_FORMATS, csv_chunks, ndjson_chunks, parquet_chunks, pyarrow
+from json_provider import json_provider_class, orjson
+from metrics import RequestMetrics, begin_request, count_queries, request_queries
+from pool import PoolStats, enforce_foreign_keys, engine_options, pool_config
+from profiling import profile_views
+from replicas import ReplicaSet, RoutingSession, replica_binds, route_reads
+from helper import (
+    check_vehicle_fields, stream_json_array, stream_ndjson, iter_ndjson, iter_batches, bulk_insert_rows,
+    collection_etag, vehicle_etag, not_modified, vehicle_columns, validation_error, parse_fields, parse_vin_list, sse_event, utcnow
+)
+from queries import (
+    vehicle_list_query, vehicle_page, vehicle_batch_query, vehicle_batch, sold_list_query, sold_page, vehicle_fields_query,
+    table_version_query, combine_versions, bump_version_statement, insert_vehicle_statement, insert_vehicles_statement, insert_new_vins_statement,
+    update_vehicle_statement, delete_vehicle_statement, patch_values,
+    stats_row, vehicle_stats_row_query, stats_deltas, stats_delta_statement, stats_query, stats_page,
+    rebuild_stats_statements, vehicle_export_query, sold_export_query,
+    SOLD_VERSION_DDL, SEARCH_DDL, search_query, search_index_statements, search_unindex_statements,
+    change_log_rows, changes_query, change_events, changes_pruned_before, prune_changes_statement
+)
 
 def create_app(config_updates=None):
-    '''creates a basic flask app (either connecting to RDS or memory based on configurations passed in'''
+    '''
+    creates a basic flask app (either connecting to RDS or memory based on configurations passed in)
+
+    nothing connects to the database here, serve it with gunicorn 'app:create_app()' (see gunicorn.conf.py)
+    and reach the extensions through app.extensions['sqlalchemy'] and app.extensions['migrate']
+    '''
 
     app = Flask(__name__)
 
@@ -22,12 +57,163 @@ def create_app(config_updates=None):
 
     app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 
+    #pagination/streaming settings for list routes
+    app.config['VEHICLE_PAGE_DEFAULT_LIMIT'] = 100
+    app.config['VEHICLE_PAGE_MAX_LIMIT'] = 1000
+    app.config['VEHICLE_STREAM_CHUNK_SIZE'] = 1000
+    app.config['VEHICLE_BULK_CHUNK_SIZE'] = 5000
+    app.config['VEHICLE_EXPORT_CHUNK_SIZE'] = 10000
+    #how far the exports' watermarks trail their start, longer than any vehicle or sale write transaction
+    app.config['VEHICLE_EXPORT_WATERMARK_LAG'] = float(os.getenv('VEHICLE_EXPORT_WATERMARK_LAG', 60))
+    app.config['VEHICLE_SEARCH_MAX_LIMIT'] = 100
+    app.config['VEHICLE_BATCH_GET_MAX_VINS'] = 1000
+    app.config['VEHICLE_BATCH_GET_CHUNK_SIZE'] = 500
+
+    #change feed (GET /vehicle/changes): sse streams poll the log every POLL_INTERVAL seconds and close
+    #after SSE_TIMEOUT (clients reconnect with Last-Event-ID), prune-vehicle-changes keeps RETENTION_DAYS
+    app.config['VEHICLE_CHANGES_POLL_INTERVAL'] = float(os.getenv('VEHICLE_CHANGES_POLL_INTERVAL', 1))
+    app.config['VEHICLE_CHANGES_SSE_TIMEOUT'] = float(os.getenv('VEHICLE_CHANGES_SSE_TIMEOUT', 30))
+    app.config['VEHICLE_CHANGES_RETENTION_DAYS'] = float(os.getenv('VEHICLE_CHANGES_RETENTION_DAYS', 7))
+
+    #sse streams a worker serves at once (a stream holds a sync worker for up to SSE_TIMEOUT, so none by
+    #default there, gthread keeps a thread free for other requests), the rest get 503 and the paged feed
+    worker_class = os.getenv('GUNICORN_WORKER_CLASS', 'sync')
+    default_streams = {'sync': 0, 'gthread': int(os.getenv('GUNICORN_THREADS', 4)) - 1}.get(worker_class, 100)
+    app.config['VEHICLE_CHANGES_SSE_MAX_STREAMS'] = int(os.getenv('VEHICLE_CHANGES_SSE_MAX_STREAMS', default_streams))
+
+    #read-through cache for single vehicle lookups, off by default: 'shared' (redis) for any multi-worker
+    #deployment, 'lru' only when a single process serves the app (each worker keeps its own lru, so the
+    #others serve stale bodies, etags and 304s for up to VEHICLE_CACHE_TTL after a write)
+    app.config['VEHICLE_CACHE_BACKEND'] = os.getenv('VEHICLE_CACHE_BACKEND', '')
+    app.config['VEHICLE_CACHE_SIZE'] = int(os.getenv('VEHICLE_CACHE_SIZE', 10000))
+    app.config['VEHICLE_CACHE_TTL'] = float(os.getenv('VEHICLE_CACHE_TTL', 5))
+    app.config['VEHICLE_CACHE_URL'] = os.getenv('VEHICLE_CACHE_URL')
+
+    #json encoder used for every response ('orjson' when installed, otherwise the standard library's)
+    app.config['JSON_PROVIDER'] = os.getenv('JSON_PROVIDER', 'orjson' if orjson else 'json')
+
+    #negotiated response compression: encodings in preference order (brotli/zstd need their packages, '' turns
+    #compression off), the smallest unstreamed body worth compressing and each encoding's level
+    app.config['COMPRESSION_ENCODINGS'] = [encoding for encoding in os.getenv('COMPRESSION_ENCODINGS', 'zstd,br,gzip').split(',') if encoding]
+    app.config['COMPRESSION_MIN_SIZE'] = int(os.getenv('COMPRESSION_MIN_SIZE', 1024))
+    app.config['COMPRESSION_LEVELS'] = {
+        'gzip': int(os.getenv('COMPRESSION_GZIP_LEVEL', 6)),
+        'br': int(os.getenv('COMPRESSION_BROTLI_QUALITY', 4)),
+        'zstd': int(os.getenv('COMPRESSION_ZSTD_LEVEL', 3)),
+    }
+
+    #adds X-Query-Count/X-DB-Time headers to every response (for spotting N+1 query patterns)
+    app.config['METRICS_QUERY_HEADER'] = os.getenv('METRICS_QUERY_HEADER', 'false').lower() == 'true'
+
+    #opt-in request profiling: views are only wrapped when PROFILE_DIR is set, then a request is profiled
+    #when its X-Profile header matches PROFILE_TOKEN or it falls in the PROFILE_SAMPLE_RATE fraction
+    app.config['PROFILE_DIR'] = os.getenv('PROFILE_DIR')
+    app.config['PROFILE_TOKEN'] = os.getenv('PROFILE_TOKEN')
+    app.config['PROFILE_SAMPLE_RATE'] = float(os.getenv('PROFILE_SAMPLE_RATE', 0))
+
+    #connection pool sizing/health settings (DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_TIMEOUT, ...)
+    app.config.update(pool_config())
+
+    #read replicas (comma separated uris) for GET /vehicle, /vehicle/<vin> and /vehicle_sold: 'round_robin' or
+    #'least_loaded', a failed replica sits out REPLICA_RETRY_SECONDS and a client that wrote reads from
+    #the primary for REPLICA_PIN_SECONDS
+    app.config['REPLICA_DATABASE_URIS'] = [uri for uri in os.getenv('REPLICA_DATABASE_URIS', '').split(',') if uri]
+    app.config['REPLICA_POLICY'] = os.getenv('REPLICA_POLICY', 'round_robin')
+    app.config['REPLICA_RETRY_SECONDS'] = float(os.getenv('REPLICA_RETRY_SECONDS', 30))
+    app.config['REPLICA_PIN_SECONDS'] = float(os.getenv('REPLICA_PIN_SECONDS', 5))
+
+    #opt-in group commit for POST /vehicle and PUT /vehicle/<vin>: concurrent writes in a worker (gthread/gevent
+    #workers) are flushed together in one transaction once MAX_ROWS are queued or MAX_DELAY seconds have passed
+    app.config['WRITE_COALESCING'] = os.getenv('WRITE_COALESCING', 'false').lower() == 'true'
+    app.config['WRITE_COALESCING_MAX_ROWS'] = int(os.getenv('WRITE_COALESCING_MAX_ROWS', 100))
+    app.config['WRITE_COALESCING_MAX_DELAY'] = float(os.getenv('WRITE_COALESCING_MAX_DELAY', 0.005))
+
+    #opt-in admission control: per route concurrency limits (endpoint=limit for its GETs, "METHOD endpoint=limit"
+    #for writes, shared by gunicorn's preloaded workers, up to WORKER_SLOTS of them), per client token buckets
+    #(ADMISSION_RATE requests a second for the whole server, 0 turns them off, clients are told apart by
+    #ADMISSION_CLIENT_HEADER or their address, taken from X-Forwarded-For behind TRUSTED_PROXIES proxies) and
+    #load shedding, bulk requests at half of each threshold and point lookups never, once the in-flight count,
+    #the recent pool wait (seconds) or the proxy queue time (X-Request-Start, seconds) crosses its threshold
+    app.config['ADMISSION_CONTROL'] = os.getenv('ADMISSION_CONTROL', 'false').lower() == 'true'
+    app.config['ADMISSION_ROUTE_LIMITS'] = parse_route_limits(os.getenv(
+        'ADMISSION_ROUTE_LIMITS', 'list_vehicles=3,list_sold_vehicles=2,export_vehicles=1,export_sold_vehicles=1,vehicle_changes=2,POST bulk_create_vehicles=1,search_vehicles=3'
+    ))
+    app.config['ADMISSION_MAX_IN_FLIGHT'] = int(os.getenv('ADMISSION_MAX_IN_FLIGHT', 10))
+    app.config['ADMISSION_MAX_POOL_WAIT'] = float(os.getenv('ADMISSION_MAX_POOL_WAIT', 0.2))
+    app.config['ADMISSION_MAX_QUEUE_TIME'] = float(os.getenv('ADMISSION_MAX_QUEUE_TIME', 1))
+    app.config['ADMISSION_RATE'] = float(os.getenv('ADMISSION_RATE', 0))
+    app.config['ADMISSION_BURST'] = int(os.getenv('ADMISSION_BURST', 50))
+    app.config['ADMISSION_CLIENT_HEADER'] = os.getenv('ADMISSION_CLIENT_HEADER')
+    app.config['ADMISSION_TRUSTED_PROXIES'] = int(os.getenv('ADMISSION_TRUSTED_PROXIES', 0))
+    app.config['ADMISSION_WORKER_SLOTS'] = int(os.getenv('ADMISSION_WORKER_SLOTS', 64))
+    app.config['ADMISSION_RETRY_AFTER'] = float(os.getenv('ADMISSION_RETRY_AFTER', 1))
+
     if config_updates:
         app.config.update(config_updates)
+
+    pool_stats = PoolStats()
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
+        **engine_options(app.config, pool_stats),
+        **app.config.get('SQLALCHEMY_ENGINE_OPTIONS', {})
+    }
+
+    app.config['SQLALCHEMY_BINDS'] = {**replica_binds(app.config), **app.config.get('SQLALCHEMY_BINDS', {})}
+
+    app.json = json_provider_class(app.config['JSON_PROVIDER'])(app)
     
-    db = SQLAlchemy(app)
+    db = SQLAlchemy(app, session_options={'class_': RoutingSession})
     migrate = Migrate(app, db)
 
+
+    cache = create_cache(app.config)
+    app.extensions['vehicle_cache'] = cache
+
+    #per route latency/query/size metrics, served on /metrics
+    request_metrics = RequestMetrics()
+    app.extensions['request_metrics'] = request_metrics
+    with app.app_context():
+        count_queries(db.engine)
+        enforce_foreign_keys(db.engine)
+
+    @app.before_request
+    def start_request_metrics():
+        g.request_start = time.perf_counter()
+        g.request_queries = begin_request()
+
+    @app.after_request
+    def record_request_metrics(response):
+        queries, db_time = g.request_queries
+        route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+        request_metrics.record(
+            request.method, route, response.status_code,
+            time.perf_counter() - g.request_start, queries, db_time,
+            None if response.is_streamed else response.content_length
+        )
+        if app.config['METRICS_QUERY_HEADER']:
+            response.headers['X-Query-Count'] = str(queries)
+            response.headers['X-DB-Time'] = f'{db_time * 1e3:.3f}ms'
+        return response
+
+    @app.teardown_request
+    def stop_request_metrics(error=None):
+        request_queries.set(None)
+
+    #registered after the metrics hooks so the sizes they record are the compressed ones
+    compress_responses(app)
+
+    #registered after the metrics hooks too, so turned away requests are still timed and counted
+    admission = admission_control(app, pool_stats) if app.config['ADMISSION_CONTROL'] else None
+    app.extensions['admission'] = admission
+
+    #change feed sse streams this worker is serving
+    sse_lock = threading.Lock()
+    sse_streams = {'open': 0}
+
+    def invalidate(*vins):
+        '''drops cached copies of vehicles that were just written'''
+        if cache is not None:
+            cache.delete(*vins)
+
     
     class Vehicle(db.Model):
         '''
@@ -41,9 +227,25 @@ def create_app(config_updates=None):
             model_year (int): the year the model was designed for (interestingly not the same as year built!)
             purchase_price (float): the amount to buy the vehicle
             fuel_type (string): the substance used to power the vehicle
+            version (int): bumped by every write, used in the vehicle's etag (with updated_at)
+            updated_at (datetime): when the vehicle was last written (the watermark for incremental exports)
 
         '''
         __tablename__='vehicles'
+        __table_args__ = (
+            #filter indexes (equality and range lookups on /vehicle)
+            db.Index('ix_vehicles_manufacturer_name_model_year', 'manufacturer_name', 'model_year'),
+            db.Index('ix_vehicles_fuel_type_purchase_price', 'fuel_type', 'purchase_price'),
+            db.Index('ix_vehicles_color', 'color'),
+            db.Index('ix_vehicles_category', 'category'),
+            #sort indexes (the vin tie breaker lets keyset pages seek instead of scan)
+            db.Index('ix_vehicles_model_year_vin', 'model_year', 'vin'),
+            db.Index('ix_vehicles_purchase_price_vin', 'purchase_price', 'vin'),
+            #incremental exports (?since=) seek on the last write time
+            db.Index('ix_vehicles_updated_at', 'updated_at'),
+            #?vin_prefix= range scans (postgres' primary key follows the database collation, this index does not)
+            db.Index('ix_vehicles_vin_pattern', 'vin', postgresql_ops={'vin': 'varchar_pattern_ops'}).ddl_if(dialect='postgresql'),
+        )
 
         vin = db.Column(db.String(), primary_key=True)
         manufacturer_name = db.Column(db.String())
@@ -54,9 +256,14 @@ def create_app(config_updates=None):
         fuel_type = db.Column(db.String())
         color = db.Column(db.String())
         category = db.Column(db.String())
+        version = db.Column(db.Integer, nullable=False, default=1, server_default='1')
+        updated_at = db.Column(db.DateTime(timezone=True), nullable=False, default=utcnow, onupdate=utcnow, server_default=db.func.now())
+
+        #the columns serialize() returns (list routes select just these instead of whole vehicles)
+        serialized_columns = ["vin", "manufacturer_name", "horse_power", "model_name", "model_year", "purchase_price", "fuel_type"]
 
 
-        def __init__(self, vin, manufacturer_name, horse_power, model_name, model_year, purchase_price, fuel_type):
+        def __init__(self, vin, manufacturer_name, horse_power, model_name, model_year, purchase_price, fuel_type, color=None, category=None):
             
             self.vin = vin.upper()
             self.manufacturer_name = manufacturer_name
@@ -65,6 +272,8 @@ def create_app(config_updates=None):
             self.model_year = model_year
             self.purchase_price = purchase_price
             self.fuel_type = fuel_type
+            self.color = color
+            self.category = category
         
         def serialize(self):
             '''return a json format (dictionary) of vehicle's attributes'''
@@ -80,12 +289,30 @@ def create_app(config_updates=None):
             }
 
     class Vehicle_sold(db.Model):
+        '''
+        Blueprint for a vehicle sale
+
+        Attributes:
+            id (int): the sale's unique identifier (also the pagination cursor)
+            vin (string): the sold vehicle's vin (references vehicles.vin, renames cascade, deletes are refused)
+            purchase_price (float): the amount the vehicle was sold for
+            insurance_policy (string): the policy attached to the sale
+            car_damage (float): the damage recorded at the time of sale
+            created_at (datetime): when the sale was written (the watermark for incremental exports)
+        '''
         __tablename__ = "sold_vehicles"
 
-        vin = db.Column(db.String())
+        id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+        #sales are history: a sold vehicle cannot be deleted (409), but a vin correction follows it into its sales
+        vin = db.Column(db.String(), db.ForeignKey('vehicles.vin', ondelete='RESTRICT', onupdate='CASCADE'), nullable=False, index=True)
         purchase_price = db.Column(db.Float())
         insurance_policy = db.Column(db.String())
         car_damage = db.Column(db.Float())
+        #stamped by the database too, sales are written outside this app
+        created_at = db.Column(db.DateTime(timezone=True), nullable=False, default=utcnow, server_default=db.func.now(), index=True)
+
+        #the columns serialize() returns (list routes select just these instead of whole sales)
+        serialized_columns = ["id", "purchase_price", "insurance_policy", "car_damage"]
 
         def __init__(self, vin, purchase_price, insurance_policy, car_damage):
             self.vin = vin.upper()
@@ -95,40 +322,426 @@ def create_app(config_updates=None):
 
         def serialize(self):
             return{
-                "vin": self.vin,
+                "id": self.id,
                 "purchase_price": self.purchase_price,
                 "insurance_policy": self.insurance_policy,
-                "car_damge": self.car_damage
+                "car_damage": self.car_damage
             }
 
+    class Table_version(db.Model):
+        '''
+        Change counter for a whole table, bumped in the same transaction as every write to it
+
+        Attributes:
+            name (string): the table being counted
+            version (int): the number of committed writes to that table (used in collection etags)
+        '''
+        __tablename__ = "table_versions"
+
+        name = db.Column(db.String(), primary_key=True)
+        version = db.Column(db.Integer, nullable=False, default=1)
+
+    class Vehicle_stats(db.Model):
+        '''
+        Inventory rollup per (manufacturer, model year, fuel type), kept current by every vehicle write
+
+        Attributes:
+            manufacturer_name (string): the group's manufacturer
+            model_year (int): the group's model year
+            fuel_type (string): the group's fuel type
+            vehicle_count (int): the number of vehicles in the group (groups at 0 are kept, not listed)
+            purchase_price_sum (float): the group's total purchase price (averages are sum / count)
+        '''
+        __tablename__ = "vehicle_stats"
+
+        manufacturer_name = db.Column(db.String(), primary_key=True)
+        model_year = db.Column(db.Integer, primary_key=True)
+        fuel_type = db.Column(db.String(), primary_key=True)
+        vehicle_count = db.Column(db.Integer, nullable=False, default=0)
+        purchase_price_sum = db.Column(db.Float, nullable=False, default=0.0)
+
+    class Vehicle_change(db.Model):
+        '''
+        Append-only log of vehicle writes, read by GET /vehicle/changes
+
+        Attributes:
+            id (int): the change's position in the log (the feed's cursor)
+            vin (string): the written vehicle's vin
+            operation (string): 'insert', 'update' or 'delete'
+            version (int): the vehicle's version after the write (None for deletes)
+            changed_at (datetime): when the change was logged (prune-vehicle-changes drops old changes)
+        '''
+        __tablename__ = "vehicle_changes"
+
+        id = db.Column(db.BigInteger().with_variant(db.Integer, 'sqlite'), primary_key=True, autoincrement=True)
+        vin = db.Column(db.String(), nullable=False)
+        operation = db.Column(db.String(), nullable=False)
+        version = db.Column(db.Integer)
+        changed_at = db.Column(db.DateTime(timezone=True), nullable=False, default=utcnow, index=True)
+
+    #creates the search indexes alongside the vehicles table (migrations create them on existing databases)
+    for dialect_name, statements in SEARCH_DDL.items():
+        for statement in statements:
+            event.listen(Vehicle.__table__, 'after_create', DDL(statement).execute_if(dialect=dialect_name))
+    event.listen(Vehicle.__table__, 'after_drop', DDL("DROP TABLE IF EXISTS vehicle_search").execute_if(dialect='sqlite'))
+    event.listen(Vehicle.__table__, 'after_drop', DDL("DROP TABLE IF EXISTS vehicle_search_keys").execute_if(dialect='sqlite'))
+
+    #counts writes to sold_vehicles, whoever makes them
+    for dialect_name, statements in SOLD_VERSION_DDL.items():
+        for statement in statements:
+            event.listen(Vehicle_sold.__table__, 'after_create', DDL(statement).execute_if(dialect=dialect_name))
+    event.listen(
+        Vehicle_sold.__table__, 'after_drop',
+        DDL("DROP FUNCTION IF EXISTS bump_sold_vehicles_version()").execute_if(dialect='postgresql')
+    )
+
+    #exposes the models to code running outside these routes (the asgi app, scripts, tests)
+    app.extensions['models'] = {
+        'Vehicle': Vehicle,
+        'Vehicle_sold': Vehicle_sold,
+        'Table_version': Table_version,
+        'Vehicle_stats': Vehicle_stats,
+        'Vehicle_change': Vehicle_change,
+    }
+
+    def table_version(*names):
+        '''returns the combined change counters of tables (read before the rows they describe)'''
+
+        return combine_versions(db.session.execute(table_version_query(Table_version, names)).all(), names)
+
+    def bump_version(name):
+        '''bumps a table's change counter inside the current transaction (and marks the request as a write)'''
+
+        g.wrote = True
+        if not db.session.execute(bump_version_statement(Table_version, name)).rowcount:
+            db.session.add(Table_version(name=name, version=1))
+
+    def update_stats(removed=(), added=()):
+        '''applies the statistics rows a write removed/added to the rollup table (same transaction)'''
+
+        deltas = stats_deltas(removed, added)
+        if deltas:
+            db.session.execute(stats_delta_statement(db.engine.dialect.name, Vehicle_stats, deltas))
+
+    def export_response(name, query, columns, watermark):
+        '''
+        Streams a query's rows as ?format=csv|ndjson|parquet from a server-side cursor, chunk by chunk
+        (csv/ndjson are compressed on the fly by compress_responses when the client accepts it)
+        '''
+        export_format = request.args.get('format', 'csv')
+        if export_format not in EXPORT_FORMATS:
+            return jsonify({"error": f"'format' must be one of {', '.join(EXPORT_FORMATS)}"}), 400
+        if export_format == 'parquet' and pyarrow is None:
+            return jsonify({"error": "parquet exports need the 'pyarrow' package installed"}), 501
+
+        chunk_size = app.config['VEHICLE_EXPORT_CHUNK_SIZE']
+        chunks = db.session.execute(query.execution_options(yield_per=chunk_size)).partitions()
+        fields = [column.key for column in columns]
+        datetime_columns = [index for index, column in enumerate(columns) if column.type.python_type is datetime]
+
+        if export_format == 'csv':
+            body = csv_chunks(chunks, fields, datetime_columns)
+        elif export_format == 'ndjson':
+            body = ndjson_chunks(chunks, fields, app.json.dumps_bytes, datetime_columns)
+        else:
+            body = parquet_chunks(chunks, columns)
+
+        headers = {
+            'Content-Disposition': f'attachment; filename="{name}.{export_format}"',
+            'X-Export-Watermark': watermark,
+        }
+        return Response(stream_with_context(body), 200, mimetype=EXPORT_FORMATS[export_format], headers=headers)
+
+    def index_search(*vins):
+        '''reindexes written vehicles in sqlite's search table (postgres indexes keep up on their own)'''
+
+        if vins and db.engine.dialect.name == 'sqlite':
+            for statement in search_index_statements():
+                db.session.execute(statement, {'vins': list(vins)})
+
+    def unindex_search(vin):
+        '''drops a vehicle about to be deleted (or renamed) from sqlite's search table'''
+
+        if db.engine.dialect.name == 'sqlite':
+            for statement in search_unindex_statements():
+                db.session.execute(statement, {'vins': [vin]})
+
+    def log_changes(*changes):
+        '''
+        Appends (vin, operation, version) changes to the change log, called after bump_version('vehicles'):
+        its row lock serializes vehicle writers, so change ids are handed out in commit order and a feed
+        reader never moves its cursor past a change that commits later
+        '''
+        db.session.execute(insert(Vehicle_change), change_log_rows(changes))
+
+    def overwrite_vehicle(vin, values, upsert, options=None):
+        '''
+        Overwrites a vehicle's columns (with upsert inserting it when missing), returning the statistics row
+        it moved away from (None after an insert) and the written vehicle (None when there was none to update)
+
+        Whether it inserted comes from the insert's RETURNING (ON CONFLICT DO NOTHING returns no row), not
+        from the read before it: a vin another request inserted in between is updated, with that request's
+        statistics row read (and locked) then
+        '''
+        options = options or {}
+        #the row the vehicle's statistics move away from (locked until commit)
+        old = db.session.execute(vehicle_stats_row_query(Vehicle, vin)).first()
+        if old is None and upsert:
+            vehicle = db.session.execute(
+                insert_vehicle_statement(db.engine.dialect.name, Vehicle, values), execution_options=options
+            ).scalar()
+            if vehicle is not None:
+                return None, vehicle
+            old = db.session.execute(vehicle_stats_row_query(Vehicle, vin)).first()
+        if old is None:
+            return None, None
+        return old, db.session.execute(update_vehicle_statement(Vehicle, vin, values), execution_options=options).scalar()
+
+    def flush_vehicle_writes(writes):
+        '''
+        Applies a batch of coalesced (operation, vin, values, upsert) writes in one transaction: the creates
+        as multi-row inserts, then the updates in queue order, with one stats, search index, version and
+        change log write for the lot
+
+        Returns each write's (json body, status), a duplicate vin or a missing vehicle fails only its own write
+        '''
+        results = [None] * len(writes)
+        removed, added, changes = [], [], []
+        #writes to the same vin share one identity map entry, refreshed by every statement
+        options = {'populate_existing': True}
+
+        creates = {}
+        for index, (operation, vin, values, upsert) in enumerate(writes):
+            if operation == 'create':
+                if vin in creates:
+                    results[index] = ({"error": "'vin' must be unique"}, 422)
+                else:
+                    creates[vin] = (index, values)
+
+        if creates:
+            inserted = {
+                vehicle.vin: vehicle.serialize()
+                for vehicle in db.session.scalars(
+                    insert_vehicles_statement(db.engine.dialect.name, Vehicle),
+                    [values for index, values in creates.values()], execution_options=options
+                )
+            }
+            for vin, (index, values) in creates.items():
+                if vin not in inserted:
+                    results[index] = ({"error": "'vin' must be unique"}, 422)
+                    continue
+                results[index] = (inserted[vin], 201)
+                added.append(stats_row(values))
+                changes.append((vin, 'insert', 1))
+
+        for index, (operation, vin, values, upsert) in enumerate(writes):
+            if operation != 'update':
+                continue
+
+            old, vehicle = overwrite_vehicle(vin, values, upsert, options)
+            if vehicle is None:
+                results[index] = ({"error":f"vehicle with vin '{vin}' not found"}, 404)
+                continue
+
+            created = old is None
+            results[index] = (vehicle.serialize(), 201 if created else 200)
+            if old is not None:
+                removed.append(old)
+            added.append(stats_row(vehicle))
+            changes.append((vin, 'insert' if created else 'update', vehicle.version))
+
+        if not changes:
+            db.session.rollback()
+            return results
+
+        written = list(dict.fromkeys(vin for vin, operation, version in changes))
+        update_stats(removed=removed, added=added)
+        index_search(*written)
+        bump_version('vehicles')
+        log_changes(*changes)
+        db.session.commit()
+        invalidate(*written)
+        return results
+
+    write_batcher = WriteBatcher(
+        flush_vehicle_writes, app.config['WRITE_COALESCING_MAX_ROWS'], app.config['WRITE_COALESCING_MAX_DELAY']
+    ) if app.config['WRITE_COALESCING'] else None
+    app.extensions['write_batcher'] = write_batcher
+
+    def coalesced_write(operation, vin, values, upsert=False):
+        '''queues a write for the next group commit, answering with its own result'''
+
+        body, status = write_batcher.submit((operation, vin, values, upsert))
+        if status < 300:
+            #the batch was committed on its leader's request, this one still pins its client to the primary
+            g.wrote = True
+        return jsonify(body), status
+
+    @app.cli.command('prune-vehicle-changes')
+    @click.option('--days', type=float, default=None, help='age of the oldest change kept (VEHICLE_CHANGES_RETENTION_DAYS by default)')
+    def prune_vehicle_changes(days):
+        '''drops old changes from the change log (feed cursors older than them get 410 Gone)'''
+
+        days = app.config['VEHICLE_CHANGES_RETENTION_DAYS'] if days is None else days
+        last_id = db.session.execute(changes_pruned_before(Vehicle_change, days)).scalar()
+        if last_id is None:
+            print("no changes to prune")
+            return
+
+        deleted = db.session.execute(prune_changes_statement(Vehicle_change, last_id)).rowcount
+        watermark = db.session.get(Table_version, 'vehicle_changes_pruned')
+        if watermark is None:
+            db.session.add(Table_version(name='vehicle_changes_pruned', version=last_id))
+        else:
+            watermark.version = last_id
+        db.session.commit()
+        print(f"pruned {deleted} vehicle changes (up to id {last_id})")
+
+    @app.cli.command('rebuild-vehicle-stats')
+    def rebuild_vehicle_stats():
+        '''recomputes the vehicle_stats rollup from the vehicles table'''
+
+        for statement in rebuild_stats_statements(Vehicle, Vehicle_stats):
+            db.session.execute(statement)
+        bump_version('vehicles')
+        db.session.commit()
+        print(f"rebuilt {db.session.query(Vehicle_stats).count()} vehicle_stats groups")
+
 
     @app.route('/')
     def hello() -> str:
         return 'Welcome to the vehicle rest-api!'
 
+    @app.route('/vehicle_cache', methods=['GET'])
+    def vehicle_cache_stats():
+        '''returns the vehicle cache's hit/miss/eviction counters'''
+
+        if cache is None:
+            return jsonify({"backend": None}), 200
+        return jsonify(cache.stats()), 200
+
+    @app.route('/metrics', methods=['GET'])
+    def prometheus_metrics():
+        '''returns request, query, pool and cache metrics in the prometheus text format'''
+
+        pool = pool_stats.snapshot(db.engine.pool)
+        cache_stats = cache.stats() if cache is not None else {}
+        replicas = app.extensions.get('replicas')
+        samples = {
+            'db_pool_checkouts_total': ('connections handed out by the pool', pool['checkouts']),
+            'db_pool_timeouts_total': ('checkouts that gave up after pool_timeout', pool['timeouts']),
+            'db_pool_wait_seconds_total': ('seconds spent waiting for connections', pool['total_wait_seconds']),
+            'db_pool_in_use': ('connections currently checked out', pool.get('in_use')),
+            'db_pool_overflow': ('connections open beyond pool_size', pool.get('overflow')),
+            'vehicle_cache_hits_total': ('single vehicle cache hits', cache_stats.get('hits')),
+            'vehicle_cache_misses_total': ('single vehicle cache misses', cache_stats.get('misses')),
+            'db_replicas_healthy': ('read replicas in rotation', len(replicas.healthy()) if replicas is not None else None),
+            'db_pool_recent_wait_seconds': ('recent checkout wait, decaying once checkouts stop waiting', pool['recent_wait_seconds']),
+            'write_batches_total': ('group commits of coalesced writes', write_batcher.batches if write_batcher is not None else None),
+            'write_batch_rows_total': ('writes flushed by group commits', write_batcher.items if write_batcher is not None else None),
+            'admission_in_flight': ('requests being served (every worker)', admission.in_flight.total() if admission is not None else None),
+            'admission_rate_limited_total': ('requests over their client rate limit', admission.rejected['rate_limited'] if admission is not None else None),
+            'admission_shed_total': ('requests shed under load', admission.rejected['shed'] if admission is not None else None),
+            'admission_route_limited_total': ('requests over their route concurrency limit', admission.rejected['route_limited'] if admission is not None else None),
+            'vehicle_changes_sse_streams': ('change feed sse streams open (this worker)', sse_streams['open']),
+        }
+        return Response(request_metrics.render(samples), 200, mimetype='text/plain; version=0.0.4')
+
+    @app.route('/db_pool', methods=['GET'])
+    def db_pool_stats():
+        '''returns the connection pool's checkout wait, in-use and overflow counters'''
+
+        return jsonify(pool_stats.snapshot(db.engine.pool)), 200
+
     @app.route('/vehicle_sold', methods=['GET'])
     def list_sold_vehicles():
         if request.method=='GET':
-            vehicles = Vehicle_sold.query.all()
-            vins = [vehicle['vin'] for vehicle in vehicles]
-            
-            vehicles_sold = []
-            for vin in vins:
-                vehicle = Vehicle.query.get(vin)
-                vehicles_sold.append(vehicle)
-            
-            vehicles_sold = [vehicle_sold.serialize() for vehicle_sold in vehicles_sold]
+            '''returns a page of sold vehicles (ordered by sale id) with their sale data'''
+
+            query, fields, limit, error = sold_list_query(
+                Vehicle, Vehicle_sold, request.args,
+                app.config['VEHICLE_PAGE_DEFAULT_LIMIT'],
+                app.config['VEHICLE_PAGE_MAX_LIMIT']
+            )
+            if error:
+                return jsonify({"error": error}), 400
+
+            #answers unchanged polls before any rows are read
+            etag = collection_etag(table_version('sold_vehicles', 'vehicles'), request.query_string)
+            if etag in request.if_none_match:
+                return not_modified(etag)
+
+            #single join instead of one vehicle lookup per sale, fetching one extra row to know
+            #whether there is a next page
+            rows = db.session.execute(query.limit(limit + 1)).all()
+            vehicles_sold, next_cursor = sold_page(rows, fields, limit, Vehicle_sold)
+
+            response = jsonify(vehicles_sold)
+            if next_cursor is not None:
+                args = request.args.to_dict()
+                args.update(limit=limit, after=next_cursor)
+                response.headers['Link'] = f'<{url_for("list_sold_vehicles", **args)}>; rel="next"'
+                response.headers['X-Next-Cursor'] = next_cursor
+            response.set_etag(etag)
+            return response, 200
+
+    @app.route('/vehicle_sold/export', methods=['GET'])
+    def export_sold_vehicles():
+        '''
+        streams every sale (or those written since ?since=<iso timestamp>) for warehouse syncs, watermarked
+        like /vehicle/export (runs overlap by VEHICLE_EXPORT_WATERMARK_LAG, so consumers must upsert by id)
+        '''
+        query, columns, watermark, error = sold_export_query(Vehicle, Vehicle_sold, request.args, app.config['VEHICLE_EXPORT_WATERMARK_LAG'])
+        if error:
+            return jsonify({"error": error}), 400
+        return export_response('vehicles_sold', query, columns, watermark)
 
-            return jsonify(vehicles_sold), 200
     @app.route('/vehicle', methods=['GET', 'POST'])
     def list_vehicles():
 
         if request.method=='GET':
-            '''returns all vehicles in a json format'''
+            '''returns a page of vehicles ordered by vin (or the whole table when streaming)'''
+
+            query, fields, limit, error = vehicle_list_query(
+                Vehicle, db.engine.dialect.name, request.args,
+                app.config['VEHICLE_PAGE_DEFAULT_LIMIT'],
+                app.config['VEHICLE_PAGE_MAX_LIMIT']
+            )
+            if error:
+                return jsonify({"error": error}), 400
+
+            #answers unchanged polls before any rows are read
+            etag = collection_etag(table_version('vehicles'), request.query_string)
+            if etag in request.if_none_match:
+                return not_modified(etag)
 
-            vehicles = Vehicle.query.all()
-            vehicles = [vehicle.serialize() for vehicle in vehicles]
-            return jsonify(vehicles), 200
+            stream = request.args.get('stream')
+            if stream is not None:
+                #pulls rows from a server-side cursor in chunks so memory stays flat
+                chunk_size = app.config['VEHICLE_STREAM_CHUNK_SIZE']
+                rows = db.session.execute(query.execution_options(yield_per=chunk_size))
+                vehicles = (dict(zip(fields, row)) for row in rows)
+
+                if stream == 'ndjson':
+                    body = stream_ndjson(vehicles, chunk_size, app.json.dumps_bytes)
+                    return Response(stream_with_context(body), 200, mimetype='application/x-ndjson', headers={'ETag': f'"{etag}"'})
+                elif stream == 'json':
+                    body = stream_json_array(vehicles, chunk_size, app.json.dumps_bytes)
+                    return Response(stream_with_context(body), 200, mimetype='application/json', headers={'ETag': f'"{etag}"'})
+                return jsonify({"error": "'stream' must be 'json' or 'ndjson'"}), 400
+
+            #fetches one extra row to know whether there is a next page
+            rows = db.session.execute(query.limit(limit + 1)).all()
+            vehicles, next_cursor = vehicle_page(rows, fields, limit)
+
+            response = jsonify(vehicles)
+            if next_cursor is not None:
+                args = request.args.to_dict()
+                args.update(limit=limit, after=next_cursor)
+                response.headers['Link'] = f'<{url_for("list_vehicles", **args)}>; rel="next"'
+                response.headers['X-Next-Cursor'] = next_cursor
+            response.set_etag(etag)
+            return response, 200
             
         elif request.method=='POST':
             '''creates a vehicle and validates it'''
@@ -136,26 +749,255 @@ def create_app(config_updates=None):
             vehicle_request = request.get_json()
             
             #check if vehicle is valid
-            vin, error = validate_vehicle_request(vehicle_request, Vehicle, False)
-            if error:
-                return error, 422
+            vin, errors = check_vehicle_fields(vehicle_request)
+            if errors:
+                return validation_error(errors), 422
+
+            if write_batcher is not None:
+                return coalesced_write('create', vin, vehicle_columns(vin, vehicle_request))
             
-            #creates vehicle, commits to database, and returns serialization
-            vehicle = Vehicle(
-                vin = vin,
-                manufacturer_name = vehicle_request.get('manufacturer_name'),
-                horse_power = vehicle_request.get('horse_power'),
-                model_name = vehicle_request.get('model_name'),
-                model_year = vehicle_request.get('model_year'),
-                purchase_price = round(vehicle_request.get('purchase_price'), 2),
-                fuel_type = vehicle_request.get('fuel_type'),
-                color = vehicle_request.get('color'),
-                category = vehicle_request.get('category')
-            )
+            #creates vehicle in one statement (the primary key enforces vin uniqueness)
+            vehicle = db.session.execute(
+                insert_vehicle_statement(db.engine.dialect.name, Vehicle, vehicle_columns(vin, vehicle_request))
+            ).scalar()
+            if vehicle is None:
+                db.session.rollback()
+                return jsonify({"error": "'vin' must be unique"}), 422
 
-            db.session.add(vehicle)
+            #serializes before committing so the commit doesn't expire (and reload) the vehicle
+            body = vehicle.serialize()
+            update_stats(added=[stats_row(vehicle)])
+            index_search(vin)
+            bump_version('vehicles')
+            log_changes((vin, 'insert', 1))
             db.session.commit()
-            return jsonify(vehicle.serialize()), 201
+            invalidate(vin)
+            return jsonify(body), 201
+
+    @app.route('/vehicle/export', methods=['GET'])
+    def export_vehicles():
+        '''
+        streams every vehicle (or those written since ?since=<iso timestamp>) for warehouse syncs, the next
+        run's ?since= comes back in X-Export-Watermark (runs overlap by VEHICLE_EXPORT_WATERMARK_LAG, so
+        consumers must upsert by vin)
+        '''
+        query, columns, watermark, error = vehicle_export_query(Vehicle, request.args, app.config['VEHICLE_EXPORT_WATERMARK_LAG'])
+        if error:
+            return jsonify({"error": error}), 400
+        return export_response('vehicles', query, columns, watermark)
+
+    @app.route('/vehicle/changes', methods=['GET'])
+    def vehicle_changes():
+        '''
+        Returns the vehicle writes after ?since=<change id>, oldest first, with the cursor to poll next in
+        X-Next-Cursor, or with ?stream=sse (or Accept: text/event-stream) streams them as they are committed
+
+        An sse stream holds a worker thread (not a database connection) between polls until
+        VEHICLE_CHANGES_SSE_TIMEOUT, so a worker serves at most VEHICLE_CHANGES_SSE_MAX_STREAMS of them and
+        answers more with 503 and a Link to the paged feed (admission control counts a stream as in flight
+        until it closes), the asgi app waits without a thread
+        '''
+        query, fields, since, limit, error = changes_query(
+            Vehicle_change, Vehicle, request.args,
+            app.config['VEHICLE_PAGE_DEFAULT_LIMIT'],
+            app.config['VEHICLE_PAGE_MAX_LIMIT'],
+            request.headers.get('Last-Event-ID')
+        )
+        if error:
+            return jsonify({"error": error}), 400
+
+        pruned = int(table_version('vehicle_changes_pruned'))
+        if since < pruned:
+            return jsonify({"error": f"changes up to {pruned} were pruned, resync from GET /vehicle"}), 410
+
+        if request.args.get('stream') == 'sse' or request.accept_mimetypes.best == 'text/event-stream':
+            poll_interval = app.config['VEHICLE_CHANGES_POLL_INTERVAL']
+            timeout = app.config['VEHICLE_CHANGES_SSE_TIMEOUT']
+
+            with sse_lock:
+                full = sse_streams['open'] >= app.config['VEHICLE_CHANGES_SSE_MAX_STREAMS']
+                if not full:
+                    sse_streams['open'] += 1
+            if full:
+                args = {key: value for key, value in request.args.items() if key != 'stream'}
+                args.update(since=since)
+                response = jsonify({"error": "too many change streams open, poll the paged feed instead"})
+                response.headers['Link'] = f'<{url_for("vehicle_changes", **args)}>; rel="alternate"'
+                response.headers['Retry-After'] = str(max(1, math.ceil(timeout)))
+                return response, 503
+
+            def close_stream():
+                with sse_lock:
+                    sse_streams['open'] -= 1
+
+            def events(since):
+                deadline = time.monotonic() + timeout
+                yield f'retry: {int(poll_interval * 1000)}\n\n'.encode()
+                while True:
+                    rows = db.session.execute(query.limit(limit), {'since': since}).all()
+                    #hands the connection back to the pool while waiting
+                    db.session.close()
+                    if rows:
+                        yield b''.join(sse_event(event, app.json.dumps_bytes) for event in change_events(rows, fields))
+                        since = rows[-1].id
+                        if len(rows) == limit:
+                            continue
+                    if time.monotonic() >= deadline:
+                        return
+                    #a comment line keeps proxies from timing out an idle stream
+                    yield b': keepalive\n\n'
+                    time.sleep(poll_interval)
+
+            response = Response(
+                stream_with_context(events(since)), 200, mimetype='text/event-stream',
+                headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+            )
+            #the server closes the response once the stream ends or the client goes away
+            response.call_on_close(close_stream)
+            return response
+
+        rows = db.session.execute(query.limit(limit + 1), {'since': since}).all()
+        changes = change_events(rows[:limit], fields)
+        next_cursor = str(changes[-1]['id']) if changes else str(since)
+
+        response = jsonify(changes)
+        response.headers['X-Next-Cursor'] = next_cursor
+        if len(rows) > limit:
+            args = request.args.to_dict()
+            args.update(limit=limit, since=next_cursor)
+            response.headers['Link'] = f'<{url_for("vehicle_changes", **args)}>; rel="next"'
+        return response, 200
+
+    @app.route('/vehicle/batch-get', methods=['POST'])
+    def batch_get_vehicles():
+        '''returns the vehicles of a json array of vins (in request order) and the vins that do not exist'''
+
+        vins, error = parse_vin_list(request.get_json(silent=True), app.config['VEHICLE_BATCH_GET_MAX_VINS'])
+        if error:
+            return jsonify({"error": error}), 400
+
+        fields, error = parse_fields(request.args, Vehicle.__table__.columns.keys(), Vehicle.serialized_columns)
+        if error:
+            return jsonify({"error": error}), 400
+
+        query = vehicle_batch_query(Vehicle, fields)
+        rows = []
+        for chunk in iter_batches(vins, app.config['VEHICLE_BATCH_GET_CHUNK_SIZE']):
+            rows.extend(db.session.execute(query, {'vins': chunk}))
+        return jsonify(vehicle_batch(rows, fields, vins)), 200
+
+    @app.route('/vehicle/search', methods=['GET'])
+    def search_vehicles():
+        '''returns the vehicles best matching ?q= by manufacturer, model, color or category'''
+
+        query, fields, error = search_query(Vehicle, db.engine.dialect.name, request.args, app.config['VEHICLE_SEARCH_MAX_LIMIT'])
+        if error:
+            return jsonify({"error": error}), 400
+
+        etag = collection_etag(table_version('vehicles'), request.query_string)
+        if etag in request.if_none_match:
+            return not_modified(etag)
+
+        response = jsonify([dict(zip(fields, row)) for row in db.session.execute(query)])
+        response.set_etag(etag)
+        return response, 200
+
+    @app.route('/vehicle/stats', methods=['GET'])
+    def vehicle_stats():
+        '''returns vehicle counts and average purchase prices per group, read from the rollup table'''
+
+        query, group_by, error = stats_query(Vehicle_stats, request.args)
+        if error:
+            return jsonify({"error": error}), 400
+
+        etag = collection_etag(table_version('vehicles'), request.query_string)
+        if etag in request.if_none_match:
+            return not_modified(etag)
+
+        response = jsonify(stats_page(db.session.execute(query).all(), group_by))
+        response.set_etag(etag)
+        return response, 200
+
+    @app.route('/vehicle/bulk', methods=['POST'])
+    def bulk_create_vehicles():
+        '''
+        Creates vehicles from a json array or a streamed ndjson body, chunk by chunk
+
+        Every chunk (VEHICLE_BULK_CHUNK_SIZE records) commits on its own: a database failure part way answers
+        500 with the vehicles already committed counted in 'inserted' (and the records rejected so far in
+        'errors'), so a retry only needs the records after them
+        '''
+        if request.mimetype == 'application/x-ndjson':
+            records = iter_ndjson(request.stream)
+        else:
+            vehicle_requests = request.get_json(silent=True)
+            if not isinstance(vehicle_requests, list):
+                return jsonify({"error": "request must be a json array or ndjson"}), 400
+            records = ((index, record, None) for index, record in enumerate(vehicle_requests))
+
+        inserted = 0
+        errors = []
+
+        def duplicate(vin):
+            index, record = candidates.pop(vin)
+            errors.append({"index": index, "vin": vin, "error": "'vin' must be unique", "errors": ["'vin' must be unique"]})
+
+        try:
+            for batch in iter_batches(records, app.config['VEHICLE_BULK_CHUNK_SIZE']):
+
+                #validates the batch without touching the database
+                candidates = {}
+                for index, record, error in batch:
+                    record_errors = [error] if error else None
+                    if not record_errors:
+                        vin, record_errors = check_vehicle_fields(record)
+                    if not record_errors and vin in candidates:
+                        record_errors = ["'vin' must be unique"]
+                    if record_errors:
+                        vin = record.get('vin') if isinstance(record, dict) else None
+                        errors.append({"index": index, "vin": vin, "error": record_errors[0], "errors": record_errors})
+                        continue
+                    candidates[vin] = (index, record)
+
+                #one set-based uniqueness check for the whole batch
+                existing = db.session.execute(
+                    db.select(Vehicle.vin).where(Vehicle.vin.in_(candidates))
+                ).scalars().all() if candidates else []
+                for vin in existing:
+                    duplicate(vin)
+
+                rows = [vehicle_columns(vin, record) for vin, (index, record) in candidates.items()]
+                if rows:
+                    try:
+                        #the fast path, in a savepoint: a vin another request wrote since the check fails it
+                        with db.session.begin_nested():
+                            bulk_insert_rows(db.session, Vehicle.__table__, rows)
+                    except IntegrityError:
+                        #reinserts skipping conflicts, the vins that don't come back are the racing duplicates
+                        written = set(db.session.scalars(insert_new_vins_statement(db.engine.dialect.name, Vehicle), rows))
+                        for vin in [vin for vin in candidates if vin not in written]:
+                            duplicate(vin)
+                        rows = [row for row in rows if row['vin'] in written]
+
+                if rows:
+                    update_stats(added=[stats_row(row) for row in rows])
+                    index_search(*candidates)
+                    bump_version('vehicles')
+                    log_changes(*[(vin, 'insert', 1) for vin in candidates])
+                db.session.commit()
+                invalidate(*candidates)
+                inserted += len(rows)
+        except SQLAlchemyError:
+            db.session.rollback()
+            app.logger.exception("bulk insert failed after %s vehicles", inserted)
+            errors.sort(key=lambda error: error['index'])
+            return jsonify({
+                "error": "bulk insert failed part way, only the vehicles counted in 'inserted' were committed",
+                "inserted": inserted, "errors": errors
+            }), 500
+
+        errors.sort(key=lambda error: error['index'])
+        return jsonify({"inserted": inserted, "errors": errors}), 200
 
     @app.route('/vehicle/<vin>', methods=['GET', 'PUT', 'DELETE', 'PATCH'])
     def select_vehicle(vin):
@@ -163,88 +1005,157 @@ def create_app(config_updates=None):
         if request.method=='GET':
             '''returns a specific vehicle'''
 
+            #sparse fieldsets select only the requested columns (and skip the full-vehicle cache)
+            if 'fields' in request.args:
+                fields, error = parse_fields(request.args, Vehicle.__table__.columns.keys(), Vehicle.serialized_columns)
+                if error:
+                    return jsonify({"error": error}), 400
+
+                row = db.session.execute(vehicle_fields_query(Vehicle, vin, fields)).first()
+                if row is None:
+                    return jsonify({"error":f"vehicle with vin '{vin}' not found"}), 404
+
+                etag = collection_etag(vehicle_etag(vin, row[0], row[1]), ','.join(fields).encode())
+                if etag in request.if_none_match:
+                    return not_modified(etag)
+                response = jsonify(dict(zip(fields, row[2:])))
+                response.set_etag(etag)
+                return response,200
+
+            #serves the serialized json straight from the cache when it is warm (clients pinned to the primary
+            #after a write skip it: another worker's copy may predate their write until its ttl runs out)
+            if cache is not None and not g.get('pinned'):
+                #entries are the etag and the body on separate lines (older "<version> <body>" ones have no body)
+                etag, _, body = (cache.get(vin) or b'').partition(b'\n')
+                if body:
+                    etag = etag.decode()
+                    if etag in request.if_none_match:
+                        return not_modified(etag)
+                    response = Response(body, 200, mimetype='application/json')
+                    response.set_etag(etag)
+                    return response
+
+            #answers unchanged polls from the etag columns alone
+            if request.if_none_match:
+                row = db.session.execute(db.select(Vehicle.version, Vehicle.updated_at).where(Vehicle.vin == vin)).first()
+                if row is not None and vehicle_etag(vin, *row) in request.if_none_match:
+                    return not_modified(vehicle_etag(vin, *row))
+
             vehicle = Vehicle.query.get(vin)
 
             if vehicle is None:
                 return jsonify({"error":f"vehicle with vin '{vin}' not found"}), 404
-            return jsonify(vehicle.serialize()),200
+
+            etag = vehicle_etag(vin, vehicle.version, vehicle.updated_at)
+            response = jsonify(vehicle.serialize())
+            response.set_etag(etag)
+            #only primary reads fill the cache, a lagging replica's row would outlive the writer's invalidate()
+            if cache is not None and g.get('read_engine') is None:
+                cache.set(vin, etag.encode() + b'\n' + response.get_data())
+            return response,200
 
         elif request.method=='PUT':
-            '''updates a specifc vehicle'''
+            '''updates a specifc vehicle (or creates it with ?upsert=true)'''
 
             vehicle_request = request.get_json()
 
-            vin, error = validate_vehicle_request(vehicle_request, Vehicle, True)
-            if error:
-                return error, 422
-            
-            vehicle = Vehicle.query.get(vin)
-            if not vehicle:
+            vin, errors = check_vehicle_fields(vehicle_request)
+            if errors:
+                return validation_error(errors), 422
+
+            values = vehicle_columns(vin, vehicle_request)
+            if write_batcher is not None:
+                return coalesced_write('update', vin, values, upsert=request.args.get('upsert') == 'true')
+
+            old, vehicle = overwrite_vehicle(vin, values, request.args.get('upsert') == 'true')
+            if vehicle is None:
+                db.session.rollback()
                 return jsonify({"error":f"vehicle with vin '{vin}' not found"}), 404
-                #or simply return 200 and add new entry based on how this put should be handled (clarify~)
-
-            vehicle.vin = vin
-            vehicle.manufacturer_name = vehicle_request.get('manufacturer_name')
-            vehicle.horse_power = vehicle_request.get('horse_power')
-            vehicle.model_name = vehicle_request.get('model_name')
-            vehicle.model_year = vehicle_request.get('model_year')
-            vehicle.purchase_price = round(vehicle_request.get('purchase_price'), 2)
-            vehicle.fuel_type = vehicle_request.get('fuel_type')
-            vehicle.color = vehicle_request.get('color')
-            vehicle.category = vehicle_request.get('category')
 
+            body = vehicle.serialize()
+            created = old is None
+            update_stats(removed=[old] if old is not None else [], added=[stats_row(vehicle)])
+            index_search(vin)
+            bump_version('vehicles')
+            log_changes((vin, 'insert' if created else 'update', vehicle.version))
             db.session.commit()
-            return jsonify(vehicle.serialize()),200
+            invalidate(vin)
+            return jsonify(body), 201 if created else 200
 
         elif request.method=='DELETE':
             '''deletes a specific vehicle'''
 
-            vehicle = Vehicle.query.get(vin)
+            unindex_search(vin)
+            try:
+                deleted = db.session.execute(delete_vehicle_statement(Vehicle, vin)).first()
+            except IntegrityError:
+                #the only foreign key on vehicles is the sales', which restricts deletes
+                db.session.rollback()
+                return jsonify({"error": f"vehicle with vin '{vin}' has been sold and cannot be deleted"}), 409
 
-            if vehicle is None:
+            if deleted is None:
+                db.session.rollback()
                 return jsonify({"error":f"vehicle with vin '{vin}' not found"}), 404
                 #or simply return 204 based on how this delete should be handled (clarify~)
             
-            db.session.delete(vehicle)
+            update_stats(removed=[deleted[1:]])
+            bump_version('vehicles')
+            log_changes((deleted[0], 'delete', None))
             db.session.commit()
+            invalidate(deleted[0])
 
             return jsonify({"message":f"deleted vehicle with vin: {vin}"}), 204
         
         elif request.method=='PATCH':
             '''updates specific attributes of a vehicle'''
-    
-            vehicle = Vehicle.query.get(vin)
-            if vehicle is None:
-                return jsonify({"error":f"vehicle with vin '{vin}' not found"}), 404
-                #or simply return 204 based on how this delete should be handled (clarify~)
 
-            #loops over and adds attributes from the request to the original vehicle serialization
-            payload = vehicle.serialize()
+            #validates only the attributes being changed
             vehicle_request = request.get_json()
-            potential_inputs = ["vin", "manufacturer_name", "horse_power", "model_name", "model_year", "purchase_price", "fuel_type", "color", "category"]
-            for input in potential_inputs:
-                if input in vehicle_request:
-                    payload[input] = vehicle_request[input]
+            new_vin, errors = check_vehicle_fields(vehicle_request, partial=True)
+            if errors:
+                return validation_error(errors), 422
 
-            #validates vehicle with updates
-            vin, error = validate_vehicle_request(payload, Vehicle, True)
-            if error:
-                return error, 422
-
-            #stores update if valid
-            vehicle.vin = vin
-            vehicle.manufacturer_name = payload['manufacturer_name']
-            vehicle.horse_power = payload['horse_power']
-            vehicle.model_name = payload['model_name']
-            vehicle.model_year = payload['model_year']
-            vehicle.purchase_price = round(payload['purchase_price'], 2)
-            vehicle.fuel_type = payload['fuel_type']
-            vehicle.color = payload['color']
-            vehicle.category = payload['category']
+            #the row the vehicle's statistics move away from (locked until commit)
+            old = db.session.execute(vehicle_stats_row_query(Vehicle, vin)).first()
+            if old is None:
+                db.session.rollback()
+                return jsonify({"error":f"vehicle with vin '{vin}' not found"}), 404
+                #or simply return 204 based on how this delete should be handled (clarify~)
 
+            #stores update in one statement
+            try:
+                vehicle = db.session.execute(
+                    update_vehicle_statement(Vehicle, vin, patch_values(vehicle_request, new_vin))
+                ).scalar()
+            except IntegrityError:
+                db.session.rollback()
+                return jsonify({"error": "'vin' must be unique"}), 422
+
+            body = vehicle.serialize()
+            update_stats(removed=[old], added=[stats_row(vehicle)])
+            if body['vin'] != vin:
+                unindex_search(vin)
+            index_search(body['vin'])
+            bump_version('vehicles')
+            if body['vin'] != vin:
+                #a new vin is a new row for mirrors keyed by vin
+                log_changes((vin, 'delete', None), (body['vin'], 'insert', vehicle.version))
+            else:
+                log_changes((vin, 'update', vehicle.version))
             db.session.commit()
-            return jsonify(vehicle.serialize()),200
+            invalidate(vin, body['vin'])
+            return jsonify(body),200
+
+    if app.config['REPLICA_DATABASE_URIS']:
+        with app.app_context():
+            replicas = ReplicaSet(
+                [db.engines[key] for key in replica_binds(app.config)],
+                app.config['REPLICA_POLICY'], app.config['REPLICA_RETRY_SECONDS']
+            )
+        app.extensions['replicas'] = replicas
+        route_reads(app, replicas, ['list_vehicles', 'select_vehicle', 'list_sold_vehicles'])
 
-    return app, db, migrate
+    if app.config['PROFILE_DIR']:
+        profile_views(app)
 
-app, db, migrate = create_app()
\ No newline at end of file
+    return app
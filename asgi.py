@@ -0,0 +1,638 @@
+'''
+Asyncio (ASGI) variant of the vehicle routes, serve with gunicorn's uvicorn worker (SERVER_MODE=asgi, see gunicorn.conf.py)
+
+Requests await the database instead of holding a worker, so one process keeps many queries in flight.
+The models, config, validation, sql and json encoding all come from the flask app (app.py/queries.py),
+only the session handling is async. Some of the flask app is not ported yet (serve it, SERVER_MODE=wsgi,
+where these matter):
+    POST /vehicle/bulk, GET /vehicle/export and GET /vehicle_sold/export answer 501
+    GET /vehicle_cache and GET /db_pool answer 501
+    the single vehicle cache (every GET reads the database)
+    admission control (ADMISSION_*), nothing is rate limited or shed
+    write coalescing (WRITE_COALESCING*), every write commits on its own
+    the flask cli commands (run them with flask --app app)
+'''
+import asyncio
+import logging
+import os
+import time
+from contextlib import asynccontextmanager
+from urllib.parse import urlencode
+
+from sqlalchemy import exc, insert, select, text
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.pool import StaticPool
+from starlette.applications import Starlette
+from starlette.middleware import Middleware
+from starlette.responses import Response, StreamingResponse
+from starlette.routing import Route
+from werkzeug.http import parse_etags
+
+from app import create_app
+from content_encoding import CompressionMiddleware
+from helper import (
+    check_vehicle_fields, collection_etag, vehicle_etag, iter_batches, parse_fields, parse_vin_list, sse_event, vehicle_columns
+)
+from metrics import begin_request, count_queries, request_queries
+from pool import enforce_foreign_keys
+from replicas import PIN_HEADER, ReplicaSet, pin_cookie, request_pinned
+from queries import (
+    vehicle_list_query, vehicle_page, vehicle_batch_query, vehicle_batch, sold_list_query, sold_page, vehicle_fields_query,
+    table_version_query, combine_versions, bump_version_statement, insert_vehicle_statement,
+    update_vehicle_statement, delete_vehicle_statement, patch_values,
+    stats_row, vehicle_stats_row_query, stats_deltas, stats_delta_statement, stats_query, stats_page,
+    search_query, search_index_statements, search_unindex_statements, change_log_rows, changes_query, change_events
+)
+
+logger = logging.getLogger(__name__)
+
+#sync drivers and the async drivers that replace them
+ASYNC_DRIVERS = {
+    'postgresql': 'postgresql+asyncpg',
+    'postgresql+psycopg2': 'postgresql+asyncpg',
+    'sqlite': 'sqlite+aiosqlite',
+}
+
+
+def async_database_uri(uri):
+    '''
+    Swaps a database uri's sync driver for its async counterpart (uris already naming an async driver are kept)
+    '''
+    scheme, separator, rest = uri.partition('://')
+    return ASYNC_DRIVERS.get(scheme, scheme) + separator + rest
+
+
+def async_engine_options(config, uri):
+    '''
+    Builds create_async_engine options from an app's pool settings (mirrors pool.engine_options)
+    '''
+    if uri.startswith('sqlite'):
+        if ':memory:' in uri or uri.endswith('://'):
+            #every connection to an in-memory database is a new database, so share one
+            return {'poolclass': StaticPool, 'connect_args': {'check_same_thread': False}}
+        return {}
+
+    options = {
+        'pool_size': config['DB_POOL_SIZE'],
+        'max_overflow': config['DB_MAX_OVERFLOW'],
+        'pool_timeout': config['DB_POOL_TIMEOUT'],
+        'pool_recycle': config['DB_POOL_RECYCLE'],
+        'pool_pre_ping': config['DB_POOL_PRE_PING'],
+    }
+    if uri.startswith('postgresql+asyncpg'):
+        options['connect_args'] = {'timeout': config['DB_CONNECT_TIMEOUT']}
+    return options
+
+
+class MetricsMiddleware:
+    '''
+    Records every request in the flask app's RequestMetrics (the asgi twin of its before/after request hooks)
+    '''
+
+    def __init__(self, app, metrics, query_header=False):
+        self.app = app
+        self.metrics = metrics
+        self.query_header = query_header
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            return await self.app(scope, receive, send)
+
+        start = time.perf_counter()
+        counters = begin_request()
+        response = {'status': 500, 'size': None}
+
+        async def send_with_metrics(message):
+            if message['type'] == 'http.response.start':
+                response['status'] = message['status']
+                headers = dict(message.get('headers', []))
+                if b'content-length' in headers:
+                    response['size'] = int(headers[b'content-length'])
+                if self.query_header:
+                    message['headers'] = [
+                        *message.get('headers', []),
+                        (b'x-query-count', str(counters[0]).encode()),
+                        (b'x-db-time', f'{counters[1] * 1e3:.3f}ms'.encode()),
+                    ]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_metrics)
+        finally:
+            route = scope.get('route')
+            self.metrics.record(
+                scope['method'], route.path if route is not None else 'unmatched', response['status'],
+                time.perf_counter() - start, counters[0], counters[1], response['size']
+            )
+            request_queries.set(None)
+
+
+def create_asgi_app(config_updates=None):
+    '''
+    creates the asgi app, configured exactly like create_app (same config_updates, same environment)
+
+    set ASYNC_DATABASE_URI to pick the async driver yourself, otherwise SQLALCHEMY_DATABASE_URI's
+    sync driver is swapped for asyncpg/aiosqlite
+    '''
+
+    flask_app = create_app(config_updates)
+    config = flask_app.config
+    models = flask_app.extensions['models']
+    Vehicle = models['Vehicle']
+    Vehicle_sold = models['Vehicle_sold']
+    Table_version = models['Table_version']
+    Vehicle_stats = models['Vehicle_stats']
+    Vehicle_change = models['Vehicle_change']
+    dumps_bytes = flask_app.json.dumps_bytes
+
+    uri = config.get('ASYNC_DATABASE_URI') or os.getenv('ASYNC_DATABASE_URI') or async_database_uri(config['SQLALCHEMY_DATABASE_URI'])
+    engine = create_async_engine(uri, **async_engine_options(config, uri))
+    #rows are serialized after commit, so keep them loaded instead of expiring them
+    Session = async_sessionmaker(engine, expire_on_commit=False)
+    count_queries(engine.sync_engine)
+    enforce_foreign_keys(engine.sync_engine)
+
+    replica_engines = []
+    for replica_uri in config['REPLICA_DATABASE_URIS']:
+        replica_uri = async_database_uri(replica_uri)
+        replica_engines.append(create_async_engine(replica_uri, **async_engine_options(config, replica_uri)))
+        count_queries(replica_engines[-1].sync_engine)
+    replicas = ReplicaSet(replica_engines, config['REPLICA_POLICY'], config['REPLICA_RETRY_SECONDS']) if replica_engines else None
+
+    def json_response(obj, status=200, headers=None):
+        '''encodes like the flask app's jsonify (same provider, same bytes)'''
+        return Response(dumps_bytes(obj) + b"\n", status, headers=headers, media_type='application/json')
+
+    def error_response(message, status):
+        return json_response({"error": message}, status)
+
+    def not_modified(etag):
+        return Response(status_code=304, headers={'ETag': f'"{etag}"'})
+
+    def matches(request, etag):
+        '''whether the request's If-None-Match already holds an etag'''
+        return etag in parse_etags(request.headers.get('if-none-match'))
+
+    async def read_json(request):
+        try:
+            return await request.json()
+        except ValueError:
+            return None
+
+    async def table_version(session, *names):
+        '''returns the combined change counters of tables (read before the rows they describe)'''
+
+        return combine_versions((await session.execute(table_version_query(Table_version, names))).all(), names)
+
+    async def bump_version(session, name):
+        '''bumps a table's change counter inside the current transaction'''
+
+        if not (await session.execute(bump_version_statement(Table_version, name))).rowcount:
+            session.add(Table_version(name=name, version=1))
+
+    async def update_stats(session, removed=(), added=()):
+        '''applies the statistics rows a write removed/added to the rollup table (same transaction)'''
+
+        deltas = stats_deltas(removed, added)
+        if deltas:
+            await session.execute(stats_delta_statement(engine.dialect.name, Vehicle_stats, deltas))
+
+    async def index_search(session, *vins):
+        '''reindexes written vehicles in sqlite's search table (postgres indexes keep up on their own)'''
+
+        if vins and engine.dialect.name == 'sqlite':
+            for statement in search_index_statements():
+                await session.execute(statement, {'vins': list(vins)})
+
+    async def unindex_search(session, vin):
+        '''drops a vehicle about to be deleted (or renamed) from sqlite's search table'''
+
+        if engine.dialect.name == 'sqlite':
+            for statement in search_unindex_statements():
+                await session.execute(statement, {'vins': [vin]})
+
+    async def log_changes(session, *changes):
+        '''appends (vin, operation, version) changes to the change log, after bump_version (see the flask app)'''
+
+        await session.execute(insert(Vehicle_change), change_log_rows(changes))
+
+    def read_session(request):
+        '''opens the session a GET reads with, on the replica routed() picked for it (or the primary)'''
+
+        read_engine = getattr(request.state, 'read_engine', None)
+        return Session(bind=read_engine) if read_engine is not None else Session()
+
+    def routed(handler):
+        '''
+        Sends a handler's GET requests to a replica (unless the client is pinned) and pins clients that
+        wrote to the primary for REPLICA_PIN_SECONDS, like the flask app's route_reads
+        '''
+        async def wrapper(request):
+            if request.method != 'GET':
+                response = await handler(request)
+                if replicas is not None and response.status_code < 400:
+                    cookie = pin_cookie(config['REPLICA_PIN_SECONDS'])
+                    response.set_cookie(**cookie)
+                    response.headers[PIN_HEADER] = cookie['value']
+                return response
+
+            read_engine = replicas.choose() if replicas is not None and not request_pinned(request.cookies, request.headers) else None
+            if read_engine is None:
+                return await handler(request)
+
+            request.state.read_engine = read_engine
+            try:
+                return await handler(request)
+            except exc.OperationalError as error:
+                replicas.mark_down(read_engine, error)
+                request.state.read_engine = None
+                return await handler(request)
+        return wrapper
+
+    def next_page_headers(request, limit, next_cursor):
+        args = dict(request.query_params)
+        args.update(limit=limit, after=next_cursor)
+        return {'Link': f'<{request.url.path}?{urlencode(args)}>; rel="next"', 'X-Next-Cursor': next_cursor}
+
+    async def stream_rows(request, query, fields, stream, chunk_size):
+        '''yields the query's rows as a json array or ndjson, one partition of chunk_size rows per write'''
+
+        async with read_session(request) as session:
+            result = await session.stream(query.execution_options(yield_per=chunk_size))
+            first = True
+            if stream == 'json':
+                yield b'['
+            async for rows in result.partitions(chunk_size):
+                encoded = [dumps_bytes(dict(zip(fields, row))) for row in rows]
+                if stream == 'json':
+                    yield (b'' if first else b',') + b','.join(encoded)
+                else:
+                    yield b'\n'.join(encoded) + b'\n'
+                first = False
+            if stream == 'json':
+                yield b']\n'
+
+    async def prometheus_metrics(request):
+        '''returns the request and query metrics in the prometheus text format'''
+
+        body = flask_app.extensions['request_metrics'].render()
+        return Response(body, 200, media_type='text/plain; version=0.0.4')
+
+    async def hello(request):
+        return Response("Welcome to the vehicle rest-api!", media_type="text/html")
+
+    async def not_implemented(request):
+        '''answers the flask app's routes this app has no port of (see the module docstring)'''
+
+        return error_response(f"{request.url.path} is only served by the flask app (SERVER_MODE=wsgi)", 501)
+
+    async def list_sold_vehicles(request):
+        '''returns a page of sold vehicles (ordered by sale id) with their sale data'''
+
+        query, fields, limit, error = sold_list_query(
+            Vehicle, Vehicle_sold, request.query_params,
+            config['VEHICLE_PAGE_DEFAULT_LIMIT'],
+            config['VEHICLE_PAGE_MAX_LIMIT']
+        )
+        if error:
+            return error_response(error, 400)
+
+        async with read_session(request) as session:
+            etag = collection_etag(await table_version(session, 'sold_vehicles', 'vehicles'), request.url.query.encode())
+            if matches(request, etag):
+                return not_modified(etag)
+
+            rows = (await session.execute(query.limit(limit + 1))).all()
+
+        vehicles_sold, next_cursor = sold_page(rows, fields, limit, Vehicle_sold)
+        headers = {'ETag': f'"{etag}"'}
+        if next_cursor is not None:
+            headers.update(next_page_headers(request, limit, next_cursor))
+        return json_response(vehicles_sold, 200, headers)
+
+    async def list_vehicles(request):
+
+        if request.method=='GET':
+            '''returns a page of vehicles ordered by vin (or the whole table when streaming)'''
+
+            query, fields, limit, error = vehicle_list_query(
+                Vehicle, engine.dialect.name, request.query_params,
+                config['VEHICLE_PAGE_DEFAULT_LIMIT'],
+                config['VEHICLE_PAGE_MAX_LIMIT']
+            )
+            if error:
+                return error_response(error, 400)
+
+            async with read_session(request) as session:
+                etag = collection_etag(await table_version(session, 'vehicles'), request.url.query.encode())
+                if matches(request, etag):
+                    return not_modified(etag)
+
+                stream = request.query_params.get('stream')
+                if stream is not None:
+                    if stream not in ('json', 'ndjson'):
+                        return error_response("'stream' must be 'json' or 'ndjson'", 400)
+                    media_type = 'application/json' if stream == 'json' else 'application/x-ndjson'
+                    body = stream_rows(request, query, fields, stream, config['VEHICLE_STREAM_CHUNK_SIZE'])
+                    return StreamingResponse(body, 200, headers={'ETag': f'"{etag}"'}, media_type=media_type)
+
+                rows = (await session.execute(query.limit(limit + 1))).all()
+
+            vehicles, next_cursor = vehicle_page(rows, fields, limit)
+            headers = {'ETag': f'"{etag}"'}
+            if next_cursor is not None:
+                headers.update(next_page_headers(request, limit, next_cursor))
+            return json_response(vehicles, 200, headers)
+
+        elif request.method=='POST':
+            '''creates a vehicle and validates it'''
+
+            vehicle_request = await read_json(request)
+            vin, errors = check_vehicle_fields(vehicle_request)
+            if errors:
+                return json_response({"error": errors[0], "errors": errors}, 422)
+
+            async with Session() as session:
+                vehicle = (await session.execute(
+                    insert_vehicle_statement(engine.dialect.name, Vehicle, vehicle_columns(vin, vehicle_request))
+                )).scalar()
+                if vehicle is None:
+                    await session.rollback()
+                    return error_response("'vin' must be unique", 422)
+
+                await update_stats(session, added=[stats_row(vehicle)])
+                await index_search(session, vin)
+                await bump_version(session, 'vehicles')
+                await log_changes(session, (vin, 'insert', 1))
+                await session.commit()
+            return json_response(vehicle.serialize(), 201)
+
+    async def vehicle_changes(request):
+        '''returns (or with ?stream=sse streams) the vehicle writes after ?since=<change id>, like the flask route'''
+
+        query, fields, since, limit, error = changes_query(
+            Vehicle_change, Vehicle, request.query_params,
+            config['VEHICLE_PAGE_DEFAULT_LIMIT'],
+            config['VEHICLE_PAGE_MAX_LIMIT'],
+            request.headers.get('last-event-id')
+        )
+        if error:
+            return error_response(error, 400)
+
+        async with Session() as session:
+            pruned = int(await table_version(session, 'vehicle_changes_pruned'))
+            if since < pruned:
+                return error_response(f"changes up to {pruned} were pruned, resync from GET /vehicle", 410)
+
+            if request.query_params.get('stream') != 'sse' and 'text/event-stream' not in request.headers.get('accept', ''):
+                rows = (await session.execute(query.limit(limit + 1), {'since': since})).all()
+                changes = change_events(rows[:limit], fields)
+                next_cursor = str(changes[-1]['id']) if changes else str(since)
+                headers = {'X-Next-Cursor': next_cursor}
+                if len(rows) > limit:
+                    args = dict(request.query_params)
+                    args.update(limit=limit, since=next_cursor)
+                    headers['Link'] = f'<{request.url.path}?{urlencode(args)}>; rel="next"'
+                return json_response(changes, 200, headers)
+
+        poll_interval = config['VEHICLE_CHANGES_POLL_INTERVAL']
+        timeout = config['VEHICLE_CHANGES_SSE_TIMEOUT']
+
+        async def events(since):
+            deadline = time.monotonic() + timeout
+            yield f'retry: {int(poll_interval * 1000)}\n\n'.encode()
+            while True:
+                async with Session() as session:
+                    rows = (await session.execute(query.limit(limit), {'since': since})).all()
+                if rows:
+                    yield b''.join(sse_event(event, dumps_bytes) for event in change_events(rows, fields))
+                    since = rows[-1].id
+                    if len(rows) == limit:
+                        continue
+                if time.monotonic() >= deadline:
+                    return
+                yield b': keepalive\n\n'
+                await asyncio.sleep(poll_interval)
+
+        return StreamingResponse(
+            events(since), 200, media_type='text/event-stream',
+            headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+        )
+
+    async def batch_get_vehicles(request):
+        '''returns the vehicles of a json array of vins (in request order) and the vins that do not exist'''
+
+        vins, error = parse_vin_list(await read_json(request), config['VEHICLE_BATCH_GET_MAX_VINS'])
+        if error:
+            return error_response(error, 400)
+
+        fields, error = parse_fields(request.query_params, Vehicle.__table__.columns.keys(), Vehicle.serialized_columns)
+        if error:
+            return error_response(error, 400)
+
+        query = vehicle_batch_query(Vehicle, fields)
+        rows = []
+        async with Session() as session:
+            for chunk in iter_batches(vins, config['VEHICLE_BATCH_GET_CHUNK_SIZE']):
+                rows.extend(await session.execute(query, {'vins': chunk}))
+        return json_response(vehicle_batch(rows, fields, vins), 200)
+
+    async def search_vehicles(request):
+        '''returns the vehicles best matching ?q= by manufacturer, model, color or category'''
+
+        query, fields, error = search_query(Vehicle, engine.dialect.name, request.query_params, config['VEHICLE_SEARCH_MAX_LIMIT'])
+        if error:
+            return error_response(error, 400)
+
+        async with Session() as session:
+            etag = collection_etag(await table_version(session, 'vehicles'), request.url.query.encode())
+            if matches(request, etag):
+                return not_modified(etag)
+            rows = (await session.execute(query)).all()
+
+        return json_response([dict(zip(fields, row)) for row in rows], 200, {'ETag': f'"{etag}"'})
+
+    async def vehicle_stats(request):
+        '''returns vehicle counts and average purchase prices per group, read from the rollup table'''
+
+        query, group_by, error = stats_query(Vehicle_stats, request.query_params)
+        if error:
+            return error_response(error, 400)
+
+        async with Session() as session:
+            etag = collection_etag(await table_version(session, 'vehicles'), request.url.query.encode())
+            if matches(request, etag):
+                return not_modified(etag)
+            rows = (await session.execute(query)).all()
+
+        return json_response(stats_page(rows, group_by), 200, {'ETag': f'"{etag}"'})
+
+    async def select_vehicle(request):
+        vin = request.path_params['vin']
+
+        if request.method=='GET':
+            '''returns a specific vehicle'''
+
+            async with read_session(request) as session:
+                if 'fields' in request.query_params:
+                    fields, error = parse_fields(request.query_params, Vehicle.__table__.columns.keys(), Vehicle.serialized_columns)
+                    if error:
+                        return error_response(error, 400)
+                    row = (await session.execute(vehicle_fields_query(Vehicle, vin, fields))).first()
+                    if row is None:
+                        return error_response(f"vehicle with vin '{vin}' not found", 404)
+
+                    etag = collection_etag(vehicle_etag(vin, row[0], row[1]), ','.join(fields).encode())
+                    if matches(request, etag):
+                        return not_modified(etag)
+                    return json_response(dict(zip(fields, row[2:])), 200, {'ETag': f'"{etag}"'})
+
+                #answers unchanged polls from the etag columns alone
+                if request.headers.get('if-none-match'):
+                    row = (await session.execute(select(Vehicle.version, Vehicle.updated_at).where(Vehicle.vin == vin))).first()
+                    if row is not None and matches(request, vehicle_etag(vin, *row)):
+                        return not_modified(vehicle_etag(vin, *row))
+
+                vehicle = await session.get(Vehicle, vin)
+
+            if vehicle is None:
+                return error_response(f"vehicle with vin '{vin}' not found", 404)
+            return json_response(vehicle.serialize(), 200, {'ETag': f'"{vehicle_etag(vin, vehicle.version, vehicle.updated_at)}"'})
+
+        elif request.method=='PUT':
+            '''updates a specifc vehicle (or creates it with ?upsert=true)'''
+
+            vehicle_request = await read_json(request)
+            vin, errors = check_vehicle_fields(vehicle_request)
+            if errors:
+                return json_response({"error": errors[0], "errors": errors}, 422)
+
+            values = vehicle_columns(vin, vehicle_request)
+            async with Session() as session:
+                #an upsert inserts unless its RETURNING comes back empty, then updates (see the flask app)
+                old = (await session.execute(vehicle_stats_row_query(Vehicle, vin))).first()
+                vehicle = None
+                if old is None and request.query_params.get('upsert') == 'true':
+                    vehicle = (await session.execute(insert_vehicle_statement(engine.dialect.name, Vehicle, values))).scalar()
+                    if vehicle is None:
+                        old = (await session.execute(vehicle_stats_row_query(Vehicle, vin))).first()
+                if vehicle is None:
+                    if old is None:
+                        await session.rollback()
+                        return error_response(f"vehicle with vin '{vin}' not found", 404)
+                    vehicle = (await session.execute(update_vehicle_statement(Vehicle, vin, values))).scalar()
+
+                created = old is None
+                await update_stats(session, removed=[] if created else [old], added=[stats_row(vehicle)])
+                await index_search(session, vin)
+                await bump_version(session, 'vehicles')
+                await log_changes(session, (vin, 'insert' if created else 'update', vehicle.version))
+                await session.commit()
+            return json_response(vehicle.serialize(), 201 if created else 200)
+
+        elif request.method=='DELETE':
+            '''deletes a specific vehicle'''
+
+            async with Session() as session:
+                await unindex_search(session, vin)
+                try:
+                    deleted = (await session.execute(delete_vehicle_statement(Vehicle, vin))).first()
+                except exc.IntegrityError:
+                    await session.rollback()
+                    return error_response(f"vehicle with vin '{vin}' has been sold and cannot be deleted", 409)
+                if deleted is None:
+                    await session.rollback()
+                    return error_response(f"vehicle with vin '{vin}' not found", 404)
+
+                await update_stats(session, removed=[deleted[1:]])
+                await bump_version(session, 'vehicles')
+                await log_changes(session, (deleted[0], 'delete', None))
+                await session.commit()
+            return Response(status_code=204)
+
+        elif request.method=='PATCH':
+            '''updates specific attributes of a vehicle'''
+
+            vehicle_request = await read_json(request)
+            new_vin, errors = check_vehicle_fields(vehicle_request, partial=True)
+            if errors:
+                return json_response({"error": errors[0], "errors": errors}, 422)
+
+            async with Session() as session:
+                old = (await session.execute(vehicle_stats_row_query(Vehicle, vin))).first()
+                if old is None:
+                    await session.rollback()
+                    return error_response(f"vehicle with vin '{vin}' not found", 404)
+
+                try:
+                    vehicle = (await session.execute(
+                        update_vehicle_statement(Vehicle, vin, patch_values(vehicle_request, new_vin))
+                    )).scalar()
+                except exc.IntegrityError:
+                    await session.rollback()
+                    return error_response("'vin' must be unique", 422)
+
+                await update_stats(session, removed=[old], added=[stats_row(vehicle)])
+                if vehicle.vin != vin:
+                    await unindex_search(session, vin)
+                await index_search(session, vehicle.vin)
+                await bump_version(session, 'vehicles')
+                if vehicle.vin != vin:
+                    await log_changes(session, (vin, 'delete', None), (vehicle.vin, 'insert', vehicle.version))
+                else:
+                    await log_changes(session, (vin, 'update', vehicle.version))
+                await session.commit()
+            return json_response(vehicle.serialize(), 200)
+
+    @asynccontextmanager
+    async def lifespan(app):
+        #opens DB_POOL_WARM connections per worker up front, then closes the pool on shutdown
+        if config['DB_POOL_WARM']:
+            connections = []
+            try:
+                for _ in range(config['DB_POOL_WARM']):
+                    connection = await engine.connect()
+                    connections.append(connection)
+                    await connection.execute(text('SELECT 1'))
+            except exc.SQLAlchemyError as error:
+                logger.warning("could not warm the connection pool: %s", error)
+            finally:
+                for connection in connections:
+                    await connection.close()
+        yield
+        await engine.dispose()
+        for replica_engine in replica_engines:
+            await replica_engine.dispose()
+
+    app = Starlette(
+        routes=[
+            Route('/', hello),
+            Route('/metrics', prometheus_metrics, methods=['GET']),
+            Route('/vehicle_sold', routed(list_sold_vehicles), methods=['GET']),
+            Route('/vehicle_sold/export', not_implemented, methods=['GET']),
+            Route('/vehicle_cache', not_implemented, methods=['GET']),
+            Route('/db_pool', not_implemented, methods=['GET']),
+            Route('/vehicle', routed(list_vehicles), methods=['GET', 'POST']),
+            Route('/vehicle/stats', vehicle_stats, methods=['GET']),
+            Route('/vehicle/search', search_vehicles, methods=['GET']),
+            Route('/vehicle/batch-get', batch_get_vehicles, methods=['POST']),
+            Route('/vehicle/changes', vehicle_changes, methods=['GET']),
+            #ahead of /vehicle/{vin}, which would take them for vins
+            Route('/vehicle/bulk', not_implemented, methods=['POST']),
+            Route('/vehicle/export', not_implemented, methods=['GET']),
+            Route('/vehicle/{vin}', routed(select_vehicle), methods=['GET', 'PUT', 'DELETE', 'PATCH']),
+        ],
+        lifespan=lifespan,
+        middleware=[
+            Middleware(MetricsMiddleware, metrics=flask_app.extensions['request_metrics'], query_header=config['METRICS_QUERY_HEADER']),
+            #inside the metrics middleware so recorded sizes are the compressed ones
+            Middleware(
+                CompressionMiddleware, encodings=config['COMPRESSION_ENCODINGS'],
+                min_size=config['COMPRESSION_MIN_SIZE'], levels=config['COMPRESSION_LEVELS']
+            ),
+        ],
+    )
+    app.state.flask_app = flask_app
+    app.state.engine = engine
+    app.state.replicas = replicas
+    return app
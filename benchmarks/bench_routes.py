@@ -0,0 +1,267 @@
+'''
+Load tests every vehicle route and checks the results against a stored baseline
+(run from the repo root: python -m benchmarks.bench_routes --rows 1000 100000 --database sqlite postgresql+psycopg2://localhost/bench)
+
+Each dataset is seeded into a fresh database through create_app (like tests/conftest.py), then every
+route is hit by --concurrency threads and its p50/p95/p99 latency and throughput are reported.
+Seeding drops every table first, so databases other than 'sqlite' (a temporary file) or a sqlite uri under
+the temporary directory are refused unless --i-know-this-drops-tables is passed.
+--save-baseline stores the results, later runs exit with 1 when a route's p95 latency grows (or its
+throughput drops) by more than --threshold percent of the baseline.
+'''
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from app import create_app
+from helper import bulk_insert_rows
+
+
+BASELINE = os.path.join(os.path.dirname(__file__), 'baseline.json')
+
+#vin characters (never I, O or Q) and their check digit values
+VIN_VALUES = {
+    **{str(digit): digit for digit in range(10)},
+    **dict(zip('ABCDEFGH', range(1, 9))),
+    **dict(zip('JKLMN', range(1, 6))), 'P': 7, 'R': 9,
+    **dict(zip('STUVWXYZ', range(2, 10))),
+}
+VIN_CHARACTERS = ''.join(VIN_VALUES)
+VIN_WEIGHTS = [8, 7, 6, 5, 4, 3, 2, 10, 0, 9, 8, 7, 6, 5, 4, 3, 2]
+
+MANUFACTURERS = {
+    'Honda': ['Accord', 'Civic'],
+    'Toyota': ['Camry', 'Corolla'],
+    'Ford': ['F-150', 'Focus'],
+    'Volkswagen': ['Jetta', 'Golf'],
+}
+FUEL_TYPES = ['gasoline', 'diesel', 'electric', 'hybrid']
+
+
+def vin_check_digit(vin):
+    '''returns the check digit (9th character) a 17 character vin must have'''
+
+    remainder = sum(VIN_VALUES[character] * weight for character, weight in zip(vin, VIN_WEIGHTS)) % 11
+    return 'X' if remainder == 10 else str(remainder)
+
+
+def synthetic_vin(index, rng):
+    '''builds a valid vin, unique per index (plant code and serial number come from the index)'''
+
+    prefix = ''.join(rng.choice(VIN_CHARACTERS) for _ in range(9))
+    vin = prefix[:8] + '0' + rng.choice(VIN_CHARACTERS) + VIN_CHARACTERS[index // 1000000] + f'{index % 1000000:06d}'
+    return vin[:8] + vin_check_digit(vin) + vin[9:]
+
+
+def synthetic_vehicle(index, rng):
+    '''builds a valid vehicle request'''
+
+    manufacturer = rng.choice(list(MANUFACTURERS))
+    return {
+        "vin": synthetic_vin(index, rng),
+        "manufacturer_name": manufacturer,
+        "horse_power": rng.randint(70, 700),
+        "model_name": rng.choice(MANUFACTURERS[manufacturer]),
+        "model_year": rng.randint(1990, 2026),
+        "purchase_price": round(rng.uniform(1000, 90000), 2),
+        "fuel_type": rng.choice(FUEL_TYPES),
+    }
+
+
+def disposable(database):
+    '''whether a --database may have its tables dropped: 'sqlite', or a sqlite uri in memory or under the temporary directory'''
+
+    if database == 'sqlite':
+        return True
+    if not database.startswith('sqlite:'):
+        return False
+    path = database.partition(':///')[2]
+    return path in ('', ':memory:') or os.path.abspath(path).startswith(os.path.join(tempfile.gettempdir(), ''))
+
+
+def seed(app, rows, chunk_size=5000, seed=0, drop_tables=False):
+    '''
+    Recreates the tables and inserts rows vehicles (a tenth of them sold), returning every seeded vin
+
+    Vehicles go through POST /vehicle/bulk, so the statistics rollup, search index and change log are filled
+    like in production. Refuses to drop the tables of anything but a disposable database unless drop_tables.
+    '''
+    uri = app.config['SQLALCHEMY_DATABASE_URI']
+    if not (drop_tables or disposable(uri)):
+        raise ValueError(f"seeding drops every table of {uri}, pass drop_tables=True (--i-know-this-drops-tables) to go ahead")
+
+    db = app.extensions['sqlalchemy']
+    models = app.extensions['models']
+    rng = random.Random(seed)
+    vehicles = [synthetic_vehicle(index, rng) for index in range(rows)]
+
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+
+    with app.test_client() as client:
+        for start in range(0, rows, chunk_size):
+            response = client.post('/vehicle/bulk', json=vehicles[start:start + chunk_size])
+            if response.status_code != 200 or response.get_json()['errors']:
+                raise RuntimeError(f"seeding failed: {response.get_data(as_text=True)[:1000]}")
+
+    #sales are written outside the app, straight into their table
+    with app.app_context():
+        sold = [
+            {"vin": vehicle['vin'], "purchase_price": vehicle['purchase_price'], "insurance_policy": "full", "car_damage": 0.0}
+            for vehicle in vehicles[::10]
+        ]
+        for start in range(0, len(sold), chunk_size):
+            bulk_insert_rows(db.session, models['Vehicle_sold'].__table__, sold[start:start + chunk_size])
+        db.session.commit()
+    return [vehicle['vin'] for vehicle in vehicles]
+
+
+def route_requests(vins, rng, created):
+    '''
+    Returns the (method, url, json body) request each benchmarked route sends
+    (each call to a factory builds the next request, so writes never collide)
+    '''
+    def post():
+        vehicle = synthetic_vehicle(len(vins) + next(created), rng)
+        return 'POST', '/vehicle', vehicle
+
+    return {
+        'GET /vehicle': lambda: ('GET', '/vehicle?limit=100', None),
+        'GET /vehicle filtered': lambda: ('GET', '/vehicle?fuel_type=diesel&sort=-purchase_price&limit=100', None),
+        'GET /vehicle/<vin>': lambda: ('GET', f'/vehicle/{rng.choice(vins)}', None),
+        'POST /vehicle': post,
+        'PATCH /vehicle/<vin>': lambda: ('PATCH', f'/vehicle/{rng.choice(vins)}', {"horse_power": rng.randint(70, 700)}),
+        'GET /vehicle_sold': lambda: ('GET', '/vehicle_sold?limit=100', None),
+    }
+
+
+def run_route(app, make_request, requests, concurrency):
+    '''
+    Sends requests requests from concurrency threads (one test client each), returning the
+    latency percentiles in milliseconds and the throughput in requests per second
+    '''
+    def worker(count):
+        client = app.test_client()
+        latencies = []
+        for _ in range(count):
+            method, url, body = make_request()
+            start = time.perf_counter()
+            response = client.open(url, method=method, json=body)
+            latencies.append(time.perf_counter() - start)
+            if response.status_code >= 400:
+                raise RuntimeError(f"{method} {url} answered {response.status_code}: {response.get_data(as_text=True)}")
+        return latencies
+
+    counts = [requests // concurrency + (index < requests % concurrency) for index in range(concurrency)]
+    start = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as executor:
+        latencies = [latency for result in executor.map(worker, counts) for latency in result]
+    elapsed = time.perf_counter() - start
+
+    percentiles = statistics.quantiles(latencies, n=100, method='inclusive')
+    return {
+        "p50_ms": round(percentiles[49] * 1e3, 3),
+        "p95_ms": round(percentiles[94] * 1e3, 3),
+        "p99_ms": round(percentiles[98] * 1e3, 3),
+        "throughput_rps": round(len(latencies) / elapsed, 1),
+    }
+
+
+def regressions(results, baseline, threshold):
+    '''
+    Lists the results that are more than threshold percent worse than their baseline
+    (results missing from the baseline are never regressions)
+    '''
+    found = []
+    for key, result in results.items():
+        expected = baseline.get(key)
+        if expected is None:
+            continue
+        if result['p95_ms'] > expected['p95_ms'] * (1 + threshold / 100):
+            found.append(f"{key}: p95 {result['p95_ms']}ms vs baseline {expected['p95_ms']}ms")
+        if result['throughput_rps'] < expected['throughput_rps'] * (1 - threshold / 100):
+            found.append(f"{key}: {result['throughput_rps']} req/s vs baseline {expected['throughput_rps']} req/s")
+    return found
+
+
+def database_uri(database, directory, rows):
+    '''maps 'sqlite' to a fresh database file (other values are used as sqlalchemy uris)'''
+
+    if database == 'sqlite':
+        return f"sqlite:///{os.path.join(directory, f'bench_{rows}.db')}"
+    return database
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, nargs='+', default=[1000], help='dataset sizes, e.g. 1000 100000 1000000')
+    parser.add_argument('--database', nargs='+', default=['sqlite'], help="'sqlite' or sqlalchemy uris (e.g. a local postgres)")
+    parser.add_argument('--requests', type=int, default=500, help='requests per route')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--baseline', default=BASELINE)
+    parser.add_argument('--threshold', type=float, default=20.0, help='allowed regression, in percent')
+    parser.add_argument('--save-baseline', action='store_true')
+    parser.add_argument('--i-know-this-drops-tables', action='store_true', help='allow seeding databases other than throwaway sqlite ones')
+    args = parser.parse_args()
+
+    unsafe = [database for database in args.database if not disposable(database)]
+    if unsafe and not args.i_know_this_drops_tables:
+        parser.error(f"seeding drops every table of {', '.join(unsafe)}, pass --i-know-this-drops-tables to go ahead")
+
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        for database in args.database:
+            for rows in args.rows:
+                app = create_app({
+                    "SQLALCHEMY_DATABASE_URI": database_uri(database, directory, rows),
+                    "VEHICLE_CACHE_BACKEND": os.getenv('VEHICLE_CACHE_BACKEND', 'lru'),
+                })
+                vins = seed(app, rows, drop_tables=args.i_know_this_drops_tables)
+                dialect = database.split(':')[0].split('+')[0]
+                rng = random.Random(rows)
+                created = iter(range(sys.maxsize))
+
+                for route, make_request in route_requests(vins, rng, created).items():
+                    key = f'{dialect} {rows} {route}'
+                    results[key] = run_route(app, make_request, args.requests, args.concurrency)
+                    result = results[key]
+                    print(
+                        f"{key:<45} p50 {result['p50_ms']:>8.2f}ms  p95 {result['p95_ms']:>8.2f}ms  "
+                        f"p99 {result['p99_ms']:>8.2f}ms  {result['throughput_rps']:>8.1f} req/s"
+                    )
+
+                with app.app_context():
+                    app.extensions['sqlalchemy'].engine.dispose()
+
+    if args.save_baseline:
+        baseline = {}
+        if os.path.exists(args.baseline):
+            with open(args.baseline) as file:
+                baseline = json.load(file)
+        baseline.update(results)
+        with open(args.baseline, 'w') as file:
+            json.dump(baseline, file, indent=2, sort_keys=True)
+        print(f"saved {len(results)} results to {args.baseline}")
+        return
+
+    if not os.path.exists(args.baseline):
+        print(f"no baseline at {args.baseline} (store one with --save-baseline)")
+        return
+
+    with open(args.baseline) as file:
+        found = regressions(results, json.load(file), args.threshold)
+    for regression in found:
+        print(f"REGRESSION {regression}")
+    if found:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,46 @@
+'''
+Measures vehicle validation cost per record (run from the repo root: python -m benchmarks.bench_validation)
+'''
+import argparse
+import timeit
+
+from schema import VEHICLE_SCHEMA
+
+
+payload = {
+            "vin": "3VWFA81H9PM123456",
+            "manufacturer_name": "Volkswagen",
+            "model_name": "Jetta",
+            "model_year": 1993,
+            "fuel_type": "Gasoline",
+            "horse_power": 115,
+            "purchase_price": 2200.20,
+            "color": "red",
+            "category": "sedan"
+            }
+
+
+def per_record(statement, number):
+    '''returns the best of five runs in microseconds per call'''
+
+    return min(timeit.repeat(statement, number=number, repeat=5)) / number * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--records', type=int, default=100000)
+    args = parser.parse_args()
+
+    invalid = {**payload, "horse_power": "bad_val", "model_year": None}
+    batch = [payload] * args.records
+
+    print(f"valid record:    {per_record(lambda: VEHICLE_SCHEMA.validate(payload), args.records):.2f} us")
+    print(f"invalid record:  {per_record(lambda: VEHICLE_SCHEMA.validate(invalid), args.records):.2f} us")
+    print(f"partial record:  {per_record(lambda: VEHICLE_SCHEMA.validate({'model_year': 2018}, True), args.records):.2f} us")
+
+    batch_time = min(timeit.repeat(lambda: VEHICLE_SCHEMA.validate_many(batch), number=1, repeat=5))
+    print(f"batch of {args.records}: {batch_time * 1e3:.1f} ms ({batch_time / args.records * 1e6:.2f} us per record)")
+
+
+if __name__ == '__main__':
+    main()
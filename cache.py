@@ -0,0 +1,155 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class LRUCache:
+    '''
+    In-process least recently used cache with a size limit and a time to live
+
+    Only for a single process serving the app (VEHICLE_CACHE_BACKEND=lru is opt in): each gunicorn worker
+    would hold its own copy and keep serving a vehicle written through another worker until the entry
+    expires, use SharedCache across workers
+
+    Attributes:
+        max_size (int): the most entries kept before the least recently used one is evicted
+        ttl (float): the number of seconds an entry stays valid
+    '''
+
+    def __init__(self, max_size=10000, ttl=30.0, clock=time.monotonic):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.clock = clock
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        '''returns the cached value for a key, or None if it is missing or expired'''
+
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            value, expires_at = entry
+            if expires_at <= self.clock():
+                del self.entries[key]
+                self.misses += 1
+                self.evictions += 1
+                return None
+
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        '''stores a value, evicting the least recently used entries past max_size'''
+
+        with self.lock:
+            self.entries[key] = (value, self.clock() + self.ttl)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, *keys):
+        '''drops entries (missing keys are ignored)'''
+
+        with self.lock:
+            for key in keys:
+                self.entries.pop(key, None)
+
+    def stats(self):
+        '''returns the counters used to size the cache'''
+
+        with self.lock:
+            return {
+                "backend": "lru",
+                "size": len(self.entries),
+                "max_size": self.max_size,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+
+class SharedCache:
+    '''
+    Cache shared by every worker, backed by any client exposing redis' get/set(ex=)/delete
+
+    Attributes:
+        client: the redis (or stand-in) client entries are stored in
+        ttl (float): the number of seconds an entry stays valid
+        prefix (string): namespaces the keys inside a shared server
+    '''
+
+    def __init__(self, client, ttl=30.0, prefix='vehicle:'):
+        self.client = client
+        self.ttl = ttl
+        self.prefix = prefix
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        '''returns the cached value for a key, or None if it is missing or expired'''
+
+        value = self.client.get(self.prefix + key)
+        with self.lock:
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return value
+
+    def set(self, key, value):
+        '''stores a value (expiry and eviction are left to the server)'''
+
+        self.client.set(self.prefix + key, value, ex=max(1, int(self.ttl)))
+
+    def delete(self, *keys):
+        '''drops entries (missing keys are ignored)'''
+
+        if keys:
+            self.client.delete(*[self.prefix + key for key in keys])
+
+    def stats(self):
+        '''returns the counters used to size the cache (evictions are tracked by the server)'''
+
+        with self.lock:
+            return {
+                "backend": "shared",
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": None,
+            }
+
+
+def create_cache(config):
+    '''
+    Builds the vehicle cache described by an app's config (or None when caching is off)
+    '''
+    backend = config.get('VEHICLE_CACHE_BACKEND')
+
+    if backend == 'lru':
+        return LRUCache(config['VEHICLE_CACHE_SIZE'], config['VEHICLE_CACHE_TTL'])
+
+    elif backend == 'shared':
+        client = config.get('VEHICLE_CACHE_CLIENT')
+        if client is None:
+            try:
+                import redis
+            except ImportError:
+                raise RuntimeError("the shared vehicle cache needs the 'redis' package installed")
+            client = redis.Redis.from_url(config['VEHICLE_CACHE_URL'])
+        return SharedCache(client, config['VEHICLE_CACHE_TTL'])
+
+    elif backend:
+        raise ValueError(f"unknown VEHICLE_CACHE_BACKEND '{backend}'")
+    return None
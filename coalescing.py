@@ -0,0 +1,78 @@
+'''
+Group commit for concurrent writes: requests queue their write and block while one of them (the leader,
+the first to find no batch forming) gathers more for up to max_delay seconds or until max_rows are queued,
+then flushes the whole batch in one transaction and hands every caller its own result
+
+Batches are per worker process and only fill up when a worker serves requests concurrently (gthread,
+gevent or eventlet worker classes), a sync worker serving one request at a time just pays max_delay.
+'''
+import threading
+import time
+from concurrent.futures import Future
+
+
+class WriteBatcher:
+    '''
+    Coalesces concurrent writes into batches flushed by flush(items), which returns one result per item
+    (an exception raised by flush reaches every caller of the batch)
+
+    Attributes:
+        max_rows (int): the queue length that flushes a batch right away
+        max_delay (float): the seconds a leader waits for a batch to fill up
+        batches (int): the batches flushed so far
+        items (int): the writes flushed so far
+    '''
+
+    def __init__(self, flush, max_rows, max_delay):
+        self.flush = flush
+        self.max_rows = max_rows
+        self.max_delay = max_delay
+        self.condition = threading.Condition()
+        self.pending = []
+        self.leading = False
+        self.batches = 0
+        self.items = 0
+
+    def submit(self, item):
+        '''queues a write and blocks until its batch is flushed, returning the write's own result'''
+
+        future = Future()
+        with self.condition:
+            self.pending.append((item, future))
+            lead = not self.leading
+            if lead:
+                self.leading = True
+            elif len(self.pending) >= self.max_rows:
+                self.condition.notify()
+
+        if lead:
+            self.lead()
+        return future.result()
+
+    def lead(self):
+        '''waits for the batch to fill up (or max_delay to pass), then flushes it'''
+
+        deadline = time.monotonic() + self.max_delay
+        with self.condition:
+            while len(self.pending) < self.max_rows:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self.condition.wait(remaining)
+            #writes queued from here on start the next batch (under a leader of their own)
+            batch, self.pending = self.pending, []
+            self.leading = False
+
+        try:
+            results = self.flush([item for item, future in batch])
+        except BaseException as error:
+            for item, future in batch:
+                future.set_exception(error)
+            return
+
+        with self.condition:
+            self.batches += 1
+            self.items += len(batch)
+        for (item, future), result in zip(batch, results):
+            future.set_result(result)
+
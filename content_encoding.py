@@ -0,0 +1,259 @@
+'''
+Negotiated response compression (gzip, plus brotli and zstd when their packages are installed)
+
+Small bodies are compressed whole once they reach a minimum size, streamed bodies chunk by chunk as they
+are written (one compressor per response, so the stream stays a single encoded body). Compressible
+responses always carry Vary: Accept-Encoding, compressed or not, so shared caches keep one copy per
+encoding. A compressed body's strong etag is marked with its encoding ("<etag>-gzip"), since its bytes
+differ from the identity body's; the markers are stripped from If-None-Match before the routes compare it
+with the etags they compute, and a 304 repeats the marked etag the client revalidated with.
+'''
+import re
+import zlib
+
+from flask import request
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+#the encoding marker compressed bodies' etags end in (inside the quotes)
+ENCODED_ETAG = re.compile(r'-(?:gzip|br|zstd)"')
+
+#media types worth compressing (parquet is compressed already and event streams must not wait on a compressor)
+COMPRESSIBLE_TYPES = {'application/json', 'application/x-ndjson', 'text/csv', 'text/plain', 'text/html'}
+
+
+def available_encodings(preference):
+    '''filters a preference list (e.g. ['zstd', 'br', 'gzip']) down to the encodings installed here'''
+
+    installed = {'gzip': True, 'br': brotli is not None, 'zstd': zstandard is not None}
+    return [encoding for encoding in preference if installed.get(encoding)]
+
+
+def negotiate(accept_encoding, encodings):
+    '''
+    Picks the encoding to answer an Accept-Encoding header with: the client's highest q value wins and
+    ties go to the earliest of encodings (returns None when identity is the only acceptable choice)
+    '''
+    weights = {}
+    for part in (accept_encoding or '').split(','):
+        name, _, params = part.strip().partition(';')
+        name = name.strip().lower()
+        if not name:
+            continue
+        q = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        weights[name] = q
+
+    best, best_q = None, 0.0
+    for encoding in encodings:
+        q = weights.get(encoding, weights.get('*', 0.0))
+        if q > best_q:
+            best, best_q = encoding, q
+    return best
+
+
+def encoded_etag(etag, encoding):
+    '''marks an ETag header value with the encoding its body is sent in ('"abc"' becomes '"abc-gzip"')'''
+
+    return f'{etag[:-1]}-{encoding}"' if etag.endswith('"') else etag
+
+
+def identity_etags(if_none_match):
+    '''strips the encoding markers from an If-None-Match header, so it matches the etags routes compute'''
+
+    return ENCODED_ETAG.sub('"', if_none_match)
+
+
+def revalidated_etag(etag, if_none_match):
+    '''returns the form of a 304's etag (marked or not) that the client's If-None-Match holds'''
+
+    for encoding in ('gzip', 'br', 'zstd'):
+        if encoded_etag(etag, encoding) in (if_none_match or ''):
+            return encoded_etag(etag, encoding)
+    return etag
+
+
+def compressor(encoding, levels):
+    '''returns the (compress, flush) functions of a new streaming compressor for an encoding'''
+
+    if encoding == 'br':
+        stream = brotli.Compressor(quality=levels['br'])
+        return stream.process, stream.finish
+    elif encoding == 'zstd':
+        stream = zstandard.ZstdCompressor(level=levels['zstd']).compressobj()
+        return stream.compress, stream.flush
+    stream = zlib.compressobj(levels['gzip'], zlib.DEFLATED, 31)
+    return stream.compress, stream.flush
+
+
+def compress(data, encoding, levels):
+    '''compresses a whole body'''
+
+    compress_chunk, flush = compressor(encoding, levels)
+    return compress_chunk(data) + flush()
+
+
+def compress_chunks(chunks, encoding, levels):
+    '''compresses a stream of chunks as it goes, yielding whatever the compressor has ready'''
+
+    compress_chunk, flush = compressor(encoding, levels)
+    for chunk in chunks:
+        compressed = compress_chunk(chunk.encode() if isinstance(chunk, str) else chunk)
+        if compressed:
+            yield compressed
+    yield flush()
+
+
+def compressible(status, content_type, content_encoding, cache_control):
+    '''whether a response may be compressed (media type, status and the headers that rule it out)'''
+
+    media_type = (content_type or '').split(';')[0].strip().lower()
+    return (
+        media_type in COMPRESSIBLE_TYPES
+        and 200 <= status and status not in (204, 206, 304)
+        and not content_encoding
+        and 'no-transform' not in (cache_control or '').lower()
+    )
+
+
+def compress_responses(app):
+    '''
+    Compresses the app's responses for clients that accept it, configured by COMPRESSION_ENCODINGS
+    (preference order), COMPRESSION_MIN_SIZE (bytes, unstreamed bodies only) and COMPRESSION_LEVELS
+
+    Register it after the metrics hooks: after_request hooks run in reverse, so the recorded sizes are the
+    compressed ones
+    '''
+    @app.before_request
+    def match_encoded_etags():
+        if_none_match = request.environ.get('HTTP_IF_NONE_MATCH')
+        if if_none_match:
+            request.environ['content_encoding.if_none_match'] = if_none_match
+            request.environ['HTTP_IF_NONE_MATCH'] = identity_etags(if_none_match)
+
+    @app.after_request
+    def compress_response(response):
+        if response.status_code == 304 and 'ETag' in response.headers:
+            response.headers['ETag'] = revalidated_etag(response.headers['ETag'], request.environ.get('content_encoding.if_none_match'))
+            return response
+
+        if request.method == 'HEAD' or not compressible(
+            response.status_code, response.content_type,
+            response.headers.get('Content-Encoding'), response.headers.get('Cache-Control')
+        ):
+            return response
+
+        response.vary.add('Accept-Encoding')
+        encoding = negotiate(request.headers.get('Accept-Encoding'), available_encodings(app.config['COMPRESSION_ENCODINGS']))
+        if encoding is None:
+            return response
+
+        levels = app.config['COMPRESSION_LEVELS']
+        if response.is_streamed:
+            response.response = compress_chunks(response.response, encoding, levels)
+            response.headers.pop('Content-Length', None)
+        else:
+            data = response.get_data()
+            if len(data) < app.config['COMPRESSION_MIN_SIZE']:
+                return response
+            response.set_data(compress(data, encoding, levels))
+        response.headers['Content-Encoding'] = encoding
+        if 'ETag' in response.headers:
+            response.headers['ETag'] = encoded_etag(response.headers['ETag'], encoding)
+        return response
+
+    return compress_response
+
+
+class CompressionMiddleware:
+    '''
+    Compresses an asgi app's responses like compress_responses (the asgi twin of its after_request hook)
+
+    The first body message decides: a complete body under min_size goes out as it is, anything else is
+    compressed message by message (etags and If-None-Match are marked and unmarked like compress_responses)
+    '''
+
+    def __init__(self, app, encodings, min_size, levels):
+        self.app = app
+        self.encodings = available_encodings(encodings)
+        self.min_size = min_size
+        self.levels = levels
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http' or scope['method'] == 'HEAD':
+            return await self.app(scope, receive, send)
+
+        request_headers = {name.lower(): value for name, value in scope['headers']}
+        encoding = negotiate(request_headers.get(b'accept-encoding', b'').decode('latin-1'), self.encodings)
+        state = {'start': None, 'compressor': None}
+
+        if_none_match = request_headers.get(b'if-none-match', b'').decode('latin-1')
+        if if_none_match:
+            scope = {**scope, 'headers': [
+                (name, identity_etags(value.decode('latin-1')).encode('latin-1') if name.lower() == b'if-none-match' else value)
+                for name, value in scope['headers']
+            ]}
+
+        async def send_compressed(message):
+            if message['type'] == 'http.response.start':
+                headers = {name.lower(): value.decode('latin-1') for name, value in message['headers']}
+                if message['status'] == 304 and b'etag' in headers:
+                    etag = revalidated_etag(headers[b'etag'], if_none_match)
+                    message_headers = [(name, value) for name, value in message['headers'] if name.lower() != b'etag']
+                    return await send({**message, 'headers': [*message_headers, (b'etag', etag.encode('latin-1'))]})
+
+                if not compressible(
+                    message['status'], headers.get(b'content-type'),
+                    headers.get(b'content-encoding'), headers.get(b'cache-control')
+                ):
+                    return await send(message)
+
+                vary = headers.get(b'vary')
+                message_headers = [(name, value) for name, value in message['headers'] if name.lower() != b'vary']
+                message_headers.append((b'vary', (vary + ', Accept-Encoding' if vary else 'Accept-Encoding').encode('latin-1')))
+                message = {**message, 'headers': message_headers}
+                if encoding is None:
+                    return await send(message)
+                #held back until the first body message shows whether it is worth compressing
+                state['start'] = message
+                return
+
+            if message['type'] != 'http.response.body' or (state['start'] is None and state['compressor'] is None):
+                return await send(message)
+
+            body = message.get('body', b'')
+            more_body = message.get('more_body', False)
+            if state['start'] is not None:
+                start, state['start'] = state['start'], None
+                if not more_body and len(body) < self.min_size:
+                    await send(start)
+                    return await send(message)
+
+                headers = [
+                    (name, encoded_etag(value.decode('latin-1'), encoding).encode('latin-1') if name.lower() == b'etag' else value)
+                    for name, value in start['headers'] if name.lower() != b'content-length'
+                ]
+                headers.append((b'content-encoding', encoding.encode()))
+                await send({**start, 'headers': headers})
+                state['compressor'] = compressor(encoding, self.levels)
+
+            compress_chunk, flush = state['compressor']
+            compressed = compress_chunk(body)
+            if not more_body:
+                compressed += flush()
+            await send({'type': 'http.response.body', 'body': compressed, 'more_body': more_body})
+
+        await self.app(scope, receive, send_compressed)
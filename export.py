@@ -0,0 +1,114 @@
+'''
+Streaming encoders for the export routes
+
+Every encoder takes an iterator of row chunks (lists of tuples straight from a server-side cursor) and
+yields bytes chunk by chunk, so an export holds one chunk in memory however many rows it covers
+'''
+import csv
+import io
+from datetime import datetime
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+#export formats and their content types
+EXPORT_FORMATS = {
+    'csv': 'text/csv',
+    'ndjson': 'application/x-ndjson',
+    'parquet': 'application/vnd.apache.parquet',
+}
+
+
+def _plain_values(rows, datetime_columns):
+    '''swaps datetimes for iso 8601 strings (only in the columns that hold them)'''
+
+    if not datetime_columns:
+        return rows
+    plain = []
+    for row in rows:
+        row = list(row)
+        for index in datetime_columns:
+            if isinstance(row[index], datetime):
+                row[index] = row[index].isoformat()
+        plain.append(row)
+    return plain
+
+
+def csv_chunks(chunks, fields, datetime_columns=()):
+    '''yields a header line, then each chunk of rows as csv (nulls are empty cells)'''
+
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator='\n')
+    writer.writerow(fields)
+    yield buffer.getvalue().encode()
+
+    for rows in chunks:
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerows(_plain_values(rows, datetime_columns))
+        yield buffer.getvalue().encode()
+
+
+def ndjson_chunks(chunks, fields, dumps, datetime_columns=()):
+    '''yields each chunk of rows as newline delimited json objects (dumps returns bytes)'''
+
+    for rows in chunks:
+        yield b''.join(dumps(dict(zip(fields, row))) + b'\n' for row in _plain_values(rows, datetime_columns))
+
+
+def arrow_type(column):
+    '''maps a sqlalchemy column onto the parquet (arrow) type it is exported as'''
+
+    python_type = column.type.python_type
+    if python_type is int:
+        return pyarrow.int64()
+    elif python_type is float:
+        return pyarrow.float64()
+    elif python_type is datetime:
+        return pyarrow.timestamp('us', tz='UTC')
+    return pyarrow.string()
+
+
+class _ParquetSink(io.RawIOBase):
+    '''write-only file that hands written bytes back on drain() (tell() keeps counting, as parquet offsets need)'''
+
+    def __init__(self):
+        self.parts = []
+        self.position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.parts.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def drain(self):
+        data = b''.join(self.parts)
+        self.parts = []
+        return data
+
+
+def parquet_chunks(chunks, columns):
+    '''
+    Yields a parquet file written one row group per chunk (the schema comes from the columns'
+    types, so chunks full of nulls still agree with the rest)
+    '''
+    schema = pyarrow.schema([(column.key, arrow_type(column)) for column in columns])
+    sink = _ParquetSink()
+    writer = pyarrow.parquet.ParquetWriter(sink, schema, compression='snappy')
+
+    for rows in chunks:
+        arrays = [pyarrow.array(values, type=field.type) for values, field in zip(zip(*rows), schema)]
+        writer.write_table(pyarrow.Table.from_arrays(arrays, schema=schema))
+        yield sink.drain()
+    writer.close()
+    yield sink.drain()
+
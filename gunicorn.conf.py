@@ -0,0 +1,89 @@
+'''
+gunicorn settings, read from the environment (serve with: gunicorn -c gunicorn.conf.py)
+
+SERVER_MODE picks the app:
+    wsgi    the flask app, 'app:create_app()' (the default)
+    asgi    the asyncio app, 'asgi:create_asgi_app()' on uvicorn workers (many requests per process)
+
+GUNICORN_WORKER_CLASS picks the wsgi worker model:
+    sync    one request per process (the default)
+    gthread GUNICORN_THREADS requests per process, keep DB_POOL_SIZE + DB_MAX_OVERFLOW >= threads
+    gevent  greenlets per process (needs gevent, and psycogreen so psycopg2 yields while waiting)
+'''
+import logging
+import multiprocessing
+import os
+
+from pool import warm_pool
+
+logger = logging.getLogger(__name__)
+
+server_mode = os.getenv('SERVER_MODE', 'wsgi')
+if server_mode not in ('wsgi', 'asgi'):
+    raise ValueError(f"unknown SERVER_MODE '{server_mode}'")
+wsgi_app = 'asgi:create_asgi_app()' if server_mode == 'asgi' else 'app:create_app()'
+
+bind = os.getenv('GUNICORN_BIND', '0.0.0.0:5000')
+workers = int(os.getenv('GUNICORN_WORKERS', min(5, multiprocessing.cpu_count() * 2 + 1)))
+worker_class = os.getenv('GUNICORN_WORKER_CLASS', 'uvicorn.workers.UvicornWorker' if server_mode == 'asgi' else 'sync')
+threads = int(os.getenv('GUNICORN_THREADS', 4 if worker_class == 'gthread' else 1))
+worker_connections = int(os.getenv('GUNICORN_WORKER_CONNECTIONS', 1000))
+timeout = int(os.getenv('GUNICORN_TIMEOUT', 30))
+graceful_timeout = int(os.getenv('GUNICORN_GRACEFUL_TIMEOUT', 30))
+keepalive = int(os.getenv('GUNICORN_KEEPALIVE', 5))
+max_requests = int(os.getenv('GUNICORN_MAX_REQUESTS', 0))
+max_requests_jitter = int(os.getenv('GUNICORN_MAX_REQUESTS_JITTER', 0))
+
+#builds the app once in the master so workers fork with it already imported (shared copy-on-write memory)
+preload_app = os.getenv('GUNICORN_PRELOAD', 'true').lower() == 'true'
+
+
+#admission control slots (rows of the shared in-flight counters) of the live workers, kept by the master
+admission_slots = {}
+
+
+def pre_fork(server, worker):
+    '''hands the worker about to be forked the lowest free admission slot'''
+
+    worker.admission_slot = next(slot for slot in range(len(admission_slots) + 1) if slot not in admission_slots)
+    admission_slots[worker.admission_slot] = worker
+
+
+def child_exit(server, worker):
+    '''frees a dead worker's admission slot, dropping the requests it never finished from the counts'''
+
+    slot = getattr(worker, 'admission_slot', None)
+    admission_slots.pop(slot, None)
+    #only a preloaded app's counters are shared with the master
+    if slot is not None and server.cfg.preload_app and server_mode == 'wsgi':
+        admission = server.app.wsgi().extensions.get('admission')
+        if admission is not None and slot < admission.in_flight.worker_slots:
+            admission.in_flight.reset(slot)
+
+
+def post_worker_init(worker):
+    '''drops database connections inherited from the master and warms this worker's own pool'''
+
+    app = worker.wsgi
+
+    #the asgi app opens (and warms) its async pool in its own lifespan startup
+    if server_mode == 'asgi':
+        return
+
+    if worker_class == 'gevent':
+        try:
+            from psycogreen.gevent import patch_psycopg
+            patch_psycopg()
+        except ImportError:
+            logger.warning("psycogreen is not installed, database calls will block the gevent worker")
+
+    admission = app.extensions.get('admission')
+    if admission is not None:
+        admission.join_worker(getattr(worker, 'admission_slot', None), worker.cfg.workers)
+
+    db = app.extensions['sqlalchemy']
+    with app.app_context():
+        #close=False leaves the master's sockets alone instead of shutting them from the child
+        db.engine.dispose(close=False)
+        if app.config['DB_POOL_WARM']:
+            warm_pool(db.engine, app.config['DB_POOL_WARM'])
@@ -1,44 +1,341 @@
-from flask import Flask, request, jsonify
-
-def validate_vehicle_request(vehicle_request, Vehicle, update):
-    '''
-    Checks if json request has all neccesary/proper attributes for a vehicle request
-    '''
-    required_inputs = ["vin", "manufacturer_name", "horse_power", "model_name", "model_year", "purchase_price", "fuel_type"]
-    vin = None
-
-    #checks if any values are missing
-    for input in required_inputs:
-        if input not in vehicle_request:
-            return vin, jsonify({"error":f"{input} not in request"})
-    
-    #checks for malformed attributes
-    if not isinstance(vehicle_request["manufacturer_name"], str):
-        return vin, jsonify({"error": "'manufacturer_name' must be a string"})
-
-    if not isinstance(vehicle_request["horse_power"], int):
-        return vin, jsonify({"error": "'horse_power' must be a int"})
-
-    if not isinstance(vehicle_request["model_name"], str):
-        return vin, jsonify({"error": "'model_name' must be a string"})
-    
-    if not isinstance(vehicle_request["model_year"], int):
-        return vin, jsonify({"error": "'model_year' must be a int"})
-
-    if not isinstance(vehicle_request["purchase_price"], (float,int)):
-        return vin, jsonify({"error": "'purchase_price' must be a int or float"})
-
-    if not isinstance(vehicle_request["fuel_type"], str):
-        return vin, jsonify({"error": "'fuel_type' must be a string"})
-
-    #checks if vin is unique
-    if "vin" in vehicle_request:
-        vin = vehicle_request.get('vin')
-        if not isinstance(vin, str):
-            return vin, jsonify({"error": "'vin' must be a string"})
-        vin = vin.upper()
-        if not update and Vehicle.query.filter_by(vin=vin).first():
-            return vin, jsonify({"error": "'vin' must be unique"})
-        return vin, None
+import io
+import json
+import operator
+import zlib
+from datetime import datetime, timezone
+
+from flask import Flask, Response, request, jsonify
+from sqlalchemy import exc
+from sqlalchemy.dialects import postgresql, sqlite
+
+from schema import VEHICLE_SCHEMA
+
+def check_vehicle_fields(vehicle_request, partial=False):
+    '''
+    Checks a vehicle record's attributes without touching the database or building a response
+    (returns the upper cased vin and every error message, or None if the record is valid)
+
+    partial only checks the attributes present in the record (for patches)
+    '''
+    errors = VEHICLE_SCHEMA.validate(vehicle_request, partial)
+    if errors:
+        return None, errors
+
+    vin = vehicle_request.get('vin')
+    return (vin.upper() if vin is not None else None), None
+
+def validation_error(errors):
+    '''
+    Builds the json body reporting a record's errors (the first one stays under 'error')
+    '''
+    return jsonify({"error": errors[0], "errors": errors})
+
+def parse_page_args(args, default_limit, max_limit, cursor=str.upper):
+    '''
+    Reads the keyset pagination arguments (?limit=&after=) from a request's query string
+    (cursor converts the raw 'after' value, vins are stored upper case by default)
+    '''
+    limit = args.get('limit', default_limit)
+    after = args.get('after')
+
+    try:
+        limit = int(limit)
+    except (TypeError, ValueError):
+        return None, None, "'limit' must be a int"
+
+    if limit < 1 or limit > max_limit:
+        return None, None, f"'limit' must be between 1 and {max_limit}"
+
+    if after is not None:
+        try:
+            after = cursor(after)
+        except (TypeError, ValueError):
+            return None, None, "'after' is not a valid cursor"
+
+    return limit, after, None
+
+
+def stream_json_array(rows, chunk_size, dumps):
+    '''
+    Yields a json array of rows, encoding (dumps returns bytes) and buffering chunk_size rows per write
+    '''
+    yield b'['
+    buffer = []
+    first = True
+    for row in rows:
+        buffer.append(dumps(row))
+        if len(buffer) >= chunk_size:
+            yield (b'' if first else b',') + b','.join(buffer)
+            first = False
+            buffer = []
+    if buffer:
+        yield (b'' if first else b',') + b','.join(buffer)
+    yield b']\n'
+
+
+def stream_ndjson(rows, chunk_size, dumps):
+    '''
+    Yields rows as newline delimited json, encoding (dumps returns bytes) and buffering chunk_size rows per write
+    '''
+    buffer = []
+    for row in rows:
+        buffer.append(dumps(row))
+        if len(buffer) >= chunk_size:
+            yield b'\n'.join(buffer) + b'\n'
+            buffer = []
+    if buffer:
+        yield b'\n'.join(buffer) + b'\n'
+
+
+def sse_event(event, dumps):
+    '''
+    Encodes a change feed event as a server-sent event (its id is where a reconnecting client resumes)
+    '''
+    return b'id: %d\nevent: %s\ndata: %s\n\n' % (event['id'], event['operation'].encode(), dumps(event))
+
+
+def iter_ndjson(stream):
+    '''
+    Yields (index, record, error) for every non blank line of a newline delimited json body,
+    reading the stream one line at a time so the whole body never sits in memory
+    '''
+    index = 0
+    for line in iter(stream.readline, b''):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            yield index, json.loads(line), None
+        except ValueError:
+            yield index, None, "malformed json"
+        index += 1
+
+
+def iter_batches(items, batch_size):
+    '''
+    Groups an iterable into lists of at most batch_size items
+    '''
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _copy_text_value(value):
+    '''formats a value for postgres' COPY text format'''
+
+    if value is None:
+        return '\\N'
+    return str(value).replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n').replace('\r', '\\r')
+
+
+def bulk_insert_rows(session, table, rows):
+    '''
+    Inserts a list of row dictionaries into a table using the fastest path the dialect offers
+    (COPY on postgres, an executemany INSERT everywhere else), a duplicate key raises IntegrityError either way
+    '''
+    if not rows:
+        return
+
+    connection = session.connection()
+    if connection.dialect.name == 'postgresql':
+        columns = list(rows[0].keys())
+        buffer = io.StringIO()
+        for row in rows:
+            buffer.write('\t'.join(_copy_text_value(row[column]) for column in columns) + '\n')
+        buffer.seek(0)
+
+        statement = f'COPY {table.name} ({", ".join(columns)}) FROM STDIN'
+        cursor = connection.connection.cursor()
+        try:
+            cursor.copy_expert(statement, buffer)
+        except connection.dialect.dbapi.IntegrityError as error:
+            #the raw cursor's errors aren't wrapped by sqlalchemy, callers catch its IntegrityError
+            raise exc.IntegrityError(statement, None, error) from error
+        finally:
+            cursor.close()
     else:
-        pass
\ No newline at end of file
+        connection.execute(table.insert(), rows)
+
+
+#filterable vehicle columns and the type their query string values are parsed as
+VEHICLE_FILTERS = {
+    "manufacturer_name": str,
+    "model_name": str,
+    "fuel_type": str,
+    "color": str,
+    "category": str,
+    "model_year": int,
+    "horse_power": int,
+    "purchase_price": float,
+}
+
+#range suffixes allowed on the numeric filters (e.g. ?model_year_gte=2015)
+RANGE_OPERATORS = {
+    "gt": operator.gt,
+    "gte": operator.ge,
+    "lt": operator.lt,
+    "lte": operator.le,
+}
+
+#columns a listing can be sorted by (all required on create, so never null)
+VEHICLE_SORTS = ["vin", "manufacturer_name", "model_name", "model_year", "horse_power", "purchase_price"]
+
+
+def parse_vehicle_filters(args, Vehicle):
+    '''
+    Turns the filter arguments of a request's query string into sqlalchemy conditions
+    (unknown arguments are left alone so pagination/streaming arguments can sit alongside)
+    '''
+    conditions = []
+    for arg, value in args.items():
+        column, _, suffix = arg.rpartition('_')
+        if column in VEHICLE_FILTERS and suffix in RANGE_OPERATORS and VEHICLE_FILTERS[column] is not str:
+            compare = RANGE_OPERATORS[suffix]
+        elif arg in VEHICLE_FILTERS:
+            column, compare = arg, operator.eq
+        else:
+            continue
+
+        try:
+            value = VEHICLE_FILTERS[column](value)
+        except ValueError:
+            kind = 'int' if VEHICLE_FILTERS[column] is int else 'int or float'
+            return None, f"'{arg}' must be a {kind}"
+
+        conditions.append(compare(getattr(Vehicle, column), value))
+    return conditions, None
+
+
+def parse_vehicle_sort(args):
+    '''
+    Reads ?sort=<column> (or ?sort=-<column> for descending) from a request's query string
+    '''
+    sort = args.get('sort', 'vin')
+    descending = sort.startswith('-')
+    column = sort.lstrip('-')
+
+    if column not in VEHICLE_SORTS:
+        return None, None, f"'sort' must be one of {', '.join(VEHICLE_SORTS)}"
+    return column, descending, None
+
+
+def parse_vin_prefix(args):
+    '''
+    Reads ?vin_prefix= (e.g. a manufacturer's wmi) from a request's query string, upper cased like stored vins
+    (returns None when the argument is missing)
+    '''
+    prefix = args.get('vin_prefix')
+    if prefix is None:
+        return None, None
+
+    if not (1 <= len(prefix) <= 17 and prefix.isascii() and prefix.isalnum()):
+        return None, "'vin_prefix' must be 1 to 17 letters or digits"
+    return prefix.upper(), None
+
+
+def parse_vin_list(body, max_vins):
+    '''
+    Reads a json array of vins, upper cased like Vehicle.__init__ does and without duplicates
+    (returns the vins in request order and an error message)
+    '''
+    if not isinstance(body, list):
+        return None, "request must be a json array of vins"
+    if len(body) > max_vins:
+        return None, f"request must hold at most {max_vins} vins"
+    if not all(isinstance(vin, str) for vin in body):
+        return None, "every vin must be a string"
+    return list(dict.fromkeys(vin.upper() for vin in body)), None
+
+
+def collection_etag(version, query_string):
+    '''
+    Builds a collection's etag from its tables' change counters and the query that shaped the page
+    '''
+    return f'{version}-{zlib.crc32(query_string):08x}'
+
+
+def vehicle_etag(vin, version, updated_at):
+    '''
+    Builds a vehicle's etag from its version and when it was written (a vehicle deleted and created again,
+    or inserted by an upsert, starts over at version 1, its write time tells the two lifetimes apart)
+    '''
+    if updated_at.tzinfo is not None:
+        updated_at = updated_at.astimezone(timezone.utc).replace(tzinfo=None)
+    return f'{vin}-{version}-{zlib.crc32(updated_at.isoformat().encode()):08x}'
+
+
+def not_modified(etag):
+    '''
+    Returns an empty 304 response carrying the etag the client already holds
+    '''
+    response = Response(status=304)
+    response.set_etag(etag)
+    return response
+
+
+def dialect_insert(dialect_name, table):
+    '''
+    Returns an INSERT construct for a database dialect that supports ON CONFLICT clauses
+    '''
+    if dialect_name == 'postgresql':
+        return postgresql.insert(table)
+    return sqlite.insert(table)
+
+
+def vehicle_columns(vin, vehicle_request):
+    '''
+    Maps a validated vehicle request onto the vehicles table's columns
+    '''
+    return {
+        "vin": vin,
+        "manufacturer_name": vehicle_request.get('manufacturer_name'),
+        "horse_power": vehicle_request.get('horse_power'),
+        "model_name": vehicle_request.get('model_name'),
+        "model_year": vehicle_request.get('model_year'),
+        "purchase_price": round(vehicle_request.get('purchase_price'), 2),
+        "fuel_type": vehicle_request.get('fuel_type'),
+        "color": vehicle_request.get('color'),
+        "category": vehicle_request.get('category'),
+    }
+
+
+def utcnow():
+    '''
+    Returns the current time as an aware utc datetime (the vehicles' updated_at)
+    '''
+    return datetime.now(timezone.utc)
+
+
+def parse_since(value):
+    '''
+    Reads an iso 8601 watermark (?since=2026-10-18T12:00:00Z) as an aware utc datetime
+    (timestamps without an offset are taken as utc, raises ValueError for anything else)
+    '''
+    since = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    if since.tzinfo is None:
+        return since.replace(tzinfo=timezone.utc)
+    return since.astimezone(timezone.utc)
+
+
+def parse_fields(args, allowed, default):
+    '''
+    Reads a sparse fieldset (?fields=vin,purchase_price) from a request's query string
+    (returns the default fields when the argument is missing)
+    '''
+    fields = args.get('fields')
+    if fields is None:
+        return list(default), None
+
+    fields = list(dict.fromkeys(field.strip() for field in fields.split(',') if field.strip()))
+    if not fields:
+        return None, "'fields' must list at least one field"
+
+    for field in fields:
+        if field not in allowed:
+            return None, f"unknown field '{field}'"
+    return fields, None
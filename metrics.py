@@ -0,0 +1,148 @@
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+
+from sqlalchemy import event
+
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 25, 50, 100)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+#[statement count, seconds spent in the database] for the request being handled
+request_queries = ContextVar('request_queries', default=None)
+
+
+class Histogram:
+    '''
+    Prometheus style histogram (counts per upper bound, plus a sum and a count)
+
+    Attributes:
+        buckets (tuple): the sorted upper bounds, an implicit +Inf bucket follows the last one
+    '''
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class RequestMetrics:
+    '''
+    Per route request counters and histograms, rendered in the prometheus text format
+
+    Routes are labelled by their rule (e.g. /vehicle/<vin>) so the number of series stays bounded
+
+    Every gunicorn worker keeps a registry of its own and /metrics answers from whichever worker took the
+    scrape, so each sample carries a worker="<pid>" label: the series of one worker only ever grow (a
+    restarted worker starts new ones), and dashboards aggregate with sum without (worker) (rate() first
+    for counters). Gauges tracked server-wide (admission_in_flight) repeat per worker, take their max.
+
+    Attributes:
+        requests (dict): (method, route, status) -> the number of responses
+        histograms (dict): (metric, method, route) -> Histogram
+    '''
+
+    HISTOGRAMS = {
+        'http_request_duration_seconds': ('time spent handling a request', LATENCY_BUCKETS),
+        'http_request_db_queries': ('sql statements executed per request', QUERY_BUCKETS),
+        'http_request_db_duration_seconds': ('time spent in the database per request', LATENCY_BUCKETS),
+        'http_response_size_bytes': ('response body sizes (streamed bodies are not counted)', SIZE_BUCKETS),
+    }
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.requests = {}
+        self.histograms = {}
+
+    def _observe(self, metric, method, route, value):
+        histogram = self.histograms.get((metric, method, route))
+        if histogram is None:
+            histogram = self.histograms[(metric, method, route)] = Histogram(self.HISTOGRAMS[metric][1])
+        histogram.observe(value)
+
+    def record(self, method, route, status, duration, queries, db_time, size=None):
+        '''adds one finished request'''
+
+        with self.lock:
+            key = (method, route, status)
+            self.requests[key] = self.requests.get(key, 0) + 1
+            self._observe('http_request_duration_seconds', method, route, duration)
+            self._observe('http_request_db_queries', method, route, queries)
+            self._observe('http_request_db_duration_seconds', method, route, db_time)
+            if size is not None:
+                self._observe('http_response_size_bytes', method, route, size)
+
+    def render(self, samples=None):
+        '''
+        Returns every metric in the prometheus text format
+        samples ({name: (help, value)}) adds values tracked elsewhere such as pool usage
+        (names ending in _total are typed as counters, the rest as gauges, None values are skipped)
+        '''
+        #read at render time, the registry may have been created in the gunicorn master before the fork
+        worker = f'worker="{os.getpid()}"'
+        lines = ['# HELP http_requests_total responses sent, by status', '# TYPE http_requests_total counter']
+        with self.lock:
+            for (method, route, status), count in sorted(self.requests.items()):
+                lines.append(f'http_requests_total{{method="{method}",route="{route}",status="{status}",{worker}}} {count}')
+
+            for metric, (description, _) in self.HISTOGRAMS.items():
+                lines.append(f'# HELP {metric} {description}')
+                lines.append(f'# TYPE {metric} histogram')
+                for (name, method, route), histogram in sorted(self.histograms.items()):
+                    if name != metric:
+                        continue
+                    labels = f'method="{method}",route="{route}",{worker}'
+                    cumulative = 0
+                    for bound, count in zip(histogram.buckets + ('+Inf',), histogram.counts):
+                        cumulative += count
+                        lines.append(f'{metric}_bucket{{{labels},le="{bound}"}} {cumulative}')
+                    lines.append(f'{metric}_sum{{{labels}}} {histogram.sum}')
+                    lines.append(f'{metric}_count{{{labels}}} {histogram.count}')
+
+        for name, (description, value) in (samples or {}).items():
+            if value is None:
+                continue
+            lines.append(f'# HELP {name} {description}')
+            lines.append(f'# TYPE {name} {"counter" if name.endswith("_total") else "gauge"}')
+            lines.append(f'{name}{{{worker}}} {value}')
+        return '\n'.join(lines) + '\n'
+
+
+def begin_request():
+    '''starts counting the sql statements of the current request (returns the counters)'''
+
+    counters = [0, 0.0]
+    request_queries.set(counters)
+    return counters
+
+
+def count_queries(engine):
+    '''
+    Adds every statement an engine runs (and its duration) to the current request's counters
+    '''
+    @event.listens_for(engine, 'before_cursor_execute')
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('query_start', []).append(time.perf_counter())
+
+    @event.listens_for(engine, 'after_cursor_execute')
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info['query_start'].pop()
+        counters = request_queries.get()
+        if counters is not None:
+            counters[0] += 1
+            counters[1] += elapsed
+
+    @event.listens_for(engine, 'handle_error')
+    def handle_error(context):
+        #failed statements never reach after_cursor_execute
+        if context.connection is not None and context.connection.info.get('query_start'):
+            context.connection.info['query_start'].pop()
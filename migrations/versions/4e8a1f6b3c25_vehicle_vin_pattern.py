@@ -0,0 +1,27 @@
+"""vehicle vin pattern index
+
+Revision ID: 4e8a1f6b3c25
+Revises: 9c4d2e7f1a36
+Create Date: 2026-10-18 18:12:47.203915
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '4e8a1f6b3c25'
+down_revision = '9c4d2e7f1a36'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    #?vin_prefix= range scans, sqlite's binary primary key already orders vins the same way
+    if op.get_bind().dialect.name == 'postgresql':
+        op.create_index('ix_vehicles_vin_pattern', 'vehicles', ['vin'], unique=False, postgresql_ops={'vin': 'varchar_pattern_ops'})
+
+
+def downgrade():
+    if op.get_bind().dialect.name == 'postgresql':
+        op.drop_index('ix_vehicles_vin_pattern', table_name='vehicles')
@@ -0,0 +1,49 @@
+"""vehicle search
+
+Revision ID: 9c4d2e7f1a36
+Revises: 7b2e5d1c9a84
+Create Date: 2026-10-18 16:40:03.512877
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9c4d2e7f1a36'
+down_revision = '7b2e5d1c9a84'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    dialect = op.get_bind().dialect.name
+
+    if dialect == 'postgresql':
+        #trigram gist index over the searched columns (the expression must match queries.search_document)
+        op.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+        op.execute(
+            "CREATE INDEX ix_vehicles_search_trgm ON vehicles USING gist (("
+            "coalesce(manufacturer_name, '') || ' ' || coalesce(model_name, '') || ' ' || "
+            "coalesce(color, '') || ' ' || coalesce(category, '')) gist_trgm_ops)"
+        )
+
+    elif dialect == 'sqlite':
+        #fts5 trigram table sharing the vehicles' rowids, filled from the existing vehicles
+        op.execute(
+            "CREATE VIRTUAL TABLE vehicle_search USING fts5("
+            "vin UNINDEXED, manufacturer_name, model_name, color, category, tokenize='trigram')"
+        )
+        op.execute(
+            "INSERT INTO vehicle_search (rowid, vin, manufacturer_name, model_name, color, category) "
+            "SELECT rowid, vin, manufacturer_name, model_name, color, category FROM vehicles"
+        )
+
+
+def downgrade():
+    dialect = op.get_bind().dialect.name
+
+    if dialect == 'postgresql':
+        op.execute("DROP INDEX ix_vehicles_search_trgm")
+    elif dialect == 'sqlite':
+        op.execute("DROP TABLE vehicle_search")
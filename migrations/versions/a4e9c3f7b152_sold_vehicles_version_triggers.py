@@ -0,0 +1,52 @@
+"""sold vehicles version triggers
+
+Revision ID: a4e9c3f7b152
+Revises: f3b8d1e6a4c7
+Create Date: 2026-10-19 16:02:11.381945
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a4e9c3f7b152'
+down_revision = 'f3b8d1e6a4c7'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    dialect = op.get_bind().dialect.name
+
+    #bumps table_versions' sold_vehicles row on every sale write (nothing did, so /vehicle_sold etags only
+    #changed with the vehicles), the same triggers queries.SOLD_VERSION_DDL creates with the table
+    if dialect == 'postgresql':
+        op.execute(
+            "CREATE OR REPLACE FUNCTION bump_sold_vehicles_version() RETURNS trigger AS $$ BEGIN "
+            "INSERT INTO table_versions (name, version) VALUES ('sold_vehicles', 1) "
+            "ON CONFLICT (name) DO UPDATE SET version = table_versions.version + 1; "
+            "RETURN NULL; END $$ LANGUAGE plpgsql"
+        )
+        op.execute(
+            "CREATE TRIGGER sold_vehicles_version AFTER INSERT OR UPDATE OR DELETE ON sold_vehicles "
+            "FOR EACH STATEMENT EXECUTE FUNCTION bump_sold_vehicles_version()"
+        )
+    elif dialect == 'sqlite':
+        for operation in ('INSERT', 'UPDATE', 'DELETE'):
+            op.execute(
+                f"CREATE TRIGGER sold_vehicles_version_{operation.lower()} AFTER {operation} ON sold_vehicles BEGIN "
+                "INSERT INTO table_versions (name, version) VALUES ('sold_vehicles', 1) "
+                "ON CONFLICT (name) DO UPDATE SET version = version + 1; END"
+            )
+
+
+def downgrade():
+    dialect = op.get_bind().dialect.name
+
+    if dialect == 'postgresql':
+        op.execute("DROP TRIGGER sold_vehicles_version ON sold_vehicles")
+        op.execute("DROP FUNCTION bump_sold_vehicles_version()")
+    elif dialect == 'sqlite':
+        for operation in ('insert', 'update', 'delete'):
+            op.execute(f"DROP TRIGGER sold_vehicles_version_{operation}")
@@ -0,0 +1,53 @@
+"""sold vehicles created_at
+
+Revision ID: c7f2a9e4d318
+Revises: a4e9c3f7b152
+Create Date: 2026-10-20 10:37:05.218460
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c7f2a9e4d318'
+down_revision = 'a4e9c3f7b152'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    #added nullable and backfilled first (sqlite cannot add a column with a non-constant default), the
+    #existing sales all get the migration's time so the next incremental export sends them once more
+    with op.batch_alter_table('sold_vehicles', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('created_at', sa.DateTime(timezone=True), nullable=True))
+
+    op.execute("UPDATE sold_vehicles SET created_at = CURRENT_TIMESTAMP")
+
+    with op.batch_alter_table('sold_vehicles', schema=None) as batch_op:
+        batch_op.alter_column('created_at', existing_type=sa.DateTime(timezone=True), nullable=False, server_default=sa.func.now())
+        batch_op.create_index('ix_sold_vehicles_created_at', ['created_at'], unique=False)
+
+    recreate_sqlite_version_triggers()
+
+
+def downgrade():
+    with op.batch_alter_table('sold_vehicles', schema=None) as batch_op:
+        batch_op.drop_index('ix_sold_vehicles_created_at')
+        batch_op.drop_column('created_at')
+
+    recreate_sqlite_version_triggers()
+
+
+def recreate_sqlite_version_triggers():
+    #sqlite's batch mode rebuilds the table, which drops a4e9c3f7b152's triggers with it
+    if op.get_bind().dialect.name != 'sqlite':
+        return
+
+    for operation in ('INSERT', 'UPDATE', 'DELETE'):
+        op.execute(f"DROP TRIGGER IF EXISTS sold_vehicles_version_{operation.lower()}")
+        op.execute(
+            f"CREATE TRIGGER sold_vehicles_version_{operation.lower()} AFTER {operation} ON sold_vehicles BEGIN "
+            "INSERT INTO table_versions (name, version) VALUES ('sold_vehicles', 1) "
+            "ON CONFLICT (name) DO UPDATE SET version = version + 1; END"
+        )
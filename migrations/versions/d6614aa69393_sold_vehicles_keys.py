@@ -0,0 +1,79 @@
+"""sold vehicles keys
+
+Revision ID: d6614aa69393
+Revises: c18953315f71
+Create Date: 2026-10-18 09:12:41.203517
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd6614aa69393'
+down_revision = 'c18953315f71'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    bind = op.get_bind()
+    inspector = sa.inspect(bind)
+
+    #color/category (and sold_vehicles) predate the migrations on databases created from the models
+    vehicle_columns = {column['name'] for column in inspector.get_columns('vehicles')}
+    with op.batch_alter_table('vehicles', schema=None) as batch_op:
+        for name in ('color', 'category'):
+            if name not in vehicle_columns:
+                batch_op.add_column(sa.Column(name, sa.String(), nullable=True))
+
+    if not inspector.has_table('sold_vehicles'):
+        op.create_table('sold_vehicles',
+        sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+        sa.Column('vin', sa.String(), nullable=False),
+        sa.Column('purchase_price', sa.Float(), nullable=True),
+        sa.Column('insurance_policy', sa.String(), nullable=True),
+        sa.Column('car_damage', sa.Float(), nullable=True),
+        sa.ForeignKeyConstraint(['vin'], ['vehicles.vin'], name='sold_vehicles_vin_fkey'),
+        sa.PrimaryKeyConstraint('id')
+        )
+        op.create_index('ix_sold_vehicles_vin', 'sold_vehicles', ['vin'], unique=False)
+        return
+
+    #the existing table has no key: sales whose vin is missing (or not in vehicles) can't take the foreign
+    #key, they are reported rather than deleted so nobody loses sales to a deploy
+    orphans = bind.execute(sa.text(
+        "SELECT DISTINCT sold_vehicles.vin FROM sold_vehicles "
+        "LEFT JOIN vehicles ON vehicles.vin = sold_vehicles.vin WHERE vehicles.vin IS NULL"
+    )).scalars().all()
+    if orphans:
+        raise RuntimeError(
+            f"{len(orphans)} sold vins have no vehicle ({', '.join(map(repr, orphans[:10]))}), "
+            "add the vehicles or delete those sales, then upgrade again"
+        )
+
+    sold_columns = {column['name'] for column in inspector.get_columns('sold_vehicles')}
+    if bind.dialect.name == 'postgresql':
+        if 'id' not in sold_columns:
+            #numbers the existing sales, new ones continue from the identity
+            op.execute("ALTER TABLE sold_vehicles ADD COLUMN id INTEGER GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY")
+        op.alter_column('sold_vehicles', 'vin', existing_type=sa.String(), nullable=False)
+        op.create_foreign_key('sold_vehicles_vin_fkey', 'sold_vehicles', 'vehicles', ['vin'], ['vin'])
+        op.create_index('ix_sold_vehicles_vin', 'sold_vehicles', ['vin'], unique=False)
+    else:
+        #sqlite rebuilds the table, the copied rows are numbered by the new INTEGER PRIMARY KEY
+        with op.batch_alter_table('sold_vehicles', schema=None, recreate='always') as batch_op:
+            if 'id' not in sold_columns:
+                batch_op.add_column(sa.Column('id', sa.Integer(), primary_key=True, autoincrement=True))
+            batch_op.alter_column('vin', existing_type=sa.String(), nullable=False)
+            batch_op.create_foreign_key('sold_vehicles_vin_fkey', 'vehicles', ['vin'], ['vin'])
+            batch_op.create_index('ix_sold_vehicles_vin', ['vin'], unique=False)
+
+
+def downgrade():
+    #takes the keys off again but keeps every sale, and the vehicles' color/category which databases created
+    #from the models already had before this revision
+    with op.batch_alter_table('sold_vehicles', schema=None) as batch_op:
+        batch_op.drop_index('ix_sold_vehicles_vin')
+        batch_op.drop_constraint('sold_vehicles_vin_fkey', type_='foreignkey')
+        batch_op.drop_column('id')
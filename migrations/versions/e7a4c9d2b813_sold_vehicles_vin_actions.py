@@ -0,0 +1,52 @@
+"""sold vehicles vin actions
+
+Revision ID: e7a4c9d2b813
+Revises: b5d3a8e2f617
+Create Date: 2026-10-19 10:04:37.518290
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e7a4c9d2b813'
+down_revision = 'b5d3a8e2f617'
+branch_labels = None
+depends_on = None
+
+
+def sold_vehicles(ondelete, onupdate):
+    '''the sold_vehicles table with the given actions on its vin key (sqlite rebuilds the table from it)'''
+
+    return sa.Table('sold_vehicles', sa.MetaData(),
+        sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+        sa.Column('vin', sa.String(), nullable=False),
+        sa.Column('purchase_price', sa.Float(), nullable=True),
+        sa.Column('insurance_policy', sa.String(), nullable=True),
+        sa.Column('car_damage', sa.Float(), nullable=True),
+        sa.ForeignKeyConstraint(['vin'], ['vehicles.vin'], name='sold_vehicles_vin_fkey', ondelete=ondelete, onupdate=onupdate),
+        sa.PrimaryKeyConstraint('id'),
+        sa.Index('ix_sold_vehicles_vin', 'vin'),
+    )
+
+
+def replace_vin_key(ondelete, onupdate):
+    if op.get_bind().dialect.name == 'postgresql':
+        op.drop_constraint('sold_vehicles_vin_fkey', 'sold_vehicles', type_='foreignkey')
+        op.create_foreign_key(
+            'sold_vehicles_vin_fkey', 'sold_vehicles', 'vehicles', ['vin'], ['vin'],
+            ondelete=ondelete, onupdate=onupdate
+        )
+    else:
+        with op.batch_alter_table('sold_vehicles', copy_from=sold_vehicles(ondelete, onupdate), recreate='always'):
+            pass
+
+
+def upgrade():
+    #a sold vehicle cannot be deleted, a vin correction cascades into its sales
+    replace_vin_key('RESTRICT', 'CASCADE')
+
+
+def downgrade():
+    replace_vin_key(None, None)
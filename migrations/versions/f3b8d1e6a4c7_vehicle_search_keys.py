@@ -0,0 +1,44 @@
+"""vehicle search keys
+
+Revision ID: f3b8d1e6a4c7
+Revises: e7a4c9d2b813
+Create Date: 2026-10-19 14:21:52.604118
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f3b8d1e6a4c7'
+down_revision = 'e7a4c9d2b813'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    if op.get_bind().dialect.name != 'sqlite':
+        return
+
+    #keys the fts5 table by an INTEGER PRIMARY KEY per vin instead of the vehicles' rowids, which VACUUM
+    #and table rebuilds renumber, then rebuilds the index from the vehicles
+    op.execute("CREATE TABLE vehicle_search_keys (id INTEGER PRIMARY KEY, vin VARCHAR NOT NULL UNIQUE)")
+    op.execute("INSERT INTO vehicle_search_keys (vin) SELECT vin FROM vehicles ORDER BY vin")
+    op.execute("DELETE FROM vehicle_search")
+    op.execute(
+        "INSERT INTO vehicle_search (rowid, vin, manufacturer_name, model_name, color, category) "
+        "SELECT keys.id, vehicles.vin, manufacturer_name, model_name, color, category "
+        "FROM vehicles JOIN vehicle_search_keys AS keys ON keys.vin = vehicles.vin"
+    )
+
+
+def downgrade():
+    if op.get_bind().dialect.name != 'sqlite':
+        return
+
+    op.execute("DROP TABLE vehicle_search_keys")
+    op.execute("DELETE FROM vehicle_search")
+    op.execute(
+        "INSERT INTO vehicle_search (rowid, vin, manufacturer_name, model_name, color, category) "
+        "SELECT rowid, vin, manufacturer_name, model_name, color, category FROM vehicles"
+    )
@@ -0,0 +1,180 @@
+import logging
+import os
+import threading
+import time
+
+from sqlalchemy import event, exc, text
+from sqlalchemy.pool import QueuePool
+
+logger = logging.getLogger(__name__)
+
+#seconds for the recent checkout wait to halve once checkouts stop waiting
+RECENT_WAIT_HALF_LIFE = 1.0
+
+
+class PoolStats:
+    '''
+    Checkout counters for one engine's connection pool
+
+    Attributes:
+        checkouts (int): the number of connections handed out
+        timeouts (int): the number of checkouts that gave up after pool_timeout
+        total_wait (float): the seconds spent waiting for connections, over every checkout
+        max_wait (float): the longest single checkout wait, in seconds
+        recent_wait (float): the longest recent wait, decaying by half every RECENT_WAIT_HALF_LIFE seconds
+            (read it through recent_wait_seconds, admission control sheds load on it)
+    '''
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.checkouts = 0
+        self.timeouts = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self.recent_wait = 0.0
+        self.recent_at = time.monotonic()
+
+    def _decayed_wait(self, now):
+        return self.recent_wait * 0.5 ** ((now - self.recent_at) / RECENT_WAIT_HALF_LIFE)
+
+    def recent_wait_seconds(self):
+        '''returns how long checkouts have recently been waiting (0 once the pool has been quiet for a while)'''
+
+        with self.lock:
+            return self._decayed_wait(time.monotonic())
+
+    def record(self, wait, timed_out=False):
+        '''adds one checkout (or one checkout timeout) to the counters'''
+
+        with self.lock:
+            now = time.monotonic()
+            self.recent_wait = max(wait, self._decayed_wait(now))
+            self.recent_at = now
+            if timed_out:
+                self.timeouts += 1
+            else:
+                self.checkouts += 1
+            self.total_wait += wait
+            self.max_wait = max(self.max_wait, wait)
+
+    def snapshot(self, pool):
+        '''returns the counters alongside the pool's live in-use/overflow gauges'''
+
+        with self.lock:
+            stats = {
+                "checkouts": self.checkouts,
+                "timeouts": self.timeouts,
+                "total_wait_seconds": self.total_wait,
+                "max_wait_seconds": self.max_wait,
+                "recent_wait_seconds": self._decayed_wait(time.monotonic()),
+            }
+
+        #only queue pools track sizes (sqlite's static/singleton pools do not)
+        if isinstance(pool, QueuePool):
+            stats.update(
+                pool_size=pool.size(),
+                in_use=pool.checkedout(),
+                idle=pool.checkedin(),
+                overflow=max(0, pool.overflow()),
+            )
+        return stats
+
+
+class TimedQueuePool(QueuePool):
+    '''
+    QueuePool that records how long every checkout waits for a free slot (subclassed per app with a stats
+    attribute), leaving out the time spent opening new connections, pinging and recycling them: admission
+    control sheds load on the wait, which a slow connect or tls handshake says nothing about
+    '''
+    stats = None
+    #seconds the current thread's checkout spent in _create_connection (only a pool slot is waited on)
+    connecting = threading.local()
+
+    def _do_get(self):
+        start = time.perf_counter()
+        self.connecting.seconds = 0.0
+        try:
+            record = super()._do_get()
+        except exc.TimeoutError:
+            self.stats.record(time.perf_counter() - start, timed_out=True)
+            raise
+        self.stats.record(time.perf_counter() - start - self.connecting.seconds)
+        return record
+
+    def _create_connection(self):
+        start = time.perf_counter()
+        try:
+            return super()._create_connection()
+        finally:
+            self.connecting.seconds = getattr(self.connecting, 'seconds', 0.0) + time.perf_counter() - start
+
+
+def pool_config():
+    '''
+    Reads the connection pool settings from the environment
+    '''
+    return {
+        'DB_POOL_SIZE': int(os.getenv('DB_POOL_SIZE', 5)),
+        'DB_MAX_OVERFLOW': int(os.getenv('DB_MAX_OVERFLOW', 10)),
+        'DB_POOL_TIMEOUT': float(os.getenv('DB_POOL_TIMEOUT', 10)),
+        'DB_POOL_RECYCLE': int(os.getenv('DB_POOL_RECYCLE', 1800)),
+        'DB_POOL_PRE_PING': os.getenv('DB_POOL_PRE_PING', 'true').lower() == 'true',
+        'DB_CONNECT_TIMEOUT': int(os.getenv('DB_CONNECT_TIMEOUT', 5)),
+        'DB_POOL_WARM': int(os.getenv('DB_POOL_WARM', 0)),
+    }
+
+
+def engine_options(config, stats):
+    '''
+    Builds create_engine options from an app's pool settings
+    (sqlite keeps flask-sqlalchemy's own pool, since its pools cannot be sized)
+    '''
+    if config['SQLALCHEMY_DATABASE_URI'].startswith('sqlite'):
+        return {}
+
+    options = {
+        'poolclass': type('TimedQueuePool', (TimedQueuePool,), {'stats': stats}),
+        'pool_size': config['DB_POOL_SIZE'],
+        'max_overflow': config['DB_MAX_OVERFLOW'],
+        'pool_timeout': config['DB_POOL_TIMEOUT'],
+        'pool_recycle': config['DB_POOL_RECYCLE'],
+        'pool_pre_ping': config['DB_POOL_PRE_PING'],
+    }
+    if config['SQLALCHEMY_DATABASE_URI'].startswith('postgresql'):
+        #fail fast instead of hanging on a dead host (e.g. mid rds failover)
+        options['connect_args'] = {'connect_timeout': config['DB_CONNECT_TIMEOUT']}
+    return options
+
+
+def enforce_foreign_keys(engine):
+    '''
+    Turns on sqlite's foreign key checks for every connection an engine opens (sqlite only enforces them
+    when asked, per connection, postgres always does), so the sold_vehicles actions behave the same on both
+    '''
+    if engine.dialect.name != 'sqlite':
+        return
+
+    @event.listens_for(engine, 'connect')
+    def foreign_keys_on(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute('PRAGMA foreign_keys=ON')
+        cursor.close()
+
+
+def warm_pool(engine, size):
+    '''
+    Opens up to size connections and returns them to the pool, so the first requests don't pay for them
+    (failures are logged, not raised, so a worker still boots while the database is unreachable)
+    '''
+    connections = []
+    try:
+        for _ in range(size):
+            connection = engine.connect()
+            connections.append(connection)
+            connection.execute(text('SELECT 1'))
+    except exc.SQLAlchemyError as error:
+        logger.warning("could not warm the connection pool: %s", error)
+    finally:
+        for connection in connections:
+            connection.close()
+    return len(connections)
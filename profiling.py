@@ -0,0 +1,99 @@
+import cProfile
+import functools
+import hmac
+import os
+import pstats
+import random
+import time
+
+from flask import request
+
+
+def profile_label(function):
+    '''names a pstats function entry for a collapsed stack (module:function:line)'''
+
+    filename, line, name = function
+    module = os.path.splitext(os.path.basename(filename))[0] if filename != '~' else 'builtins'
+    return f'{module}:{name}:{line}'.replace(';', ':').replace(' ', '_')
+
+
+def collapsed_stacks(stats, min_microseconds=1):
+    '''
+    Rebuilds collapsed ("a;b;c microseconds") flamegraph stacks from a profile's call graph
+
+    cProfile only records caller -> callee edges, so a function's time is split across the paths
+    reaching it in proportion to each edge's cumulative time (exact unless a function is shared
+    by paths with very different costs)
+    '''
+    callees = {}
+    for function, (_, _, _, _, callers) in stats.items():
+        for caller, edge in callers.items():
+            callees.setdefault(caller, {})[function] = edge[3]
+
+    lines = {}
+
+    def walk(function, stack, path_time):
+        _, _, own_time, total_time, _ = stats[function]
+        share = path_time / total_time if total_time else 0.0
+        stack = stack + [profile_label(function)]
+
+        self_time = round(own_time * share * 1e6)
+        if self_time >= min_microseconds:
+            key = ';'.join(stack)
+            lines[key] = lines.get(key, 0) + self_time
+
+        for callee, edge_time in callees.get(function, {}).items():
+            #recursion is folded into the frame already on the stack
+            if profile_label(callee) in stack or callee not in stats:
+                continue
+            if edge_time * share * 1e6 >= min_microseconds:
+                walk(callee, stack, edge_time * share)
+
+    roots = [function for function, entry in stats.items() if not any(caller in stats for caller in entry[4])]
+    for root in roots:
+        walk(root, [], stats[root][3])
+    return [f'{stack} {microseconds}' for stack, microseconds in sorted(lines.items())]
+
+
+def profile_views(app):
+    '''
+    Wraps every view registered on app with an opt-in cProfile, writing <id>.pstats and <id>.collapsed
+    (feed the latter to flamegraph.pl or speedscope) to PROFILE_DIR
+
+    A request is profiled when its X-Profile header matches PROFILE_TOKEN, or at random for a
+    PROFILE_SAMPLE_RATE fraction of requests, the rest only pay for that check
+    '''
+    directory = app.config['PROFILE_DIR']
+    token = app.config['PROFILE_TOKEN']
+    sample_rate = app.config['PROFILE_SAMPLE_RATE']
+
+    def triggered():
+        if token and hmac.compare_digest(request.headers.get('X-Profile', ''), token):
+            return True
+        return sample_rate > 0 and random.random() < sample_rate
+
+    def profiled(endpoint, view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            if not triggered():
+                return view(*args, **kwargs)
+
+            profile = cProfile.Profile()
+            result = profile.runcall(view, *args, **kwargs)
+            #responses are finalized (jsonify included) inside the view, so the profile covers encoding too
+            response = app.make_response(result)
+
+            profile_id = f'{time.strftime("%Y%m%d-%H%M%S")}-{request.method}-{endpoint}-{os.getpid()}-{random.getrandbits(32):08x}'
+            os.makedirs(directory, exist_ok=True)
+            path = os.path.join(directory, profile_id)
+            profile.dump_stats(path + '.pstats')
+            with open(path + '.collapsed', 'w') as file:
+                file.write('\n'.join(collapsed_stacks(pstats.Stats(profile).stats)) + '\n')
+
+            response.headers['X-Profile-Id'] = profile_id
+            return response
+        return wrapper
+
+    for endpoint, view in list(app.view_functions.items()):
+        if endpoint != 'static':
+            app.view_functions[endpoint] = profiled(endpoint, view)
@@ -0,0 +1,647 @@
+'''
+Statement builders shared by the flask (app.py) and asgi (asgi.py) apps
+
+Nothing here touches a session or a request, so both apps execute the same sql
+'''
+from datetime import timedelta
+
+from sqlalchemy import bindparam, case, column, delete, func, insert, literal, literal_column, select, table, text, tuple_, update
+
+from helper import (
+    dialect_insert, parse_fields, parse_page_args, parse_since, parse_vehicle_filters, parse_vehicle_sort,
+    parse_vin_prefix, utcnow
+)
+
+
+def vin_prefix_condition(dialect_name, Vehicle, prefix):
+    '''
+    Matches the vins starting with prefix as an index range scan: [prefix, prefix with its last character bumped)
+    Postgres compares with the pattern operators so ix_vehicles_vin_pattern is used whatever the collation
+    (and whether or not the plan is generic), sqlite's binary primary key orders the same way
+    '''
+    upper = prefix[:-1] + chr(ord(prefix[-1]) + 1)
+    if dialect_name == 'postgresql':
+        return Vehicle.vin.op('~>=~')(prefix) & Vehicle.vin.op('~<~')(upper)
+    return (Vehicle.vin >= prefix) & (Vehicle.vin < upper)
+
+
+def vehicle_list_query(Vehicle, dialect_name, args, default_limit, max_limit):
+    '''
+    Compiles GET /vehicle's query string into one select of plain columns
+    (returns the query, the fields to serialize, the page size and an error message)
+    '''
+    limit, after, error = parse_page_args(args, default_limit, max_limit)
+    if error:
+        return None, None, None, error
+
+    conditions, error = parse_vehicle_filters(args, Vehicle)
+    if error:
+        return None, None, None, error
+
+    vin_prefix, error = parse_vin_prefix(args)
+    if error:
+        return None, None, None, error
+    if vin_prefix is not None:
+        conditions.append(vin_prefix_condition(dialect_name, Vehicle, vin_prefix))
+
+    sort, descending, error = parse_vehicle_sort(args)
+    if error:
+        return None, None, None, error
+
+    fields, error = parse_fields(args, Vehicle.__table__.columns.keys(), Vehicle.serialized_columns)
+    if error:
+        return None, None, None, error
+
+    #orders by the sort column with vin as a tie breaker so the cursor stays a vin
+    sort_key = tuple_(getattr(Vehicle, sort), Vehicle.vin) if sort != 'vin' else Vehicle.vin
+    order = [getattr(Vehicle, sort), Vehicle.vin] if sort != 'vin' else [Vehicle.vin]
+    if descending:
+        order = [column.desc() for column in order]
+
+    #selects only the requested columns (plus vin for the cursor) so rows never become orm objects
+    columns = fields if 'vin' in fields else fields + ['vin']
+    query = select(*[getattr(Vehicle, column) for column in columns]).where(*conditions).order_by(*order)
+    if after is not None:
+        #keyset seek: continue after the (sort value, vin) of the cursor's row
+        if sort != 'vin':
+            cursor = select(getattr(Vehicle, sort), Vehicle.vin).where(Vehicle.vin == after).scalar_subquery()
+        else:
+            cursor = after
+        query = query.where(sort_key < cursor if descending else sort_key > cursor)
+
+    return query, fields, limit, None
+
+
+def vehicle_page(rows, fields, limit):
+    '''
+    Splits rows fetched with limit + 1 into the page's vehicles and the next cursor (None on the last page)
+    '''
+    next_cursor = rows[limit - 1].vin if len(rows) > limit else None
+    return [dict(zip(fields, row)) for row in rows[:limit]], next_cursor
+
+
+def vehicle_batch_query(Vehicle, fields):
+    '''
+    Selects the requested fields (plus vin) of the vehicles in one chunk of vins, bound as :vins
+    (one statement is compiled and cached for every chunk, only the expanded IN list changes)
+    '''
+    columns = fields if 'vin' in fields else fields + ['vin']
+    return select(*[getattr(Vehicle, column) for column in columns]).where(Vehicle.vin.in_(bindparam('vins', expanding=True)))
+
+
+def vehicle_batch(rows, fields, vins):
+    '''
+    Orders the rows of a batch get like the requested vins and lists the vins that were not found
+    '''
+    found = {row.vin: dict(zip(fields, row)) for row in rows}
+    return {
+        "vehicles": [found[vin] for vin in vins if vin in found],
+        "missing": [vin for vin in vins if vin not in found],
+    }
+
+
+def sold_list_query(Vehicle, Vehicle_sold, args, default_limit, max_limit):
+    '''
+    Compiles GET /vehicle_sold's query string into a single join of sales and vehicles
+    (returns the query, the fields to serialize, the page size and an error message)
+    '''
+    limit, after, error = parse_page_args(args, default_limit, max_limit, cursor=int)
+    if error:
+        return None, None, None, error
+
+    fields, error = parse_fields(
+        args,
+        Vehicle.__table__.columns.keys() + ['sale'],
+        Vehicle.serialized_columns + ['sale']
+    )
+    if error:
+        return None, None, None, error
+
+    #selects only the requested columns (plus the sale id for the cursor) as plain rows
+    sale_fields = Vehicle_sold.serialized_columns if 'sale' in fields else []
+    vehicle_fields = [field for field in fields if field != 'sale']
+    query = (
+        select(
+            Vehicle_sold.id,
+            *[getattr(Vehicle_sold, column) for column in sale_fields],
+            *[getattr(Vehicle, column) for column in vehicle_fields]
+        )
+        .join(Vehicle, Vehicle.vin == Vehicle_sold.vin)
+        .order_by(Vehicle_sold.id)
+    )
+    if after is not None:
+        query = query.where(Vehicle_sold.id > after)
+
+    return query, fields, limit, None
+
+
+def sold_page(rows, fields, limit, Vehicle_sold):
+    '''
+    Splits rows fetched with limit + 1 into the page's sold vehicles (sale data nested) and the next cursor
+    '''
+    next_cursor = str(rows[limit - 1][0]) if len(rows) > limit else None
+
+    sale_fields = Vehicle_sold.serialized_columns if 'sale' in fields else []
+    vehicle_fields = [field for field in fields if field != 'sale']
+    split = 1 + len(sale_fields)
+
+    vehicles_sold = []
+    for row in rows[:limit]:
+        vehicle_sold = dict(zip(vehicle_fields, row[split:]))
+        if sale_fields:
+            vehicle_sold['sale'] = dict(zip(sale_fields, row[1:split]))
+        vehicles_sold.append(vehicle_sold)
+    return vehicles_sold, next_cursor
+
+
+def vehicle_fields_query(Vehicle, vin, fields):
+    '''selects a vehicle's version and updated_at (its etag) followed by the requested fields'''
+
+    return select(Vehicle.version, Vehicle.updated_at, *[getattr(Vehicle, field) for field in fields]).where(Vehicle.vin == vin)
+
+
+def table_version_query(Table_version, names):
+    '''selects the change counters of tables'''
+
+    return select(Table_version.name, Table_version.version).where(Table_version.name.in_(names))
+
+
+def combine_versions(rows, names):
+    '''joins fetched change counters into one version string (tables without a counter count as 0)'''
+
+    versions = dict(rows)
+    return '.'.join(str(versions.get(name, 0)) for name in names)
+
+
+def bump_version_statement(Table_version, name):
+    '''bumps a table's change counter (a rowcount of 0 means the counter row still has to be added)'''
+
+    return update(Table_version).where(Table_version.name == name).values(version=Table_version.version + 1)
+
+
+def insert_vehicle_statement(dialect_name, Vehicle, values):
+    '''inserts a vehicle unless its vin exists, returning the new vehicle (or nothing on a conflict)'''
+
+    return (
+        dialect_insert(dialect_name, Vehicle)
+        .values(**values)
+        .on_conflict_do_nothing(index_elements=['vin'])
+        .returning(Vehicle)
+    )
+
+
+def insert_vehicles_statement(dialect_name, Vehicle):
+    '''
+    Inserts many vehicles (executed with a list of rows) as multi-row inserts, skipping vins that exist
+    and returning only the new vehicles
+    '''
+    return (
+        dialect_insert(dialect_name, Vehicle)
+        .on_conflict_do_nothing(index_elements=['vin'])
+        .returning(Vehicle)
+    )
+
+
+def insert_new_vins_statement(dialect_name, Vehicle):
+    '''like insert_vehicles_statement, returning just the vins that were new'''
+
+    return (
+        dialect_insert(dialect_name, Vehicle)
+        .on_conflict_do_nothing(index_elements=['vin'])
+        .returning(Vehicle.vin)
+    )
+
+
+def update_vehicle_statement(Vehicle, vin, values):
+    '''updates a vehicle's columns and bumps its version, returning the updated vehicle'''
+
+    return (
+        update(Vehicle).where(Vehicle.vin == vin)
+        .values(**values, version=Vehicle.version + 1)
+        .returning(Vehicle)
+    )
+
+
+def delete_vehicle_statement(Vehicle, vin):
+    '''deletes a vehicle, returning its vin followed by its statistics row (see stats_columns)'''
+
+    return delete(Vehicle).where(Vehicle.vin == vin).returning(Vehicle.vin, *stats_columns(Vehicle))
+
+
+def patch_values(vehicle_request, new_vin):
+    '''
+    Picks the columns a (validated) patch request changes
+    '''
+    potential_inputs = ["vin", "manufacturer_name", "horse_power", "model_name", "model_year", "purchase_price", "fuel_type", "color", "category"]
+    values = {input: vehicle_request[input] for input in potential_inputs if input in vehicle_request}
+    if 'vin' in values:
+        values['vin'] = new_vin
+    if 'purchase_price' in values:
+        values['purchase_price'] = round(values['purchase_price'], 2)
+    return values
+
+
+#the dimensions inventory statistics are grouped by (in vehicle_stats' primary key order)
+STATS_DIMENSIONS = ["manufacturer_name", "model_year", "fuel_type"]
+
+
+def stats_columns(Vehicle):
+    '''the vehicle columns a statistics row is made of (its dimensions, then its purchase price)'''
+
+    return [getattr(Vehicle, dimension) for dimension in STATS_DIMENSIONS] + [Vehicle.purchase_price]
+
+
+def stats_row(vehicle):
+    '''picks a written vehicle's (or a vehicle column dict's) statistics row'''
+
+    if isinstance(vehicle, dict):
+        return tuple(vehicle.get(column) for column in STATS_DIMENSIONS + ["purchase_price"])
+    return tuple(getattr(vehicle, column) for column in STATS_DIMENSIONS + ["purchase_price"])
+
+
+def vehicle_stats_row_query(Vehicle, vin):
+    '''selects (and locks until the write commits) a vehicle's statistics row before it changes'''
+
+    return select(*stats_columns(Vehicle)).where(Vehicle.vin == vin).with_for_update()
+
+
+def stats_deltas(removed=(), added=()):
+    '''
+    Nets the statistics rows leaving and entering the vehicles table into per group changes
+    (returns {(manufacturer_name, model_year, fuel_type): [count change, purchase price sum change]})
+    '''
+    deltas = {}
+    for sign, rows in ((-1, removed), (1, added)):
+        for *group, price in rows:
+            if None in group:
+                continue
+            delta = deltas.setdefault(tuple(group), [0, 0.0])
+            delta[0] += sign
+            delta[1] += sign * (price or 0)
+    return {group: delta for group, delta in deltas.items() if delta[0] or delta[1]}
+
+
+def stats_delta_statement(dialect_name, Vehicle_stats, deltas):
+    '''applies stats_deltas to the rollup table in one statement (new groups are inserted)'''
+
+    statement = dialect_insert(dialect_name, Vehicle_stats).values([
+        {**dict(zip(STATS_DIMENSIONS, group)), "vehicle_count": count, "purchase_price_sum": price_sum}
+        for group, (count, price_sum) in deltas.items()
+    ])
+    return statement.on_conflict_do_update(
+        index_elements=STATS_DIMENSIONS,
+        set_={
+            "vehicle_count": Vehicle_stats.vehicle_count + statement.excluded.vehicle_count,
+            "purchase_price_sum": Vehicle_stats.purchase_price_sum + statement.excluded.purchase_price_sum,
+        }
+    )
+
+
+def stats_query(Vehicle_stats, args):
+    '''
+    Compiles GET /vehicle/stats' query string into an aggregate over the rollup table (never the vehicles)
+    (returns the query, the dimensions grouped by and an error message)
+    '''
+    group_by = args.get('group_by', ','.join(STATS_DIMENSIONS))
+    group_by = [dimension for dimension in group_by.split(',') if dimension]
+    if any(dimension not in STATS_DIMENSIONS for dimension in group_by) or len(set(group_by)) != len(group_by):
+        return None, None, f"'group_by' must be a comma separated list of {', '.join(STATS_DIMENSIONS)}"
+
+    conditions = [Vehicle_stats.vehicle_count > 0]
+    for dimension in STATS_DIMENSIONS:
+        if dimension in args:
+            value = args.get(dimension)
+            if dimension == 'model_year':
+                try:
+                    value = int(value)
+                except ValueError:
+                    return None, None, "'model_year' must be an integer"
+            conditions.append(getattr(Vehicle_stats, dimension) == value)
+
+    columns = [getattr(Vehicle_stats, dimension) for dimension in group_by]
+    query = (
+        select(*columns, func.sum(Vehicle_stats.vehicle_count), func.sum(Vehicle_stats.purchase_price_sum))
+        .where(*conditions)
+        .group_by(*columns)
+        .order_by(*columns)
+    )
+    return query, group_by, None
+
+
+def stats_page(rows, group_by):
+    '''builds GET /vehicle/stats' groups (with their vehicle count and average purchase price)'''
+
+    return [
+        {**dict(zip(group_by, row)), "count": row[-2], "average_purchase_price": round(row[-1] / row[-2], 2)}
+        for row in rows
+        if row[-2]
+    ]
+
+
+def rebuild_stats_statements(Vehicle, Vehicle_stats):
+    '''recomputes the whole rollup table from the vehicles (run in one transaction to recover from drift)'''
+
+    dimensions = [getattr(Vehicle, dimension) for dimension in STATS_DIMENSIONS]
+    return [
+        delete(Vehicle_stats),
+        insert(Vehicle_stats).from_select(
+            STATS_DIMENSIONS + ["vehicle_count", "purchase_price_sum"],
+            select(*dimensions, func.count(), func.coalesce(func.sum(Vehicle.purchase_price), 0.0))
+            .where(*[dimension.is_not(None) for dimension in dimensions])
+            .group_by(*dimensions)
+        ),
+    ]
+
+
+def vehicle_export_query(Vehicle, args, watermark_lag):
+    '''
+    Compiles GET /vehicle/export's query string into a select of every (or ?fields=) column ordered by vin
+    (returns the query, the exported columns, the watermark for the next ?since= and an error message)
+
+    updated_at is stamped when a write runs, not when it commits, so the watermark is watermark_lag seconds
+    before the export starts: writes still uncommitted then are caught by the next run as long as their
+    transactions are shorter than the lag. Runs overlap by the lag, consumers upsert rows by vin.
+    '''
+    conditions, error = parse_vehicle_filters(args, Vehicle)
+    if error:
+        return None, None, None, error
+
+    columns = Vehicle.__table__.columns.keys()
+    fields, error = parse_fields(args, columns, columns)
+    if error:
+        return None, None, None, error
+
+    #taken before reading, rows written during the export (or up to the lag before it) are exported again
+    watermark = utcnow() - timedelta(seconds=watermark_lag)
+    if 'since' in args:
+        try:
+            conditions.append(Vehicle.updated_at >= parse_since(args.get('since')))
+        except ValueError:
+            return None, None, None, "'since' must be an iso 8601 timestamp"
+
+    query = select(*[getattr(Vehicle, field) for field in fields]).where(*conditions).order_by(Vehicle.vin)
+    return query, [Vehicle.__table__.c[field] for field in fields], watermark.isoformat(), None
+
+
+def sold_export_query(Vehicle, Vehicle_sold, args, watermark_lag):
+    '''
+    Compiles GET /vehicle_sold/export's query string into a select of sales ordered by id (returns the query,
+    the exported columns, the watermark for the next ?since= and an error message)
+
+    Sale ids are drawn when a sale is inserted, not when it commits, so a lower id can become visible after a
+    higher one was exported: the watermark is created_at trailing the export's start by watermark_lag, like
+    vehicle_export_query's, and runs overlap by the lag, consumers upsert sales by id.
+    '''
+    vehicle_conditions, error = parse_vehicle_filters(args, Vehicle)
+    if error:
+        return None, None, None, error
+
+    columns = Vehicle_sold.__table__.columns.keys()
+    fields, error = parse_fields(args, columns, columns)
+    if error:
+        return None, None, None, error
+
+    #taken before reading, sales written during the export (or up to the lag before it) are exported again
+    watermark = utcnow() - timedelta(seconds=watermark_lag)
+    conditions = []
+    if 'since' in args:
+        try:
+            conditions.append(Vehicle_sold.created_at >= parse_since(args.get('since')))
+        except ValueError:
+            return None, None, None, "'since' must be an iso 8601 timestamp"
+
+    query = select(*[getattr(Vehicle_sold, field) for field in fields]).where(*conditions).order_by(Vehicle_sold.id)
+    if vehicle_conditions:
+        #vehicle filters select the sales of matching vehicles
+        query = query.join(Vehicle, Vehicle.vin == Vehicle_sold.vin).where(*vehicle_conditions)
+    return query, [Vehicle_sold.__table__.c[field] for field in fields], watermark.isoformat(), None
+
+
+#bumps the sold_vehicles change counter on every write to the table (sales are written outside this app, so
+#triggers keep GET /vehicle_sold's etag honest), created with the table (and by migration a4e9c3f7b152)
+SOLD_VERSION_DDL = {
+    'postgresql': [
+        "CREATE OR REPLACE FUNCTION bump_sold_vehicles_version() RETURNS trigger AS $$ BEGIN "
+        "INSERT INTO table_versions (name, version) VALUES ('sold_vehicles', 1) "
+        "ON CONFLICT (name) DO UPDATE SET version = table_versions.version + 1; "
+        "RETURN NULL; END $$ LANGUAGE plpgsql",
+        "CREATE TRIGGER sold_vehicles_version AFTER INSERT OR UPDATE OR DELETE ON sold_vehicles "
+        "FOR EACH STATEMENT EXECUTE FUNCTION bump_sold_vehicles_version()",
+    ],
+    #sqlite triggers run per row
+    'sqlite': [
+        f"CREATE TRIGGER IF NOT EXISTS sold_vehicles_version_{operation.lower()} AFTER {operation} ON sold_vehicles BEGIN "
+        "INSERT INTO table_versions (name, version) VALUES ('sold_vehicles', 1) "
+        "ON CONFLICT (name) DO UPDATE SET version = version + 1; END"
+        for operation in ('INSERT', 'UPDATE', 'DELETE')
+    ],
+}
+
+
+#the columns /vehicle/search matches against
+SEARCH_COLUMNS = ["manufacturer_name", "model_name", "color", "category"]
+
+#search indexes, created with the vehicles table (and by migrations 9c4d2e7f1a36 and f3b8d1e6a4c7)
+#postgres ranks with a trigram gist index (it can return the nearest rows in order, so a LIMIT stops early),
+#sqlite with an fts5 trigram table the write handlers keep in sync, keyed through vehicle_search_keys (an
+#INTEGER PRIMARY KEY per vin, which VACUUM and table rebuilds keep, unlike the vehicles' implicit rowids)
+SEARCH_DDL = {
+    'postgresql': [
+        "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+        "CREATE INDEX IF NOT EXISTS ix_vehicles_search_trgm ON vehicles USING gist (("
+        "coalesce(manufacturer_name, '') || ' ' || coalesce(model_name, '') || ' ' || "
+        "coalesce(color, '') || ' ' || coalesce(category, '')) gist_trgm_ops)",
+    ],
+    'sqlite': [
+        "CREATE TABLE IF NOT EXISTS vehicle_search_keys (id INTEGER PRIMARY KEY, vin VARCHAR NOT NULL UNIQUE)",
+        "CREATE VIRTUAL TABLE IF NOT EXISTS vehicle_search USING fts5("
+        "vin UNINDEXED, manufacturer_name, model_name, color, category, tokenize='trigram')",
+    ],
+}
+
+vehicle_search = table('vehicle_search', column('vin'), *[column(name) for name in SEARCH_COLUMNS], column('rank'))
+
+
+def search_document(Vehicle):
+    '''the text postgres searches, written exactly like ix_vehicles_search_trgm's expression so the index is used'''
+
+    document = func.coalesce(getattr(Vehicle, SEARCH_COLUMNS[0]), literal_column("''"))
+    for name in SEARCH_COLUMNS[1:]:
+        document = document.op('||')(literal_column("' '")).op('||')(func.coalesce(getattr(Vehicle, name), literal_column("''")))
+    return document
+
+
+def search_trigrams(q):
+    '''the distinct trigrams of a search term (a shorter term is its own only trigram)'''
+
+    term = q.lower()
+    return list(dict.fromkeys(term[index:index + 3] for index in range(max(len(term) - 2, 1))))
+
+
+def fts_query(q):
+    '''
+    Builds an fts5 trigram MATCH expression: the whole term, or any of its trigrams (so a typo only
+    costs the trigrams it touches and bm25 ranks rows sharing more trigrams higher)
+    '''
+    phrases = dict.fromkeys([q.lower()] + search_trigrams(q))
+    return ' OR '.join('"' + phrase.replace('"', '""') + '"' for phrase in phrases)
+
+
+def search_query(Vehicle, dialect_name, args, max_limit):
+    '''
+    Compiles GET /vehicle/search's query string into a ranked search (returns the query, the fields and an error message)
+    Prefix matches on the manufacturer or model rank first, then substring and typo tolerant (trigram) matches
+    '''
+    q = args.get('q', '').strip()
+    if len(q) < 3:
+        return None, None, "'q' must be at least 3 characters"
+
+    try:
+        limit = int(args.get('limit', 20))
+    except ValueError:
+        return None, None, "'limit' must be an integer"
+    if not 1 <= limit <= max_limit:
+        return None, None, f"'limit' must be between 1 and {max_limit}"
+
+    fields, error = parse_fields(args, Vehicle.__table__.columns.keys(), Vehicle.serialized_columns)
+    if error:
+        return None, None, error
+    columns = [getattr(Vehicle, field) for field in fields]
+
+    if dialect_name == 'postgresql':
+        document = search_document(Vehicle)
+        #ranked like sqlite's: prefix matches first, then by word similarity distance
+        prefix = case(
+            (Vehicle.manufacturer_name.istartswith(q, autoescape=True) | Vehicle.model_name.istartswith(q, autoescape=True), 1),
+            else_=0
+        )
+        query = (
+            select(*columns)
+            .where(literal(q).op('<%')(document) | document.icontains(q, autoescape=True))
+            .order_by(prefix.desc(), literal(q).op('<<->')(document))
+            .limit(limit)
+        )
+        return query, fields, None
+
+    #the MATCH finds rows sharing any trigram, a third of the term's trigrams must match to count
+    #(roughly pg_trgm's word similarity threshold, one typo still leaves most of a word's trigrams)
+    trigrams = search_trigrams(q)
+    document = func.lower(search_document(vehicle_search.c))
+    shared = sum(case((func.instr(document, trigram) > 0, 1), else_=0) for trigram in trigrams)
+    prefix = case(
+        (vehicle_search.c.manufacturer_name.istartswith(q, autoescape=True) | vehicle_search.c.model_name.istartswith(q, autoescape=True), 1),
+        else_=0
+    ).label('prefix')
+    ranked = (
+        select(vehicle_search.c.vin, prefix, vehicle_search.c.rank)
+        .where(literal_column('vehicle_search').op('MATCH')(fts_query(q)), shared * 3 >= len(trigrams))
+        .order_by(prefix.desc(), vehicle_search.c.rank)
+        .limit(limit)
+        .subquery()
+    )
+    query = select(*columns).join(ranked, ranked.c.vin == Vehicle.vin).order_by(ranked.c.prefix.desc(), ranked.c.rank)
+    return query, fields, None
+
+
+def search_index_statements():
+    '''(re)indexes vehicles (by vin) in sqlite's search table, run after they are written'''
+
+    return [
+        text(
+            "INSERT OR IGNORE INTO vehicle_search_keys (vin) SELECT vin FROM vehicles WHERE vin IN :vins"
+        ).bindparams(bindparam('vins', expanding=True)),
+        text(
+            "INSERT OR REPLACE INTO vehicle_search (rowid, vin, manufacturer_name, model_name, color, category) "
+            "SELECT keys.id, vehicles.vin, manufacturer_name, model_name, color, category "
+            "FROM vehicles JOIN vehicle_search_keys AS keys ON keys.vin = vehicles.vin WHERE vehicles.vin IN :vins"
+        ).bindparams(bindparam('vins', expanding=True)),
+    ]
+
+
+def search_unindex_statements():
+    '''drops vehicles (by vin) from sqlite's search table, run before they are deleted or renamed'''
+
+    return [
+        text(
+            "DELETE FROM vehicle_search WHERE rowid IN (SELECT id FROM vehicle_search_keys WHERE vin IN :vins)"
+        ).bindparams(bindparam('vins', expanding=True)),
+        text("DELETE FROM vehicle_search_keys WHERE vin IN :vins").bindparams(bindparam('vins', expanding=True)),
+    ]
+
+
+#operations recorded in the vehicle change log
+CHANGE_OPERATIONS = ('insert', 'update', 'delete')
+
+
+def change_log_rows(changes):
+    '''maps (vin, operation, version) changes onto vehicle_changes rows (deletes have no version)'''
+
+    return [{'vin': vin, 'operation': operation, 'version': version} for vin, operation, version in changes]
+
+
+def changes_query(Vehicle_change, Vehicle, args, default_limit, max_limit, last_event_id=None):
+    '''
+    Compiles GET /vehicle/changes' query string into a select of the changes after :since, oldest first
+    Each change carries the vehicle's current columns (nulls once it is deleted), so a mirror applies a
+    page without fetching the vehicles it names (returns the query, the fields, since, the page size and an error message)
+
+    since falls back to an sse client's Last-Event-ID, then to 0 (the start of the log)
+    '''
+    since = args.get('since', last_event_id if last_event_id is not None else 0)
+    try:
+        since = int(since)
+    except (TypeError, ValueError):
+        return None, None, None, None, "'since' must be a change id"
+    if since < 0:
+        return None, None, None, None, "'since' must be a change id"
+
+    try:
+        limit = int(args.get('limit', default_limit))
+    except ValueError:
+        return None, None, None, None, "'limit' must be a int"
+    if not 1 <= limit <= max_limit:
+        return None, None, None, None, f"'limit' must be between 1 and {max_limit}"
+
+    fields, error = parse_fields(args, Vehicle.__table__.columns.keys(), Vehicle.serialized_columns)
+    if error:
+        return None, None, None, None, error
+
+    query = (
+        select(
+            Vehicle_change.id, Vehicle_change.vin, Vehicle_change.operation, Vehicle_change.version,
+            Vehicle_change.changed_at, Vehicle.vin.label('current_vin'),
+            *[getattr(Vehicle, field) for field in fields]
+        )
+        .outerjoin(Vehicle, Vehicle.vin == Vehicle_change.vin)
+        .where(Vehicle_change.id > bindparam('since'))
+        .order_by(Vehicle_change.id)
+    )
+    return query, fields, since, limit, None
+
+
+def change_events(rows, fields):
+    '''turns change log rows into the feed's events'''
+
+    return [
+        {
+            "id": row.id,
+            "vin": row.vin,
+            "operation": row.operation,
+            "version": row.version,
+            "changed_at": row.changed_at.isoformat(),
+            "vehicle": dict(zip(fields, row[6:])) if row.current_vin is not None else None,
+        }
+        for row in rows
+    ]
+
+
+def changes_pruned_before(Vehicle_change, days):
+    '''selects the newest change older than days (the last id a prune removes)'''
+
+    return select(func.max(Vehicle_change.id)).where(Vehicle_change.changed_at < utcnow() - timedelta(days=days))
+
+
+def prune_changes_statement(Vehicle_change, last_id):
+    '''deletes the changes up to last_id (recorded by the caller as the 'vehicle_changes_pruned' watermark)'''
+
+    return delete(Vehicle_change).where(Vehicle_change.id <= last_id)
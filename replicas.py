@@ -0,0 +1,168 @@
+'''
+Read replica routing: GET requests to the list/lookup routes read from a replica, everything else (and any
+client that wrote within REPLICA_PIN_SECONDS) uses the primary
+
+Clients are pinned with a cookie and, for api clients that don't keep cookies, the same value in the
+X-Read-Primary-Until header: writes answer with it and a read sending it back is pinned too
+
+Replicas are flask-sqlalchemy binds (replica_0, replica_1, ...) that no model is bound to, so create_all
+and migrations never touch them, a request reaches one only through RoutingSession.get_bind
+'''
+import functools
+import itertools
+import logging
+import math
+import threading
+import time
+
+from flask import g, has_app_context, request
+from flask_sqlalchemy.session import Session
+from sqlalchemy import exc
+from sqlalchemy.pool import QueuePool
+
+from pool import PoolStats, engine_options
+
+logger = logging.getLogger(__name__)
+
+#cookie holding the time (unix seconds) until which a client that wrote reads from the primary
+PIN_COOKIE = 'read_primary_until'
+#header carrying the same time, for clients that echo it back instead of keeping cookies
+PIN_HEADER = 'X-Read-Primary-Until'
+
+
+def replica_binds(config):
+    '''
+    Builds SQLALCHEMY_BINDS entries for REPLICA_DATABASE_URIS, each pooled like the primary (with its own stats)
+    '''
+    return {
+        f'replica_{index}': {'url': uri, **engine_options({**config, 'SQLALCHEMY_DATABASE_URI': uri}, PoolStats())}
+        for index, uri in enumerate(config['REPLICA_DATABASE_URIS'])
+    }
+
+
+def pinned(cookie):
+    '''whether a pin cookie's value still sends its client to the primary'''
+
+    try:
+        return float(cookie) > time.time()
+    except (TypeError, ValueError):
+        return False
+
+
+def request_pinned(cookies, headers):
+    '''whether a request's pin cookie or pin header sends it to the primary'''
+
+    return pinned(cookies.get(PIN_COOKIE)) or pinned(headers.get(PIN_HEADER))
+
+
+def pin_cookie(seconds):
+    '''returns the set_cookie arguments pinning a client that just wrote to the primary for seconds'''
+
+    return {
+        'key': PIN_COOKIE,
+        'value': f'{time.time() + seconds:.3f}',
+        'max_age': math.ceil(seconds),
+        'httponly': True,
+        'samesite': 'Lax',
+    }
+
+
+class ReplicaSet:
+    '''
+    Picks the replica engine for a read, round robin or least loaded (fewest checked out connections, ties
+    rotate), skipping replicas that failed within retry_seconds (None when no replica is healthy)
+
+    Attributes:
+        engines (list): the replica engines (sync or async)
+        down_until (dict): engine -> the monotonic time it is tried again
+    '''
+
+    def __init__(self, engines, policy='round_robin', retry_seconds=30.0):
+        if policy not in ('round_robin', 'least_loaded'):
+            raise ValueError("REPLICA_POLICY must be 'round_robin' or 'least_loaded'")
+        self.engines = list(engines)
+        self.policy = policy
+        self.retry_seconds = retry_seconds
+        self.down_until = {}
+        self.lock = threading.Lock()
+        self.turns = itertools.count()
+
+    def healthy(self):
+        now = time.monotonic()
+        with self.lock:
+            return [engine for engine in self.engines if self.down_until.get(engine, 0) <= now]
+
+    def choose(self):
+        healthy = self.healthy()
+        if not healthy:
+            return None
+        start = next(self.turns) % len(healthy)
+        rotated = healthy[start:] + healthy[:start]
+        if self.policy == 'least_loaded':
+            return min(rotated, key=lambda engine: engine.pool.checkedout() if isinstance(engine.pool, QueuePool) else 0)
+        return rotated[0]
+
+    def mark_down(self, engine, error):
+        '''takes a replica out of rotation for retry_seconds'''
+
+        with self.lock:
+            self.down_until[engine] = time.monotonic() + self.retry_seconds
+        logger.warning("replica %s failed, reading from the primary for %ss: %s", engine.url, self.retry_seconds, error)
+
+
+class RoutingSession(Session):
+    '''
+    Flask-sqlalchemy session that sends every statement of a replica routed request (g.read_engine) to that replica
+    '''
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and has_app_context():
+            engine = g.get('read_engine')
+            if engine is not None:
+                return engine
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+def route_reads(app, replicas, endpoints):
+    '''
+    Wraps the endpoints' views so their GET requests read from a replica (unless the client is pinned),
+    and pins clients whose request wrote (g.wrote, set by bump_version) to the primary for REPLICA_PIN_SECONDS
+
+    A replica failing mid request is taken out of rotation and the view reruns on the primary
+    '''
+    db = app.extensions['sqlalchemy']
+
+    def routed(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            if request.method != 'GET':
+                return view(*args, **kwargs)
+            if request_pinned(request.cookies, request.headers):
+                #pinned reads also skip caches that may hold what the client wrote over
+                g.pinned = True
+                return view(*args, **kwargs)
+
+            engine = replicas.choose()
+            if engine is None:
+                return view(*args, **kwargs)
+
+            g.read_engine = engine
+            try:
+                return view(*args, **kwargs)
+            except exc.OperationalError as error:
+                db.session.rollback()
+                replicas.mark_down(engine, error)
+                g.read_engine = None
+                return view(*args, **kwargs)
+        return wrapper
+
+    for endpoint in endpoints:
+        app.view_functions[endpoint] = routed(app.view_functions[endpoint])
+
+    @app.after_request
+    def pin_writers(response):
+        if g.get('wrote'):
+            cookie = pin_cookie(app.config['REPLICA_PIN_SECONDS'])
+            response.set_cookie(**cookie)
+            response.headers[PIN_HEADER] = cookie['value']
+        return response
@@ -0,0 +1,121 @@
+TYPE_NAMES = {
+    str: 'string',
+    int: 'int',
+    float: 'float',
+    bool: 'bool',
+}
+
+
+class Field:
+    '''
+    One attribute of a schema
+
+    Attributes:
+        name (string): the key the attribute is stored under
+        types (type or tuple): the type(s) the attribute's value must be an instance of
+        required (bool): whether the attribute must be present (ignored for partial records)
+        nullable (bool): whether the attribute may be null
+    '''
+
+    def __init__(self, name, types, required=True, nullable=False):
+        self.name = name
+        self.types = types
+        self.required = required
+        self.nullable = nullable
+
+    @property
+    def type_error(self):
+        '''the error reported when the attribute has the wrong type'''
+
+        types = self.types if isinstance(self.types, tuple) else (self.types,)
+        names = ' or '.join(TYPE_NAMES.get(type, type.__name__) for type in reversed(types))
+        return f"'{self.name}' must be a {names}"
+
+
+class Schema:
+    '''
+    Declarative description of a json record, compiled once into a validator
+
+    The success path is a single generated boolean expression (no loops, no allocations),
+    error messages are only built once that expression fails
+    '''
+
+    def __init__(self, *fields):
+        self.fields = fields
+        self._is_valid = self._compile(partial=False)
+        self._is_valid_partial = self._compile(partial=True)
+
+    def _compile(self, partial):
+        '''generates a function returning True only for records with no errors'''
+
+        namespace = {}
+        conditions = []
+        for index, field in enumerate(self.fields):
+            key = repr(field.name)
+            namespace[f'types_{index}'] = field.types
+
+            value_ok = f'isinstance(record[{key}], types_{index})'
+            if field.nullable:
+                value_ok = f'(record[{key}] is None or {value_ok})'
+
+            if field.required and not partial:
+                conditions.append(f'({key} in record and {value_ok})')
+            else:
+                conditions.append(f'({key} not in record or {value_ok})')
+
+        source = 'def is_valid(record):\n    return ' + ' and '.join(conditions or ['True']) + '\n'
+        exec(compile(source, f'<schema {"partial" if partial else "full"}>', 'exec'), namespace)
+        return namespace['is_valid']
+
+    def validate(self, record, partial=False):
+        '''
+        Returns None for a valid record, otherwise every error message (missing attributes first)
+        partial only checks the attributes present in the record (for patches)
+        '''
+        if type(record) is dict and (self._is_valid_partial if partial else self._is_valid)(record):
+            return None
+        return self.errors(record, partial)
+
+    def errors(self, record, partial=False):
+        '''lists every error message for a record (the slow path, only taken on failure)'''
+
+        if not isinstance(record, dict):
+            return ["vehicle must be a json object"]
+
+        missing = []
+        malformed = []
+        for field in self.fields:
+            if field.name not in record:
+                if field.required and not partial:
+                    missing.append(f"{field.name} not in request")
+                continue
+
+            value = record[field.name]
+            if value is None and field.nullable:
+                continue
+            if not isinstance(value, field.types):
+                malformed.append(field.type_error)
+        return missing + malformed
+
+    def validate_many(self, records, partial=False):
+        '''validates a batch of records, returning {index: errors} for the invalid ones only'''
+
+        is_valid = self._is_valid_partial if partial else self._is_valid
+        return {
+            index: self.errors(record, partial)
+            for index, record in enumerate(records)
+            if not (type(record) is dict and is_valid(record))
+        }
+
+
+VEHICLE_SCHEMA = Schema(
+    Field('vin', str),
+    Field('manufacturer_name', str),
+    Field('horse_power', int),
+    Field('model_name', str),
+    Field('model_year', int),
+    Field('purchase_price', (float, int)),
+    Field('fuel_type', str),
+    Field('color', str, required=False, nullable=True),
+    Field('category', str, required=False, nullable=True),
+)
@@ -7,11 +7,12 @@ from app import create_app
 def app():
     '''create app with testing configurations'''
     
-    app, db, migrate = create_app({
+    app = create_app({
         "TESTING": True, 
         "SQLALCHEMY_DATABASE_URI": "sqlite:///:memory:", 
         "SQLALCHEMY_TRACK_MODIFICATIONS": False,
     })
+    db = app.extensions["sqlalchemy"]
 
     with app.app_context():
         db.create_all()
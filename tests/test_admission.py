@@ -0,0 +1,194 @@
+import copy
+import os
+import time
+
+import pytest
+
+from admission import (
+    BULK, CRITICAL, NORMAL, InFlight, TokenBucket, client_address, limit_key, parse_route_limits, queue_seconds, route_priority
+)
+from app import create_app
+
+
+payload = {
+            "vin": "3VWFA81H9PM123456",
+            "manufacturer_name": "Volkswagen",
+            "model_name": "Jetta",
+            "model_year": 1993,
+            "fuel_type": "Gasoline",
+            "horse_power": 115,
+            "purchase_price": 2200.20
+            }
+
+
+@pytest.fixture()
+def admission_app(tmp_path):
+    '''app with admission control on, a single list request allowed at a time and no rate limit'''
+
+    app = create_app({
+        "TESTING": True,
+        "SQLALCHEMY_DATABASE_URI": f"sqlite:///{tmp_path / 'admission.db'}",
+        "ADMISSION_CONTROL": True,
+        "ADMISSION_ROUTE_LIMITS": {"list_vehicles": 1},
+        "ADMISSION_MAX_IN_FLIGHT": 4,
+        "ADMISSION_RETRY_AFTER": 2,
+    })
+    with app.app_context():
+        app.extensions["sqlalchemy"].create_all()
+    return app
+
+
+def test_route_priority_and_limits():
+    '''tests point lookups are critical, scans/exports/bulk writes bulk and the rest normal'''
+
+    assert route_priority("select_vehicle", "GET") == CRITICAL
+    assert route_priority("batch_get_vehicles", "POST") == CRITICAL
+    assert route_priority("select_vehicle", "DELETE") == NORMAL
+    assert route_priority("list_vehicles", "GET") == BULK
+    assert route_priority("list_vehicles", "POST") == NORMAL
+    assert route_priority("bulk_create_vehicles", "POST") == BULK
+
+    assert parse_route_limits("list_vehicles=2, export_vehicles=1,") == {"list_vehicles": 2, "export_vehicles": 1}
+    assert parse_route_limits("") == {}
+    assert parse_route_limits("POST bulk_create_vehicles=1") == {"POST bulk_create_vehicles": 1}
+    assert (limit_key("list_vehicles", "GET"), limit_key("list_vehicles", "POST")) == ("list_vehicles", "POST list_vehicles")
+
+def test_token_bucket_and_queue_time():
+    '''tests buckets allow a burst, then refill at rate, and X-Request-Start is read in any unit'''
+
+    bucket = TokenBucket(rate=2, burst=2, now=0.0)
+    assert bucket.take(0.0) == 0 and bucket.take(0.0) == 0
+    assert bucket.take(0.0) == pytest.approx(0.5)
+    assert bucket.take(0.5) == 0
+
+    now = time.time()
+    assert queue_seconds(f"t={now - 2:.3f}", now) == pytest.approx(2, abs=0.01)
+    assert queue_seconds(f"{(now - 2) * 1e3:.0f}", now) == pytest.approx(2, abs=0.01)
+    assert queue_seconds(f"t={(now - 2) * 1e6:.0f}", now) == pytest.approx(2, abs=0.01)
+    assert queue_seconds("soon", now) is None
+
+def test_in_flight_counts():
+    '''tests a limited route is refused at its limit and releases free the slot again'''
+
+    in_flight = InFlight(["list_vehicles"])
+    assert in_flight.acquire("list_vehicles", 1)
+    assert not in_flight.acquire("list_vehicles", 1)
+    assert in_flight.acquire("select_vehicle", None)
+    assert (in_flight.count("list_vehicles"), in_flight.total()) == (1, 2)
+
+    in_flight.release("list_vehicles")
+    in_flight.release("select_vehicle")
+    assert in_flight.total() == 0
+
+def test_in_flight_across_workers():
+    '''tests workers see each other's requests and a dead worker's requests stop counting once its row is reset'''
+
+    first = InFlight(["list_vehicles"], worker_slots=2)
+    #a forked worker shares the counters' memory and claims a row of its own
+    second = copy.copy(first)
+    second.claim(1)
+
+    assert first.acquire("list_vehicles", 1)
+    assert not second.acquire("list_vehicles", 1)
+    assert second.total() == 1
+
+    #the first worker is killed mid request, child_exit resets its row
+    first.reset(0)
+    assert second.acquire("list_vehicles", 1)
+    assert (second.total(), second.count("list_vehicles")) == (1, 1)
+
+def test_client_address():
+    '''tests X-Forwarded-For is only trusted as far as the configured proxies'''
+
+    assert client_address("10.0.0.1", "1.1.1.1, 2.2.2.2", 0) == "10.0.0.1"
+    assert client_address("10.0.0.1", "1.1.1.1, 2.2.2.2", 1) == "2.2.2.2"
+    assert client_address("10.0.0.1", "1.1.1.1, 2.2.2.2", 2) == "1.1.1.1"
+    assert client_address("10.0.0.1", "2.2.2.2", 3) == "2.2.2.2"
+    assert client_address("10.0.0.1", None, 1) == "10.0.0.1"
+
+def test_route_limit(admission_app):
+    '''tests a route over its concurrency limit gets 503 with Retry-After while other routes keep going'''
+
+    client = admission_app.test_client()
+    admission = admission_app.extensions["admission"]
+    client.post("/vehicle", json=payload)
+
+    admission.in_flight.acquire("list_vehicles", 1)
+    response = client.get("/vehicle")
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "2"
+    assert client.get("/vehicle/3VWFA81H9PM123456").status_code == 200
+
+    #creates on the same url don't count against the list scans' limit
+    response = client.post("/vehicle", json={**payload, "vin": "3VWFA81H9PM123457"})
+    assert response.status_code == 201
+
+    admission.in_flight.release("list_vehicles")
+    assert client.get("/vehicle").status_code == 200
+    assert admission.in_flight.total() == 0
+    assert admission.rejected["route_limited"] == 1
+
+def test_load_shedding(admission_app):
+    '''tests bulk requests are shed first, normal ones next and point lookups never'''
+
+    client = admission_app.test_client()
+    admission = admission_app.extensions["admission"]
+    client.post("/vehicle", json=payload)
+
+    #half of ADMISSION_MAX_IN_FLIGHT sheds bulk requests only
+    admission.in_flight.acquire("hello", None)
+    admission.in_flight.acquire("hello", None)
+    assert client.get("/vehicle").status_code == 503
+    assert client.get("/vehicle/search?q=jetta").status_code == 200
+
+    admission.in_flight.acquire("hello", None)
+    admission.in_flight.acquire("hello", None)
+    assert client.get("/vehicle/search?q=jetta").status_code == 503
+    assert client.get("/vehicle/3VWFA81H9PM123456").status_code == 200
+    for _ in range(4):
+        admission.in_flight.release("hello")
+
+    #requests that queued at the proxy for too long
+    stale = f"t={time.time() - 5:.3f}"
+    assert client.get("/vehicle", headers={"X-Request-Start": stale}).status_code == 503
+    assert client.get("/vehicle").status_code == 200
+
+    body = client.get("/metrics").get_data(as_text=True)
+    assert f'admission_shed_total{{worker="{os.getpid()}"}} 3' in body
+
+def test_shedding_on_pool_wait(admission_app):
+    '''tests a saturated pool (a long recent checkout wait) sheds bulk requests'''
+
+    client = admission_app.test_client()
+    pool_stats = admission_app.extensions["admission"].pool_stats
+
+    pool_stats.record(0.15)
+    response = client.get("/vehicle")
+    assert response.status_code == 503
+    assert "database connections are saturated" in response.get_json()["error"]
+    assert client.get("/vehicle/missing").status_code == 404
+
+def test_rate_limit(tmp_path):
+    '''tests each client gets its own token bucket and is told when to retry'''
+
+    app = create_app({
+        "TESTING": True,
+        "SQLALCHEMY_DATABASE_URI": f"sqlite:///{tmp_path / 'admission.db'}",
+        "ADMISSION_CONTROL": True,
+        "ADMISSION_RATE": 0.5,
+        "ADMISSION_BURST": 2,
+        "ADMISSION_CLIENT_HEADER": "X-Client-Id",
+    })
+    client = app.test_client()
+
+    assert client.get("/", headers={"X-Client-Id": "a"}).status_code == 200
+    assert client.get("/", headers={"X-Client-Id": "a"}).status_code == 200
+    response = client.get("/", headers={"X-Client-Id": "a"})
+    assert response.status_code == 429
+    assert response.headers["Retry-After"] == "2"
+    assert client.get("/", headers={"X-Client-Id": "b"}).status_code == 200
+
+    #each of 2 workers gets half of the rate and burst
+    admission = app.extensions["admission"]
+    admission.join_worker(0, 2)
+    assert (admission.rate_limiter.rate, admission.rate_limiter.burst) == (0.25, 1)
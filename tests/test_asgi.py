@@ -0,0 +1,188 @@
+import json
+import os
+
+import pytest
+from starlette.testclient import TestClient
+
+from asgi import async_database_uri, create_asgi_app
+
+
+vehicle = {
+    "vin": "1hgcm82633a004352",
+    "manufacturer_name": "Honda",
+    "horse_power": 240,
+    "model_name": "Accord",
+    "model_year": 2003,
+    "purchase_price": 12000.456,
+    "fuel_type": "gasoline",
+}
+
+
+@pytest.fixture()
+def asgi_client(tmp_path):
+    '''asgi app on a sqlite file (aiosqlite), with the tables created through the flask app'''
+
+    app = create_asgi_app({
+        "TESTING": True,
+        "SQLALCHEMY_DATABASE_URI": f"sqlite:///{tmp_path / 'asgi.db'}",
+    })
+    flask_app = app.state.flask_app
+    with flask_app.app_context():
+        flask_app.extensions["sqlalchemy"].create_all()
+
+    with TestClient(app) as client:
+        yield client
+
+
+def test_async_database_uri():
+    '''tests sync drivers are swapped for async ones'''
+
+    assert async_database_uri("postgresql+psycopg2://u:p@host/db") == "postgresql+asyncpg://u:p@host/db"
+    assert async_database_uri("sqlite:///:memory:") == "sqlite+aiosqlite:///:memory:"
+    assert async_database_uri("postgresql+asyncpg://host/db") == "postgresql+asyncpg://host/db"
+
+def test_vehicle_crud(asgi_client):
+    '''tests create, read, update, patch and delete through the async routes'''
+
+    response = asgi_client.post("/vehicle", json=vehicle)
+    assert response.status_code == 201
+    assert response.json()["vin"] == "1HGCM82633A004352"
+    assert response.json()["purchase_price"] == 12000.46
+
+    assert asgi_client.post("/vehicle", json=vehicle).json() == {"error": "'vin' must be unique"}
+
+    response = asgi_client.get("/vehicle/1HGCM82633A004352")
+    assert response.status_code == 200
+    assert response.headers["etag"].startswith('"1HGCM82633A004352-1-')
+    assert asgi_client.get("/vehicle/1HGCM82633A004352", headers={"If-None-Match": response.headers["etag"]}).status_code == 304
+
+    response = asgi_client.put("/vehicle/1HGCM82633A004352", json={**vehicle, "horse_power": 250})
+    assert response.status_code == 200
+    assert response.json()["horse_power"] == 250
+
+    response = asgi_client.patch("/vehicle/1HGCM82633A004352", json={"model_name": "Civic"})
+    assert response.status_code == 200
+    assert response.json()["model_name"] == "Civic"
+
+    assert asgi_client.delete("/vehicle/1HGCM82633A004352").status_code == 204
+    assert asgi_client.get("/vehicle/1HGCM82633A004352").status_code == 404
+
+def test_validation_errors(asgi_client):
+    '''tests the async routes share the flask app's validation'''
+
+    response = asgi_client.post("/vehicle", json={**vehicle, "horse_power": "a lot"})
+    assert response.status_code == 422
+    assert response.json() == {"error": "'horse_power' must be a int", "errors": ["'horse_power' must be a int"]}
+
+def test_list_pages_and_streams(asgi_client):
+    '''tests keyset pages, etags and streaming match the flask routes'''
+
+    for index in range(3):
+        asgi_client.post("/vehicle", json={**vehicle, "vin": f"vin{index}"})
+
+    response = asgi_client.get("/vehicle?limit=2")
+    assert [row["vin"] for row in response.json()] == ["VIN0", "VIN1"]
+    assert response.headers["x-next-cursor"] == "VIN1"
+    assert asgi_client.get("/vehicle?limit=2", headers={"If-None-Match": response.headers["etag"]}).status_code == 304
+
+    response = asgi_client.get("/vehicle?limit=2&after=VIN1&fields=vin")
+    assert response.json() == [{"vin": "VIN2"}]
+
+    response = asgi_client.get("/vehicle?stream=ndjson")
+    assert [json.loads(line)["vin"] for line in response.text.splitlines()] == ["VIN0", "VIN1", "VIN2"]
+    assert [row["vin"] for row in asgi_client.get("/vehicle?stream=json").json()] == ["VIN0", "VIN1", "VIN2"]
+
+    assert asgi_client.get("/vehicle?limit=0").status_code == 400
+    assert asgi_client.get("/vehicle_sold").json() == []
+
+def test_unported_routes(asgi_client):
+    '''tests the flask only routes answer 501 instead of being taken for vins'''
+
+    response = asgi_client.get("/vehicle/export")
+    assert response.status_code == 501
+    assert response.json() == {"error": "/vehicle/export is only served by the flask app (SERVER_MODE=wsgi)"}
+    assert asgi_client.post("/vehicle/bulk", json=[]).status_code == 501
+    for path in ("/vehicle_sold/export", "/vehicle_cache", "/db_pool"):
+        assert asgi_client.get(path).status_code == 501
+
+def test_metrics(asgi_client):
+    '''tests the async routes feed the same request metrics'''
+
+    asgi_client.get("/vehicle/missing")
+
+    body = asgi_client.get("/metrics").text
+    assert f'http_requests_total{{method="GET",route="/vehicle/{{vin}}",status="404",worker="{os.getpid()}"}} 1' in body
+    assert f'http_request_db_queries_sum{{method="GET",route="/vehicle/{{vin}}",worker="{os.getpid()}"}} 1' in body
+
+def test_vehicle_stats(asgi_client):
+    '''tests async writes keep the rollup table current'''
+
+    asgi_client.post("/vehicle", json=vehicle)
+    asgi_client.post("/vehicle", json={**vehicle, "vin": "vin1", "purchase_price": 14000.0})
+    asgi_client.patch("/vehicle/VIN1", json={"fuel_type": "diesel"})
+    asgi_client.delete("/vehicle/1HGCM82633A004352")
+
+    assert asgi_client.get("/vehicle/stats?group_by=fuel_type").json() == [
+        {"fuel_type": "diesel", "count": 1, "average_purchase_price": 14000.0},
+    ]
+
+def test_vehicle_search(asgi_client):
+    '''tests async writes keep the search index current'''
+
+    asgi_client.post("/vehicle", json=vehicle)
+    asgi_client.post("/vehicle", json={**vehicle, "vin": "vin1", "manufacturer_name": "Toyota", "model_name": "Corolla"})
+    assert [row["vin"] for row in asgi_client.get("/vehicle/search?q=toyta").json()] == ["VIN1"]
+
+    asgi_client.patch("/vehicle/VIN1", json={"model_name": "Camry"})
+    assert asgi_client.get("/vehicle/search?q=corolla").json() == []
+
+    asgi_client.delete("/vehicle/1HGCM82633A004352")
+    assert asgi_client.get("/vehicle/search?q=accord").json() == []
+    assert asgi_client.get("/vehicle/search?q=ab").status_code == 400
+
+def test_vin_prefix_and_batch_get(asgi_client):
+    '''tests prefix scans and batch gets through the async routes'''
+
+    asgi_client.post("/vehicle", json=vehicle)
+    asgi_client.post("/vehicle", json={**vehicle, "vin": "vin1"})
+
+    assert [row["vin"] for row in asgi_client.get("/vehicle?vin_prefix=1hg").json()] == ["1HGCM82633A004352"]
+    assert asgi_client.post("/vehicle/batch-get?fields=vin", json=["vin1", "vin2"]).json() == {"vehicles": [{"vin": "VIN1"}], "missing": ["VIN2"]}
+    assert asgi_client.post("/vehicle/batch-get", json="vin1").status_code == 400
+
+def test_vehicle_changes(asgi_client):
+    '''tests async writes append to the change feed'''
+
+    asgi_client.post("/vehicle", json=vehicle)
+    asgi_client.patch("/vehicle/1HGCM82633A004352", json={"horse_power": 250})
+    asgi_client.delete("/vehicle/1HGCM82633A004352")
+
+    response = asgi_client.get("/vehicle/changes")
+    assert [(change["operation"], change["version"]) for change in response.json()] == [("insert", 1), ("update", 2), ("delete", None)]
+    assert response.headers["x-next-cursor"] == "3"
+    assert asgi_client.get("/vehicle/changes?since=2&limit=1").json()[0]["operation"] == "delete"
+
+def test_compressed_responses(asgi_client):
+    '''tests large bodies (whole or streamed) are compressed and small ones only vary on Accept-Encoding'''
+
+    for index in range(10):
+        asgi_client.post("/vehicle", json={**vehicle, "vin": f"vin{index}"})
+
+    response = asgi_client.get("/vehicle", headers={"Accept-Encoding": "gzip"})
+    assert response.headers["content-encoding"] == "gzip" and response.headers["vary"] == "Accept-Encoding"
+    assert len(response.json()) == 10
+
+    response = asgi_client.get("/vehicle?stream=ndjson", headers={"Accept-Encoding": "gzip"})
+    assert response.headers["content-encoding"] == "gzip"
+    assert len(response.text.splitlines()) == 10
+
+    response = asgi_client.get("/vehicle/VIN1", headers={"Accept-Encoding": "gzip"})
+    assert "content-encoding" not in response.headers and response.headers["vary"] == "Accept-Encoding"
+    assert "content-encoding" not in asgi_client.get("/vehicle", headers={"Accept-Encoding": "identity"}).headers
+
+    #checks the compressed body's etag is marked with its encoding and still revalidates
+    identity = asgi_client.get("/vehicle", headers={"Accept-Encoding": "identity"}).headers["etag"]
+    etag = asgi_client.get("/vehicle", headers={"Accept-Encoding": "gzip"}).headers["etag"]
+    assert etag == identity[:-1] + '-gzip"'
+    response = asgi_client.get("/vehicle", headers={"Accept-Encoding": "gzip", "If-None-Match": etag})
+    assert response.status_code == 304 and response.headers["etag"] == etag
@@ -0,0 +1,56 @@
+import random
+
+import pytest
+
+from app import create_app
+from benchmarks.bench_routes import disposable, regressions, run_route, seed, synthetic_vin, vin_check_digit
+from helper import check_vehicle_fields
+
+
+def test_synthetic_vins_are_valid_and_unique():
+    '''tests seeded vins carry a correct check digit and never repeat'''
+
+    assert vin_check_digit("1M8GDM9AXKP042788") == "X"
+
+    rng = random.Random(0)
+    vins = [synthetic_vin(index, rng) for index in range(2000)]
+    assert len(set(vins)) == len(vins)
+    assert all(len(vin) == 17 and vin[8] == vin_check_digit(vin) for vin in vins)
+
+def test_regressions():
+    '''tests only results worse than the threshold are reported'''
+
+    baseline = {"sqlite 1000 GET /vehicle": {"p95_ms": 10.0, "throughput_rps": 100.0}}
+
+    assert regressions({"sqlite 1000 GET /vehicle": {"p95_ms": 11.0, "throughput_rps": 90.0}}, baseline, 20) == []
+    assert len(regressions({"sqlite 1000 GET /vehicle": {"p95_ms": 13.0, "throughput_rps": 70.0}}, baseline, 20)) == 2
+    assert regressions({"sqlite 1000 POST /vehicle": {"p95_ms": 99.0, "throughput_rps": 1.0}}, baseline, 20) == []
+
+def test_seed_and_run_route(tmp_path):
+    '''tests a seeded dataset can be load tested'''
+
+    app = create_app({"SQLALCHEMY_DATABASE_URI": f"sqlite:///{tmp_path / 'bench.db'}"})
+    vins = seed(app, 50, chunk_size=20)
+    assert len(vins) == 50
+
+    with app.test_client() as client:
+        assert len(client.get("/vehicle_sold").get_json()) == 5
+        assert check_vehicle_fields(client.get(f"/vehicle/{vins[0]}").get_json())[1] is None
+        #seeded through the bulk route, so the rollup, search index and change log are filled too
+        assert sum(group["count"] for group in client.get("/vehicle/stats").get_json()) == 50
+        assert len(client.get("/vehicle/changes?limit=100").get_json()) == 50
+
+    result = run_route(app, lambda: ('GET', f'/vehicle/{vins[1]}', None), 20, 2)
+    assert result["p50_ms"] <= result["p95_ms"] <= result["p99_ms"]
+    assert result["throughput_rps"] > 0
+
+def test_seed_refuses_other_databases(tmp_path):
+    '''tests seeding (which drops every table) only runs against throwaway databases unless told otherwise'''
+
+    assert disposable("sqlite") and disposable("sqlite://") and disposable(f"sqlite:///{tmp_path / 'bench.db'}")
+    assert not disposable("sqlite:///app.db")
+    assert not disposable("postgresql+psycopg2://localhost/vehicles")
+
+    app = create_app({"SQLALCHEMY_DATABASE_URI": "sqlite:///app.db"})
+    with pytest.raises(ValueError):
+        seed(app, 10)
@@ -0,0 +1,133 @@
+import pytest
+
+from app import create_app
+from cache import LRUCache
+
+
+class FakeClock:
+    '''stand-in for time.monotonic that only moves when told to'''
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class FakeRedis:
+    '''in-memory stand-in for the redis client used by the shared cache'''
+
+    def __init__(self):
+        self.store = {}
+
+    def get(self, key):
+        return self.store.get(key)
+
+    def set(self, key, value, ex=None):
+        self.store[key] = value
+
+    def delete(self, *keys):
+        for key in keys:
+            self.store.pop(key, None)
+
+
+payload = {
+            "vin": "3VWFA81H9PM123456",
+            "manufacturer_name": "Volkswagen",
+            "model_name": "Jetta",
+            "model_year": 1993,
+            "fuel_type": "Gasoline",
+            "horse_power": 115,
+            "purchase_price": 2200.20
+            }
+
+
+def test_lru_eviction_and_ttl():
+    '''tests the lru cache evicts the least recently used entry and expires old ones'''
+
+    clock = FakeClock()
+    cache = LRUCache(max_size=2, ttl=10, clock=clock)
+
+    cache.set("a", b"1")
+    cache.set("b", b"2")
+    assert cache.get("a") == b"1"
+
+    #"b" is now least recently used, so it is evicted first
+    cache.set("c", b"3")
+    assert cache.get("b") is None
+    assert cache.get("c") == b"3"
+
+    #entries expire once their ttl passes
+    clock.now = 11
+    assert cache.get("a") is None
+
+    assert cache.stats()["hits"] == 2
+    assert cache.stats()["misses"] == 2
+    assert cache.stats()["evictions"] == 2
+
+def test_cache_is_off_by_default(app, client):
+    '''tests the cache is opt in, so multi-worker deployments never serve another worker's stale lookups'''
+
+    assert app.extensions["vehicle_cache"] is None
+    assert client.get("/vehicle_cache").json["backend"] is None
+
+def test_cached_vehicle_is_invalidated_on_write():
+    '''tests the vehicle route serves cached lookups and drops them on every write'''
+
+    app = create_app({"TESTING": True, "SQLALCHEMY_DATABASE_URI": "sqlite:///:memory:", "VEHICLE_CACHE_BACKEND": "lru"})
+    with app.app_context():
+        app.extensions["sqlalchemy"].create_all()
+    client = app.test_client()
+    cache = app.extensions["vehicle_cache"]
+    client.post("/vehicle", json=payload)
+
+    #first lookup misses, second is served from the cache with identical bytes
+    first = client.get("/vehicle/3VWFA81H9PM123456")
+    second = client.get("/vehicle/3VWFA81H9PM123456")
+    assert first.get_data() == second.get_data()
+    assert cache.stats()["hits"] == 1
+
+    #checks put, patch and delete are never hidden behind a stale entry
+    response = client.put("/vehicle/3VWFA81H9PM123456", json={**payload, "model_year": 1990})
+    assert client.get("/vehicle/3VWFA81H9PM123456").json["model_year"] == 1990
+
+    response = client.patch("/vehicle/3VWFA81H9PM123456", json={"model_year": 2018})
+    assert client.get("/vehicle/3VWFA81H9PM123456").json["model_year"] == 2018
+
+    response = client.delete("/vehicle/3VWFA81H9PM123456")
+    assert response.status_code == 204
+    assert client.get("/vehicle/3VWFA81H9PM123456").status_code == 404
+
+    response = client.get("/vehicle_cache")
+    assert response.json["backend"] == "lru"
+    assert response.json["hits"] == 1
+
+def test_shared_cache_backend():
+    '''tests the vehicle route against the shared cache backend with a local stand-in'''
+
+    redis = FakeRedis()
+    app = create_app({
+        "TESTING": True,
+        "SQLALCHEMY_DATABASE_URI": "sqlite:///:memory:",
+        "VEHICLE_CACHE_BACKEND": "shared",
+        "VEHICLE_CACHE_CLIENT": redis,
+    })
+    db = app.extensions["sqlalchemy"]
+    with app.app_context():
+        db.create_all()
+    client = app.test_client()
+
+    client.post("/vehicle", json=payload)
+    response = client.get("/vehicle/3VWFA81H9PM123456")
+    assert response.status_code == 200
+    assert redis.store["vehicle:3VWFA81H9PM123456"] == response.headers["ETag"].strip('"').encode() + b"\n" + response.get_data()
+
+    client.delete("/vehicle/3VWFA81H9PM123456")
+    assert "vehicle:3VWFA81H9PM123456" not in redis.store
+    assert client.get("/vehicle/3VWFA81H9PM123456").status_code == 404
+
+def test_unknown_cache_backend():
+    '''tests create_app rejects a misspelled cache backend'''
+
+    with pytest.raises(ValueError):
+        create_app({"SQLALCHEMY_DATABASE_URI": "sqlite:///:memory:", "VEHICLE_CACHE_BACKEND": "memcache"})
@@ -0,0 +1,107 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from app import create_app
+from coalescing import WriteBatcher
+
+
+payload = {
+            "vin": "3VWFA81H9PM123456",
+            "manufacturer_name": "Volkswagen",
+            "model_name": "Jetta",
+            "model_year": 1993,
+            "fuel_type": "Gasoline",
+            "horse_power": 115,
+            "purchase_price": 2200.20
+            }
+
+
+@pytest.fixture()
+def coalescing_app(tmp_path):
+    '''app with group commit on (batches of up to 8 writes, gathered for up to 200ms)'''
+
+    app = create_app({
+        "TESTING": True,
+        "SQLALCHEMY_DATABASE_URI": f"sqlite:///{tmp_path / 'coalescing.db'}",
+        "WRITE_COALESCING": True,
+        "WRITE_COALESCING_MAX_ROWS": 8,
+        "WRITE_COALESCING_MAX_DELAY": 0.2,
+    })
+    with app.app_context():
+        app.extensions["sqlalchemy"].create_all()
+    return app
+
+
+def concurrently(app, requests):
+    '''sends (method, url, json) requests from a thread each, returning their responses in order'''
+
+    def send(args):
+        method, url, body = args
+        return app.test_client().open(url, method=method, json=body)
+
+    with ThreadPoolExecutor(len(requests)) as executor:
+        return list(executor.map(send, requests))
+
+
+def test_batcher_flushes_together():
+    '''tests concurrent submits share one flush and each gets its own result (or the batch's error)'''
+
+    flushed = []
+
+    def flush(items):
+        flushed.append(items)
+        if "boom" in items:
+            raise RuntimeError("flush failed")
+        return [item * 2 for item in items]
+
+    batcher = WriteBatcher(flush, max_rows=4, max_delay=5)
+    with ThreadPoolExecutor(4) as executor:
+        assert sorted(executor.map(batcher.submit, [1, 2, 3, 4])) == [2, 4, 6, 8]
+    #max_rows flushed the batch long before max_delay
+    assert len(flushed) == 1 and (batcher.batches, batcher.items) == (1, 4)
+
+    batcher.max_delay = 0.01
+    assert batcher.submit(5) == 10
+    with pytest.raises(RuntimeError):
+        batcher.submit("boom")
+    assert batcher.batches == 2
+
+def test_coalesced_creates(coalescing_app):
+    '''tests concurrent creates commit as one batch, duplicate vins failing alone'''
+
+    vins = ["vin0", "vin1", "vin2", "vin3", "vin1", "vin4"]
+    responses = concurrently(coalescing_app, [("POST", "/vehicle", {**payload, "vin": vin}) for vin in vins])
+
+    assert sorted(response.status_code for response in responses) == [201] * 5 + [422]
+    assert [response.get_json() for response in responses if response.status_code == 422] == [{"error": "'vin' must be unique"}]
+    assert responses[0].get_json()["vin"] == "VIN0"
+    assert coalescing_app.extensions["write_batcher"].batches == 1
+
+    client = coalescing_app.test_client()
+    assert len(client.get("/vehicle").get_json()) == 5
+    assert client.get("/vehicle/stats?group_by=fuel_type").get_json() == [
+        {"fuel_type": "Gasoline", "count": 5, "average_purchase_price": 2200.2},
+    ]
+    assert [change["operation"] for change in client.get("/vehicle/changes").get_json()] == ["insert"] * 5
+    assert client.post("/vehicle", json={**payload, "vin": "vin0"}).status_code == 422
+
+def test_coalesced_updates(coalescing_app):
+    '''tests puts (and upserts) are coalesced with creates, missing vehicles failing alone'''
+
+    client = coalescing_app.test_client()
+    client.post("/vehicle", json=payload)
+
+    responses = concurrently(coalescing_app, [
+        ("PUT", "/vehicle/3VWFA81H9PM123456", {**payload, "horse_power": 150}),
+        ("PUT", "/vehicle/missing", {**payload, "vin": "missing"}),
+        ("PUT", "/vehicle/new?upsert=true", {**payload, "vin": "new"}),
+        ("POST", "/vehicle", {**payload, "vin": "vin9"}),
+    ])
+    assert [response.status_code for response in responses] == [200, 404, 201, 201]
+    assert responses[0].get_json()["horse_power"] == 150
+
+    response = client.get("/vehicle/3VWFA81H9PM123456")
+    assert response.get_json()["horse_power"] == 150
+    assert response.headers["ETag"].startswith('"3VWFA81H9PM123456-2-')
+    assert [change["operation"] for change in client.get("/vehicle/changes").get_json()] == ["insert", "insert", "update", "insert"]
@@ -0,0 +1,72 @@
+import gzip
+import json
+
+from content_encoding import available_encodings, compress_chunks, negotiate
+
+
+payload = {
+            "manufacturer_name": "Volkswagen",
+            "model_name": "Jetta",
+            "model_year": 1993,
+            "fuel_type": "Gasoline",
+            "horse_power": 115,
+            "purchase_price": 2200.20
+            }
+
+
+def test_negotiate():
+    '''tests the client's q values win, the server's preference breaks ties and q=0 refuses an encoding'''
+
+    assert negotiate("gzip, br", ["zstd", "br", "gzip"]) == "br"
+    assert negotiate("gzip;q=1.0, br;q=0.5", ["zstd", "br", "gzip"]) == "gzip"
+    assert negotiate("*", ["zstd", "gzip"]) == "zstd"
+    assert negotiate("*, zstd;q=0", ["zstd", "gzip"]) == "gzip"
+    assert negotiate("identity", ["gzip"]) is None
+    assert negotiate(None, ["gzip"]) is None
+    assert available_encodings(["nope", "gzip"]) == ["gzip"]
+
+def test_compress_chunks_stream_one_body():
+    '''tests a compressed stream decodes back to the original chunks'''
+
+    levels = {"gzip": 6}
+    data = b"".join(compress_chunks(iter([b"a" * 1000, "b" * 1000]), "gzip", levels))
+    assert gzip.decompress(data) == b"a" * 1000 + b"b" * 1000
+
+def test_compressed_responses(app, client):
+    '''tests lists are compressed (whole or streamed) above the minimum size and always vary on Accept-Encoding'''
+
+    app.config["COMPRESSION_MIN_SIZE"] = 500
+    for index in range(10):
+        client.post("/vehicle", json={**payload, "vin": f"3VWFA81H9PM12345{index}"})
+
+    response = client.get("/vehicle", headers={"Accept-Encoding": "gzip"})
+    assert response.headers["Content-Encoding"] == "gzip"
+    assert response.headers["Vary"] == "Accept-Encoding"
+    assert int(response.headers["Content-Length"]) == len(response.get_data())
+    assert len(json.loads(gzip.decompress(response.get_data()))) == 10
+
+    response = client.get("/vehicle?stream=ndjson", headers={"Accept-Encoding": "gzip"})
+    assert response.is_streamed and response.headers["Content-Encoding"] == "gzip"
+    assert len(gzip.decompress(response.get_data()).splitlines()) == 10
+
+    #checks small bodies, refusing clients and unchanged polls are sent as they are
+    response = client.get("/vehicle?limit=1", headers={"Accept-Encoding": "gzip"})
+    assert "Content-Encoding" not in response.headers and response.headers["Vary"] == "Accept-Encoding"
+    assert "Content-Encoding" not in client.get("/vehicle", headers={"Accept-Encoding": "gzip;q=0"}).headers
+    etag = response.headers["ETag"]
+    response = client.get("/vehicle?limit=1", headers={"Accept-Encoding": "gzip", "If-None-Match": etag})
+    assert response.status_code == 304 and "Content-Encoding" not in response.headers
+
+    #checks compressed bodies get their own etag, which still revalidates (and comes back on the 304)
+    identity = client.get("/vehicle").headers["ETag"]
+    etag = client.get("/vehicle", headers={"Accept-Encoding": "gzip"}).headers["ETag"]
+    assert etag == identity[:-1] + '-gzip"'
+    response = client.get("/vehicle", headers={"Accept-Encoding": "gzip", "If-None-Match": etag})
+    assert response.status_code == 304 and response.headers["ETag"] == etag
+    assert client.get("/vehicle", headers={"If-None-Match": identity}).headers["ETag"] == identity
+
+    #checks the recorded response sizes are the compressed ones
+    sizes = app.extensions["request_metrics"].histograms[("http_response_size_bytes", "GET", "/vehicle")]
+    recorded = sizes.sum
+    response = client.get("/vehicle", headers={"Accept-Encoding": "gzip"})
+    assert sizes.sum - recorded == len(response.get_data())
@@ -0,0 +1,29 @@
+import io
+from datetime import datetime, timezone
+
+import pytest
+import sqlalchemy as sa
+
+from export import csv_chunks, parquet_chunks
+
+
+def test_csv_chunks_encode_one_chunk_per_write():
+    '''tests the header comes first and each chunk is written separately'''
+
+    updated_at = datetime(2026, 10, 18, 12, 0, tzinfo=timezone.utc)
+    chunks = list(csv_chunks(iter([[("A", None)], [("B", updated_at)]]), ["vin", "updated_at"], [1]))
+
+    assert chunks == [b"vin,updated_at\n", b"A,\n", b"B,2026-10-18T12:00:00+00:00\n"]
+
+def test_parquet_chunks_write_row_groups():
+    '''tests each chunk becomes a row group of a readable parquet file'''
+
+    pyarrow = pytest.importorskip("pyarrow")
+    import pyarrow.parquet
+
+    table = sa.Table("t", sa.MetaData(), sa.Column("vin", sa.String()), sa.Column("model_year", sa.Integer()))
+    data = b"".join(parquet_chunks(iter([[("A", 1993)], [("B", None)]]), list(table.columns)))
+
+    parquet_file = pyarrow.parquet.ParquetFile(io.BytesIO(data))
+    assert parquet_file.num_row_groups == 2
+    assert parquet_file.read().to_pylist() == [{"vin": "A", "model_year": 1993}, {"vin": "B", "model_year": None}]
@@ -0,0 +1,85 @@
+import os
+import runpy
+
+from app import create_app
+
+
+conf = runpy.run_path(os.path.join(os.path.dirname(__file__), "..", "gunicorn.conf.py"))
+
+
+class FakeWorker:
+    '''stand-in for the gunicorn worker handed to server hooks'''
+
+    def __init__(self, wsgi, workers=1):
+        self.wsgi = wsgi
+        self.cfg = type("Config", (), {"workers": workers})
+
+
+class FakeServer:
+    '''stand-in for the gunicorn arbiter handed to server hooks'''
+
+    def __init__(self, app):
+        self.app = type("Application", (), {"wsgi": lambda _: app})()
+        self.cfg = type("Config", (), {"preload_app": True})
+
+
+def test_post_worker_init_warms_a_fresh_pool(tmp_path):
+    '''tests each worker drops the master's connections and opens its own'''
+
+    app = create_app({
+        "SQLALCHEMY_DATABASE_URI": f"sqlite:///{tmp_path / 'worker.db'}",
+        "DB_POOL_WARM": 2,
+    })
+    db = app.extensions["sqlalchemy"]
+    with app.app_context():
+        master_pool = db.engine.pool
+        conf["post_worker_init"](FakeWorker(app))
+
+        #the worker pool replaced the master's and already holds warm connections
+        assert db.engine.pool is not master_pool
+        assert db.engine.pool.checkedin() == 2
+
+def test_defaults():
+    '''tests the defaults serve preloaded sync workers on port 5000'''
+
+    assert conf["wsgi_app"] == "app:create_app()"
+    assert conf["worker_class"] == "sync"
+    assert conf["preload_app"] is True
+    assert conf["bind"] == "0.0.0.0:5000"
+
+def test_asgi_mode(monkeypatch):
+    '''tests SERVER_MODE=asgi serves the asyncio app on uvicorn workers'''
+
+    monkeypatch.setenv("SERVER_MODE", "asgi")
+    asgi_conf = runpy.run_path(os.path.join(os.path.dirname(__file__), "..", "gunicorn.conf.py"))
+
+    assert asgi_conf["wsgi_app"] == "asgi:create_asgi_app()"
+    assert asgi_conf["worker_class"] == "uvicorn.workers.UvicornWorker"
+
+def test_admission_slots(tmp_path):
+    '''tests workers get free admission slots and a dead worker's in-flight requests are dropped'''
+
+    app = create_app({
+        "SQLALCHEMY_DATABASE_URI": f"sqlite:///{tmp_path / 'worker.db'}",
+        "ADMISSION_CONTROL": True,
+        "ADMISSION_ROUTE_LIMITS": {"list_vehicles": 1},
+    })
+    server = FakeServer(app)
+    first, second = FakeWorker(app, workers=2), FakeWorker(app, workers=2)
+    conf["pre_fork"](server, first)
+    conf["pre_fork"](server, second)
+    assert (first.admission_slot, second.admission_slot) == (0, 1)
+
+    in_flight = app.extensions["admission"].in_flight
+    conf["post_worker_init"](first)
+    assert in_flight.acquire("list_vehicles", 1)
+
+    #the worker dies mid request: its slot is freed and its request stops counting for its replacement
+    conf["child_exit"](server, first)
+    replacement = FakeWorker(app, workers=2)
+    conf["pre_fork"](server, replacement)
+    assert replacement.admission_slot == 0
+    conf["post_worker_init"](replacement)
+    assert in_flight.total() == 0
+    conf["child_exit"](server, second)
+    conf["child_exit"](server, replacement)
@@ -0,0 +1,80 @@
+import os
+
+from app import create_app
+from metrics import Histogram, RequestMetrics
+
+
+payload = {
+            "vin": "3VWFA81H9PM123456",
+            "manufacturer_name": "Volkswagen",
+            "model_name": "Jetta",
+            "model_year": 1993,
+            "fuel_type": "Gasoline",
+            "horse_power": 115,
+            "purchase_price": 2200.20
+            }
+
+
+def test_histogram_buckets():
+    '''tests values land in the first bucket whose upper bound holds them'''
+
+    histogram = Histogram((1, 5))
+    for value in (0.5, 1, 3, 9):
+        histogram.observe(value)
+
+    assert histogram.counts == [2, 1, 1]
+    assert histogram.count == 4
+    assert histogram.sum == 13.5
+
+def test_render_is_cumulative():
+    '''tests the prometheus output lists cumulative buckets per route'''
+
+    metrics = RequestMetrics()
+    metrics.record("GET", "/vehicle", 200, 0.003, 2, 0.001, 512)
+    metrics.record("GET", "/vehicle", 200, 0.2, 2, 0.1, 512)
+
+    body = metrics.render({"db_pool_in_use": ("connections checked out", 3), "db_pool_overflow": ("overflow", None)})
+    worker = f'worker="{os.getpid()}"'
+    assert f'http_requests_total{{method="GET",route="/vehicle",status="200",{worker}}} 2' in body
+    assert f'http_request_duration_seconds_bucket{{method="GET",route="/vehicle",{worker},le="0.005"}} 1' in body
+    assert f'http_request_duration_seconds_bucket{{method="GET",route="/vehicle",{worker},le="0.25"}} 2' in body
+    assert f'http_request_db_queries_count{{method="GET",route="/vehicle",{worker}}} 2' in body
+    assert f"# TYPE db_pool_in_use gauge\ndb_pool_in_use{{{worker}}} 3" in body
+    assert "db_pool_overflow" not in body
+
+def test_metrics_endpoint(client):
+    '''tests requests are counted per route rule and status'''
+
+    client.post("/vehicle", json=payload)
+    client.get("/vehicle/3VWFA81H9PM123456")
+    client.get("/vehicle/missing")
+
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert response.mimetype == "text/plain"
+    body = response.get_data(as_text=True)
+    worker = f'worker="{os.getpid()}"'
+    assert f'http_requests_total{{method="POST",route="/vehicle",status="201",{worker}}} 1' in body
+    assert f'http_requests_total{{method="GET",route="/vehicle/<vin>",status="200",{worker}}} 1' in body
+    assert f'http_requests_total{{method="GET",route="/vehicle/<vin>",status="404",{worker}}} 1' in body
+    assert f'http_response_size_bytes_count{{method="POST",route="/vehicle",{worker}}} 1' in body
+    assert "db_pool_checkouts_total" in body
+
+def test_query_count_header():
+    '''tests the optional header reports each request's statements'''
+
+    app = create_app({"SQLALCHEMY_DATABASE_URI": "sqlite:///:memory:", "METRICS_QUERY_HEADER": True, "VEHICLE_CACHE_BACKEND": "lru"})
+    with app.app_context():
+        app.extensions["sqlalchemy"].create_all()
+    client = app.test_client()
+
+    #insert + version bump (the version row is added on the first write)
+    response = client.post("/vehicle", json=payload)
+    assert int(response.headers["X-Query-Count"]) >= 2
+    assert response.headers["X-DB-Time"].endswith("ms")
+
+    #a single vehicle lookup is served from the cache without touching the database
+    client.get("/vehicle/3VWFA81H9PM123456")
+    assert client.get("/vehicle/3VWFA81H9PM123456").headers["X-Query-Count"] == "0"
+
+    assert "X-Query-Count" not in create_app({"SQLALCHEMY_DATABASE_URI": "sqlite:///:memory:"}).test_client().get("/").headers
@@ -0,0 +1,102 @@
+import time
+
+import pytest
+from sqlalchemy import create_engine, event, exc
+
+from pool import RECENT_WAIT_HALF_LIFE, PoolStats, TimedQueuePool, engine_options, pool_config, warm_pool
+
+
+@pytest.fixture()
+def engine(tmp_path):
+    '''sqlite file engine on a single-connection timed pool'''
+
+    stats = PoolStats()
+    engine = create_engine(
+        f"sqlite:///{tmp_path / 'pool.db'}",
+        poolclass=type('TimedQueuePool', (TimedQueuePool,), {'stats': stats}),
+        pool_size=1,
+        max_overflow=0,
+        pool_timeout=0.05,
+    )
+    yield engine, stats
+    engine.dispose()
+
+
+def test_pool_records_checkouts_and_timeouts(engine):
+    '''tests the timed pool counts checkouts, waits and exhausted-pool timeouts'''
+
+    engine, stats = engine
+
+    connection = engine.connect()
+    assert stats.snapshot(engine.pool)["in_use"] == 1
+
+    #the only connection is taken, so a second checkout times out
+    with pytest.raises(exc.TimeoutError):
+        engine.connect()
+    connection.close()
+
+    snapshot = stats.snapshot(engine.pool)
+    assert snapshot["checkouts"] == 1
+    assert snapshot["timeouts"] == 1
+    assert snapshot["in_use"] == 0
+    assert snapshot["max_wait_seconds"] >= 0.05
+
+def test_pool_wait_leaves_out_connection_setup(engine):
+    '''tests opening and pinging connections is not counted as waiting for the pool'''
+
+    engine, stats = engine
+    event.listen(engine, "connect", lambda dbapi_connection, connection_record: time.sleep(0.1))
+    event.listen(engine, "checkout", lambda dbapi_connection, connection_record, connection_proxy: time.sleep(0.1))
+
+    #the first checkout opens the connection, the second reuses it
+    engine.connect().close()
+    engine.connect().close()
+
+    assert stats.checkouts == 2
+    assert stats.max_wait < 0.05
+
+def test_pool_survives_dispose(engine):
+    '''tests the stats stay attached when the engine recreates its pool'''
+
+    engine, stats = engine
+    engine.dispose()
+    engine.connect().close()
+    assert stats.checkouts == 1
+
+def test_recent_wait_decays():
+    '''tests the recent wait follows the longest recent checkout wait and halves every half life after it'''
+
+    stats = PoolStats()
+    stats.record(0.4)
+    stats.record(0.1)
+    assert stats.recent_wait_seconds() == pytest.approx(0.4, rel=0.01)
+
+    stats.recent_at -= RECENT_WAIT_HALF_LIFE * 2
+    assert stats.recent_wait_seconds() == pytest.approx(0.1, rel=0.01)
+
+def test_warm_pool(engine):
+    '''tests warming opens connections and hands them back to the pool'''
+
+    engine, stats = engine
+    assert warm_pool(engine, 1) == 1
+    assert stats.snapshot(engine.pool)["idle"] == 1
+
+def test_engine_options():
+    '''tests pool settings reach postgres engines but leave sqlite alone'''
+
+    config = {**pool_config(), "SQLALCHEMY_DATABASE_URI": "postgresql+psycopg2://user:pw@host/db"}
+    options = engine_options(config, PoolStats())
+    assert options["pool_size"] == config["DB_POOL_SIZE"]
+    assert options["pool_pre_ping"] is True
+    assert options["connect_args"] == {"connect_timeout": config["DB_CONNECT_TIMEOUT"]}
+
+    config["SQLALCHEMY_DATABASE_URI"] = "sqlite:///:memory:"
+    assert engine_options(config, PoolStats()) == {}
+
+def test_db_pool_route(client):
+    '''tests the pool counters are served over http'''
+
+    client.get("/vehicle")
+    response = client.get("/db_pool")
+    assert response.status_code == 200
+    assert "checkouts" in response.json
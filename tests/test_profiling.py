@@ -0,0 +1,86 @@
+import pstats
+
+from app import create_app
+from profiling import collapsed_stacks
+
+
+payload = {
+            "vin": "3VWFA81H9PM123456",
+            "manufacturer_name": "Volkswagen",
+            "model_name": "Jetta",
+            "model_year": 1993,
+            "fuel_type": "Gasoline",
+            "horse_power": 115,
+            "purchase_price": 2200.20
+            }
+
+
+def profiled_client(tmp_path, **config):
+    app = create_app({
+        "SQLALCHEMY_DATABASE_URI": "sqlite:///:memory:",
+        "PROFILE_DIR": str(tmp_path / "profiles"),
+        "PROFILE_TOKEN": "secret",
+        **config,
+    })
+    with app.app_context():
+        app.extensions["sqlalchemy"].create_all()
+    return app.test_client()
+
+
+def test_profile_on_header(tmp_path):
+    '''tests an authorized header writes pstats and collapsed stacks for that request only'''
+
+    client = profiled_client(tmp_path)
+
+    assert "X-Profile-Id" not in client.post("/vehicle", json=payload).headers
+    assert "X-Profile-Id" not in client.get("/vehicle", headers={"X-Profile": "wrong"}).headers
+    assert not (tmp_path / "profiles").exists()
+
+    response = client.get("/vehicle", headers={"X-Profile": "secret"})
+    assert response.status_code == 200
+    assert response.get_json()[0]["vin"] == "3VWFA81H9PM123456"
+
+    profile_id = response.headers["X-Profile-Id"]
+    assert "GET-list_vehicles" in profile_id
+    stats = pstats.Stats(str(tmp_path / "profiles" / f"{profile_id}.pstats"))
+    assert any(name == "list_vehicles" for _, _, name in stats.stats)
+
+    collapsed = (tmp_path / "profiles" / f"{profile_id}.collapsed").read_text().splitlines()
+    assert collapsed
+    for line in collapsed:
+        stack, microseconds = line.rsplit(" ", 1)
+        assert int(microseconds) > 0
+    assert any("app:list_vehicles" in line for line in collapsed)
+
+def test_profile_sampling(tmp_path):
+    '''tests a sample rate of 1 profiles every request'''
+
+    client = profiled_client(tmp_path, PROFILE_TOKEN=None, PROFILE_SAMPLE_RATE=1.0)
+
+    assert "X-Profile-Id" in client.get("/vehicle/missing").headers
+    assert len(list((tmp_path / "profiles").glob("*.pstats"))) == 1
+
+def test_views_unwrapped_without_profile_dir():
+    '''tests nothing is wrapped (so nothing is paid) unless profiling is configured'''
+
+    app = create_app({"SQLALCHEMY_DATABASE_URI": "sqlite:///:memory:"})
+    assert not hasattr(app.view_functions["list_vehicles"], "__wrapped__")
+
+def test_collapsed_stacks_split_time_by_caller():
+    '''tests a shared callee's time is split across its callers' stacks'''
+
+    root = ("app.py", 1, "root")
+    a = ("app.py", 2, "a")
+    b = ("app.py", 3, "b")
+    leaf = ("helper.py", 4, "leaf")
+    stats = {
+        root: (1, 1, 0.0, 0.004, {}),
+        a: (1, 1, 0.0, 0.003, {root: (1, 1, 0.0, 0.003)}),
+        b: (1, 1, 0.0, 0.001, {root: (1, 1, 0.0, 0.001)}),
+        leaf: (2, 2, 0.004, 0.004, {a: (1, 1, 0.003, 0.003), b: (1, 1, 0.001, 0.001)}),
+    }
+
+    assert collapsed_stacks(stats) == [
+        "app:root:1;app:a:2;helper:leaf:4 3000",
+        "app:root:1;app:b:3;helper:leaf:4 1000",
+    ]
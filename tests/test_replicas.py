@@ -0,0 +1,173 @@
+import os
+import shutil
+
+import pytest
+from starlette.testclient import TestClient
+
+from app import create_app
+from asgi import create_asgi_app
+from replicas import PIN_COOKIE, PIN_HEADER, ReplicaSet
+
+
+payload = {
+            "vin": "3VWFA81H9PM123456",
+            "manufacturer_name": "Volkswagen",
+            "model_name": "Jetta",
+            "model_year": 1993,
+            "fuel_type": "Gasoline",
+            "horse_power": 115,
+            "purchase_price": 2200.20
+            }
+
+
+def replicated_config(tmp_path):
+    '''a primary and a replica sqlite file (the replica is a copy of the empty primary, so it never sees new writes)'''
+
+    return {
+        "TESTING": True,
+        "SQLALCHEMY_DATABASE_URI": f"sqlite:///{tmp_path / 'primary.db'}",
+        "REPLICA_DATABASE_URIS": [f"sqlite:///{tmp_path / 'replica.db'}"],
+        "VEHICLE_CACHE_BACKEND": "",
+    }
+
+
+def create_replicated(app, tmp_path):
+    with app.app_context():
+        app.extensions["sqlalchemy"].create_all()
+    shutil.copy(tmp_path / "primary.db", tmp_path / "replica.db")
+
+
+class FakePool:
+    def __init__(self, checked_out):
+        self.checked_out = checked_out
+
+
+class FakeEngine:
+    def __init__(self, name, checked_out=0):
+        self.url = name
+        self.pool = FakePool(checked_out)
+
+
+def test_replica_set_policies():
+    '''tests round robin rotates, least loaded ignores busy replicas and failed replicas sit out'''
+
+    first, second = FakeEngine("first"), FakeEngine("second")
+    replicas = ReplicaSet([first, second])
+    assert [replicas.choose() for _ in range(4)] == [first, second, first, second]
+
+    replicas.mark_down(first, "refused")
+    assert [replicas.choose() for _ in range(2)] == [second, second]
+    replicas.mark_down(second, "refused")
+    assert replicas.choose() is None
+
+    replicas.down_until.clear()
+    replicas.retry_seconds = 0
+    replicas.mark_down(first, "refused")
+    assert replicas.choose() in (first, second)
+
+    with pytest.raises(ValueError):
+        ReplicaSet([first], policy="random")
+
+def test_least_loaded(tmp_path):
+    '''tests least loaded picks the replica with the fewest checked out connections'''
+
+    app = create_app({**replicated_config(tmp_path), "REPLICA_DATABASE_URIS": [
+        f"sqlite:///{tmp_path / 'replica_a.db'}", f"sqlite:///{tmp_path / 'replica_b.db'}"
+    ], "REPLICA_POLICY": "least_loaded"})
+    replicas = app.extensions["replicas"]
+    busy, idle = replicas.engines
+
+    connection = busy.connect()
+    assert {replicas.choose() for _ in range(4)} == {idle}
+    connection.close()
+    assert {replicas.choose() for _ in range(4)} == {busy, idle}
+
+def test_reads_route_to_replica_until_a_write(tmp_path):
+    '''tests GETs read the replica, a client that wrote is pinned to the primary and other clients are not'''
+
+    app = create_app(replicated_config(tmp_path))
+    create_replicated(app, tmp_path)
+    writer = app.test_client()
+
+    response = writer.post("/vehicle", json=payload)
+    assert response.status_code == 201
+    assert PIN_COOKIE in response.headers["Set-Cookie"]
+
+    #the writer reads its own write from the primary, everyone else reads the (stale) replica
+    assert writer.get("/vehicle/3VWFA81H9PM123456").status_code == 200
+    assert [vehicle["vin"] for vehicle in writer.get("/vehicle").json] == ["3VWFA81H9PM123456"]
+    reader = app.test_client()
+    assert reader.get("/vehicle/3VWFA81H9PM123456").status_code == 404
+    assert reader.get("/vehicle").json == []
+    assert reader.get("/vehicle_sold").json == []
+
+    #reads and failed writes never pin
+    assert "Set-Cookie" not in reader.get("/vehicle").headers
+    assert "Set-Cookie" not in reader.post("/vehicle", json=payload).headers
+
+    #an expired pin goes back to the replica
+    writer.set_cookie(PIN_COOKIE, "0")
+    assert writer.get("/vehicle/3VWFA81H9PM123456").status_code == 404
+
+def test_pinned_reads_skip_the_cache(tmp_path):
+    '''tests pinned clients (cookie or header) never get stale cached copies and replica reads never fill the cache'''
+
+    app = create_app({**replicated_config(tmp_path), "VEHICLE_CACHE_BACKEND": "lru"})
+    with app.app_context():
+        app.extensions["sqlalchemy"].create_all()
+    app.test_client().post("/vehicle", json=payload)
+    shutil.copy(tmp_path / "primary.db", tmp_path / "replica.db")
+    cache = app.extensions["vehicle_cache"]
+    cache.delete("3VWFA81H9PM123456")
+
+    #the replica's copy is served but not cached
+    reader = app.test_client()
+    assert reader.get("/vehicle/3VWFA81H9PM123456").json["horse_power"] == 115
+    assert cache.get("3VWFA81H9PM123456") is None
+
+    writer = app.test_client()
+    assert writer.put("/vehicle/3VWFA81H9PM123456", json={**payload, "horse_power": 150}).status_code == 200
+    assert reader.get("/vehicle/3VWFA81H9PM123456").json["horse_power"] == 115
+    assert cache.get("3VWFA81H9PM123456") is None
+
+    #a stale copy (as another worker's cache may hold) is skipped by the pinned writer
+    cache.set("3VWFA81H9PM123456", b'1 {"horse_power": 115}')
+    assert writer.get("/vehicle/3VWFA81H9PM123456").json["horse_power"] == 150
+
+    #clients without cookies pin themselves by echoing the header back
+    client = app.test_client(use_cookies=False)
+    response = client.put("/vehicle/3VWFA81H9PM123456", json={**payload, "horse_power": 160})
+    assert client.get("/vehicle/3VWFA81H9PM123456").json["horse_power"] == 115
+    headers = {PIN_HEADER: response.headers[PIN_HEADER]}
+    assert client.get("/vehicle/3VWFA81H9PM123456", headers=headers).json["horse_power"] == 160
+
+def test_failed_replica_falls_back_to_primary(tmp_path):
+    '''tests a broken replica is taken out of rotation and the read is answered by the primary'''
+
+    app = create_app(replicated_config(tmp_path))
+    create_replicated(app, tmp_path)
+    app.test_client().post("/vehicle", json=payload)
+
+    #a replica without the tables fails every read
+    replicas = app.extensions["replicas"]
+    os.remove(tmp_path / "replica.db")
+    replicas.engines[0].dispose()
+
+    client = app.test_client()
+    assert client.get("/vehicle/3VWFA81H9PM123456").status_code == 200
+    assert replicas.healthy() == []
+    assert f'db_replicas_healthy{{worker="{os.getpid()}"}} 0' in client.get("/metrics").get_data(as_text=True)
+    assert client.get("/vehicle").json[0]["vin"] == "3VWFA81H9PM123456"
+
+def test_asgi_reads_route_to_replica(tmp_path):
+    '''tests the async routes follow the same routing and pinning'''
+
+    app = create_asgi_app(replicated_config(tmp_path))
+    create_replicated(app.state.flask_app, tmp_path)
+
+    with TestClient(app) as writer, TestClient(app) as reader:
+        response = writer.post("/vehicle", json=payload)
+        assert PIN_COOKIE in response.headers["set-cookie"] and PIN_HEADER in response.headers
+        assert writer.get("/vehicle/3VWFA81H9PM123456").status_code == 200
+        assert reader.get("/vehicle/3VWFA81H9PM123456").status_code == 404
+        assert reader.get("/vehicle?stream=ndjson").text == ""
@@ -1,3 +1,15 @@
+import gzip
+import json
+import os
+from datetime import date, datetime, timedelta, timezone
+
+import pytest
+from sqlalchemy import event, text
+
+import export
+from app import create_app
+from helper import utcnow
+
 
 def test_view_empty_vehicle(client):
     '''tests the vehicle route to display all vehicles when db is empty'''
@@ -245,7 +257,7 @@ def test_vehicle_patch(client):
     assert response.json["error"] == f"'model_year' must be a int"
 
 
-def test_vehicle_sold(client):
+def test_vehicle_sold(app, client):
     payload = {
                 "vin": "3VWFA81H9PM123456",
                 "manufacturer_name": "Volkswagen",
@@ -261,6 +273,832 @@ def test_vehicle_sold(client):
     assert response.status_code ==201
     assert response.json["vin"] == "3VWFA81H9PM123456"
 
-    #post the vehicle's vin into vehicle_sold
-    #assert hey is the status code 200 and is the vehicle's vin in vehicle sold once we commit get request
-    
\ No newline at end of file
+    #post the vehicle's vin into vehicle_sold (twice, to page through the sales)
+    db = app.extensions["sqlalchemy"]
+    with app.app_context():
+        for price in (2500.00, 2600.00):
+            db.session.execute(
+                db.text("INSERT INTO sold_vehicles (vin, purchase_price, insurance_policy, car_damage) VALUES (:vin, :price, 'GEICO-1', 0.0)"),
+                {"vin": "3VWFA81H9PM123456", "price": price}
+            )
+        db.session.commit()
+
+    #checks the sale is merged with the vehicle it sold
+    response = client.get("/vehicle_sold?limit=1")
+    assert response.status_code == 200
+    assert response.json == [{
+                "vin": "3VWFA81H9PM123456",
+                "manufacturer_name": "Volkswagen",
+                "model_name": "Jetta",
+                "model_year": 1993,
+                "fuel_type": "Gasoline",
+                "horse_power": 115,
+                "purchase_price": 2200.20,
+                "sale": {
+                    "id": 1,
+                    "purchase_price": 2500.00,
+                    "insurance_policy": "GEICO-1",
+                    "car_damage": 0.0
+                }
+                }]
+    assert response.headers["X-Next-Cursor"] == "1"
+
+    #checks sales written outside the app change the collection's etag
+    etag = response.headers["ETag"]
+    assert client.get("/vehicle_sold?limit=1", headers={"If-None-Match": etag}).status_code == 304
+    with app.app_context():
+        db.session.execute(db.text("UPDATE sold_vehicles SET car_damage = 1.0 WHERE id = 1"))
+        db.session.commit()
+    assert client.get("/vehicle_sold?limit=1", headers={"If-None-Match": etag}).status_code == 200
+
+    #checks the next page holds the second sale
+    response = client.get("/vehicle_sold?limit=1&after=1")
+    assert response.status_code == 200
+    assert [sale["sale"]["id"] for sale in response.json] == [2]
+    assert "Link" not in response.headers
+
+    response = client.get("/vehicle_sold?after=bad_val")
+    assert response.status_code == 400
+
+def test_sold_vehicle_delete_and_rename(app, client):
+    '''tests a sold vehicle cannot be deleted (409) but a vin correction follows it into its sales'''
+
+    payload = {
+                "vin": "3VWFA81H9PM123456",
+                "manufacturer_name": "Volkswagen",
+                "model_name": "Jetta",
+                "model_year": 1993,
+                "fuel_type": "Gasoline",
+                "horse_power": 115,
+                "purchase_price": 2200.20
+                }
+    client.post("/vehicle", json=payload)
+    db = app.extensions["sqlalchemy"]
+    with app.app_context():
+        db.session.execute(db.text("INSERT INTO sold_vehicles (vin, purchase_price) VALUES ('3VWFA81H9PM123456', 2500.0)"))
+        db.session.commit()
+
+    response = client.delete("/vehicle/3VWFA81H9PM123456")
+    assert response.status_code == 409
+    assert response.json == {"error": "vehicle with vin '3VWFA81H9PM123456' has been sold and cannot be deleted"}
+    assert client.get("/vehicle/3VWFA81H9PM123456").status_code == 200
+    assert client.get("/vehicle/search?q=jetta").json[0]["vin"] == "3VWFA81H9PM123456"
+
+    response = client.patch("/vehicle/3VWFA81H9PM123456", json={"vin": "3VWFA81H9PM123457"})
+    assert response.status_code == 200
+    assert [sale["vin"] for sale in client.get("/vehicle_sold").json] == ["3VWFA81H9PM123457"]
+    
+
+def test_vehicle_keyset_pagination(client):
+    '''tests the vehicle route to page through vehicles with ?limit=&after='''
+
+    payload = {
+                "manufacturer_name": "Volkswagen",
+                "model_name": "Jetta",
+                "model_year": 1993,
+                "fuel_type": "Gasoline",
+                "horse_power": 115,
+                "purchase_price": 2200.20
+                }
+
+    #posts vehicles out of vin order
+    vins = ["3VWFA81H9PM123458", "3VWFA81H9PM123456", "3VWFA81H9PM123457"]
+    for vin in vins:
+        response = client.post("/vehicle", json={**payload, "vin": vin})
+        assert response.status_code == 201
+
+    #checks first page is ordered by vin and links to the next page
+    response = client.get("/vehicle?limit=2")
+    assert response.status_code == 200
+    assert [vehicle["vin"] for vehicle in response.json] == ["3VWFA81H9PM123456", "3VWFA81H9PM123457"]
+    assert response.headers["X-Next-Cursor"] == "3VWFA81H9PM123457"
+    assert 'rel="next"' in response.headers["Link"]
+
+    #checks following the cursor returns the last page without a next link
+    response = client.get("/vehicle?limit=2&after=3vwfa81h9pm123457")
+    assert response.status_code == 200
+    assert [vehicle["vin"] for vehicle in response.json] == ["3VWFA81H9PM123458"]
+    assert "Link" not in response.headers
+
+    #checks malformed limits are rejected
+    response = client.get("/vehicle?limit=bad_val")
+    assert response.status_code == 400
+    assert response.json["error"] == "'limit' must be a int"
+
+    response = client.get("/vehicle?limit=0")
+    assert response.status_code == 400
+
+def test_vehicle_streaming(client):
+    '''tests the vehicle route to stream every vehicle as a json array or ndjson'''
+
+    payload = {
+                "manufacturer_name": "Volkswagen",
+                "model_name": "Jetta",
+                "model_year": 1993,
+                "fuel_type": "Gasoline",
+                "horse_power": 115,
+                "purchase_price": 2200.20
+                }
+
+    #checks an empty table still streams a valid json array
+    response = client.get("/vehicle?stream=json")
+    assert response.status_code == 200
+    assert response.json == []
+
+    vins = ["3VWFA81H9PM123456", "3VWFA81H9PM123457", "3VWFA81H9PM123458"]
+    for vin in vins:
+        client.post("/vehicle", json={**payload, "vin": vin})
+
+    response = client.get("/vehicle?stream=json")
+    assert response.status_code == 200
+    assert [vehicle["vin"] for vehicle in response.json] == vins
+
+    response = client.get("/vehicle?stream=ndjson")
+    assert response.status_code == 200
+    assert response.mimetype == "application/x-ndjson"
+    lines = response.get_data(as_text=True).splitlines()
+    assert [json.loads(line)["vin"] for line in lines] == vins
+
+    response = client.get("/vehicle?stream=xml")
+    assert response.status_code == 400
+
+def test_bulk_create_vehicles(app, client):
+    '''tests the bulk route to create vehicles from a json array and report per-row errors'''
+
+    app.config["VEHICLE_BULK_CHUNK_SIZE"] = 2
+    payload = {
+                "manufacturer_name": "Volkswagen",
+                "model_name": "Jetta",
+                "model_year": 1993,
+                "fuel_type": "Gasoline",
+                "horse_power": 115,
+                "purchase_price": 2200.20
+                }
+
+    #one vehicle already exists before the bulk load
+    client.post("/vehicle", json={**payload, "vin": "3VWFA81H9PM123456"})
+
+    vehicles = [
+        {**payload, "vin": "3vwfa81h9pm123457"},
+        {**payload, "vin": "3VWFA81H9PM123456"},
+        {**payload, "vin": "3VWFA81H9PM123458", "model_year": "bad_val"},
+        {**payload, "vin": "3VWFA81H9PM123459"},
+        {**payload, "vin": "3VWFA81H9PM123459"},
+    ]
+    response = client.post("/vehicle/bulk", json=vehicles)
+    assert response.status_code == 200
+    assert response.json["inserted"] == 2
+    assert response.json["errors"] == [
+        {"index": 1, "vin": "3VWFA81H9PM123456", "error": "'vin' must be unique", "errors": ["'vin' must be unique"]},
+        {"index": 2, "vin": "3VWFA81H9PM123458", "error": "'model_year' must be a int", "errors": ["'model_year' must be a int"]},
+        {"index": 4, "vin": "3VWFA81H9PM123459", "error": "'vin' must be unique", "errors": ["'vin' must be unique"]},
+    ]
+
+    response = client.get("/vehicle")
+    assert [vehicle["vin"] for vehicle in response.json] == ["3VWFA81H9PM123456", "3VWFA81H9PM123457", "3VWFA81H9PM123459"]
+
+    #checks non array bodies are rejected
+    response = client.post("/vehicle/bulk", json={"vin": "3VWFA81H9PM123460"})
+    assert response.status_code == 400
+
+def test_bulk_create_racing_duplicate(app, client):
+    '''tests a vin written by another request between the uniqueness check and the insert is reported, not a 500'''
+
+    payload = {
+                "manufacturer_name": "Volkswagen",
+                "model_name": "Jetta",
+                "model_year": 1993,
+                "fuel_type": "Gasoline",
+                "horse_power": 115,
+                "purchase_price": 2200.20
+                }
+    db = app.extensions["sqlalchemy"]
+
+    #the racing write lands right before the insert's savepoint, after the uniqueness check
+    raced = []
+    def racing_write(conn, cursor, statement, parameters, context, executemany):
+        if statement.startswith("SAVEPOINT") and not raced:
+            raced.append(statement)
+            cursor.connection.execute("INSERT INTO vehicles (vin, version, updated_at) VALUES ('3VWFA81H9PM123457', 1, '2026-01-01')")
+
+    with app.app_context():
+        event.listen(db.engine, "before_cursor_execute", racing_write)
+
+    response = client.post("/vehicle/bulk", json=[{**payload, "vin": "3VWFA81H9PM123456"}, {**payload, "vin": "3VWFA81H9PM123457"}])
+    assert raced and response.status_code == 200
+    assert response.json == {"inserted": 1, "errors": [
+        {"index": 1, "vin": "3VWFA81H9PM123457", "error": "'vin' must be unique", "errors": ["'vin' must be unique"]},
+    ]}
+    assert [change["vin"] for change in client.get("/vehicle/changes").json] == ["3VWFA81H9PM123456"]
+
+def test_upsert_racing_insert(app, client):
+    '''tests an upsert whose vin another request inserts after the read updates it, moving that vehicle's statistics'''
+
+    payload = {
+                "vin": "3VWFA81H9PM123456",
+                "manufacturer_name": "Volkswagen",
+                "model_name": "Jetta",
+                "model_year": 1993,
+                "fuel_type": "Gasoline",
+                "horse_power": 115,
+                "purchase_price": 2200.20
+                }
+    db = app.extensions["sqlalchemy"]
+
+    #the racing create (a diesel, with its statistics) lands between the upsert's read and its insert
+    raced = []
+    def racing_write(conn, cursor, statement, parameters, context, executemany):
+        if statement.startswith("INSERT INTO vehicles") and not raced:
+            raced.append(statement)
+            cursor.connection.execute(
+                "INSERT INTO vehicles (vin, manufacturer_name, model_year, fuel_type, purchase_price, version, updated_at) "
+                "VALUES ('3VWFA81H9PM123456', 'Volkswagen', 1993, 'Diesel', 1000.0, 1, '2026-01-01')"
+            )
+            cursor.connection.execute(
+                "INSERT INTO vehicle_stats (manufacturer_name, model_year, fuel_type, vehicle_count, purchase_price_sum) "
+                "VALUES ('Volkswagen', 1993, 'Diesel', 1, 1000.0)"
+            )
+
+    with app.app_context():
+        event.listen(db.engine, "before_cursor_execute", racing_write)
+
+    response = client.put("/vehicle/3VWFA81H9PM123456?upsert=true", json=payload)
+    assert raced and response.status_code == 200
+    assert response.json["fuel_type"] == "Gasoline"
+    assert client.get("/vehicle/stats?group_by=fuel_type").json == [
+        {"fuel_type": "Gasoline", "count": 1, "average_purchase_price": 2200.2},
+    ]
+    assert [change["operation"] for change in client.get("/vehicle/changes").json] == ["update"]
+
+def test_bulk_create_vehicles_ndjson(client):
+    '''tests the bulk route to create vehicles from a newline delimited json body'''
+
+    payload = {
+                "manufacturer_name": "Volkswagen",
+                "model_name": "Jetta",
+                "model_year": 1993,
+                "fuel_type": "Gasoline",
+                "horse_power": 115,
+                "purchase_price": 2200.20
+                }
+
+    body = "\n".join([
+        json.dumps({**payload, "vin": "3VWFA81H9PM123456"}),
+        "{not json",
+        "",
+        json.dumps({**payload, "vin": "3VWFA81H9PM123457"}),
+    ])
+    response = client.post("/vehicle/bulk", data=body, content_type="application/x-ndjson")
+    assert response.status_code == 200
+    assert response.json["inserted"] == 2
+    assert response.json["errors"] == [{"index": 1, "vin": None, "error": "malformed json", "errors": ["malformed json"]}]
+
+    response = client.get("/vehicle/3VWFA81H9PM123457")
+    assert response.status_code == 200
+    assert response.json["purchase_price"] == 2200.20
+
+def test_vehicle_filter_and_sort(client):
+    '''tests the vehicle route to filter and sort vehicles in the database'''
+
+    payload = {
+                "manufacturer_name": "Volkswagen",
+                "model_name": "Jetta",
+                "model_year": 1993,
+                "fuel_type": "Gasoline",
+                "horse_power": 115,
+                "purchase_price": 2200.20
+                }
+
+    client.post("/vehicle", json={**payload, "vin": "3VWFA81H9PM123456", "model_year": 2015, "purchase_price": 9000})
+    client.post("/vehicle", json={**payload, "vin": "3VWFA81H9PM123457", "model_year": 2018, "color": "red"})
+    client.post("/vehicle", json={**payload, "vin": "1FTFW1ET1EFA12345", "manufacturer_name": "Ford", "model_year": 2018, "fuel_type": "Diesel"})
+
+    #checks equality and range filters combine
+    response = client.get("/vehicle?manufacturer_name=Volkswagen&model_year_gte=2016")
+    assert response.status_code == 200
+    assert [vehicle["vin"] for vehicle in response.json] == ["3VWFA81H9PM123457"]
+
+    response = client.get("/vehicle?purchase_price_lt=5000&fuel_type=Gasoline")
+    assert [vehicle["vin"] for vehicle in response.json] == ["3VWFA81H9PM123457"]
+
+    response = client.get("/vehicle?color=red")
+    assert [vehicle["vin"] for vehicle in response.json] == ["3VWFA81H9PM123457"]
+
+    #checks sorting, including keyset pages over a non-vin sort
+    response = client.get("/vehicle?sort=-purchase_price")
+    assert [vehicle["vin"] for vehicle in response.json] == ["3VWFA81H9PM123456", "3VWFA81H9PM123457", "1FTFW1ET1EFA12345"]
+
+    response = client.get("/vehicle?sort=model_year&limit=2")
+    assert [vehicle["vin"] for vehicle in response.json] == ["3VWFA81H9PM123456", "1FTFW1ET1EFA12345"]
+    response = client.get(f"/vehicle?sort=model_year&limit=2&after={response.headers['X-Next-Cursor']}")
+    assert [vehicle["vin"] for vehicle in response.json] == ["3VWFA81H9PM123457"]
+
+    #checks malformed filters and sorts are rejected
+    response = client.get("/vehicle?model_year_gte=bad_val")
+    assert response.status_code == 400
+    assert response.json["error"] == "'model_year_gte' must be a int"
+
+    response = client.get("/vehicle?sort=color")
+    assert response.status_code == 400
+
+def test_vehicle_etags(client):
+    '''tests the vehicle routes answer unchanged conditional requests with 304'''
+
+    payload = {
+                "vin": "3VWFA81H9PM123456",
+                "manufacturer_name": "Volkswagen",
+                "model_name": "Jetta",
+                "model_year": 1993,
+                "fuel_type": "Gasoline",
+                "horse_power": 115,
+                "purchase_price": 2200.20
+                }
+    client.post("/vehicle", json=payload)
+
+    #checks a single vehicle's etag holds until the vehicle is written
+    response = client.get("/vehicle/3VWFA81H9PM123456")
+    etag = response.headers["ETag"]
+    response = client.get("/vehicle/3VWFA81H9PM123456", headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.get_data() == b""
+
+    client.patch("/vehicle/3VWFA81H9PM123456", json={"model_year": 2018})
+    response = client.get("/vehicle/3VWFA81H9PM123456", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.headers["ETag"] != etag
+
+    #checks a vehicle deleted and created again (back at version 1) doesn't match its first lifetime's etag
+    etag = response.headers["ETag"]
+    client.delete("/vehicle/3VWFA81H9PM123456")
+    client.put("/vehicle/3VWFA81H9PM123456?upsert=true", json=payload)
+    client.patch("/vehicle/3VWFA81H9PM123456", json={"model_year": 2018})
+    assert client.get("/vehicle/3VWFA81H9PM123456", headers={"If-None-Match": etag}).status_code == 200
+    assert client.get("/vehicle/3VWFA81H9PM123456?fields=vin", headers={"If-None-Match": etag}).status_code == 200
+
+    #checks the collection etag depends on the query and changes with the table
+    response = client.get("/vehicle")
+    etag = response.headers["ETag"]
+    assert client.get("/vehicle", headers={"If-None-Match": etag}).status_code == 304
+    assert client.get("/vehicle?limit=5", headers={"If-None-Match": etag}).status_code == 200
+
+    client.post("/vehicle", json={**payload, "vin": "3VWFA81H9PM123457"})
+    response = client.get("/vehicle", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert len(response.json) == 2
+
+def test_vehicle_single_statement_writes(client):
+    '''tests the vehicle routes handle upserts, missing vehicles and vin conflicts'''
+
+    payload = {
+                "vin": "3VWFA81H9PM123456",
+                "manufacturer_name": "Volkswagen",
+                "model_name": "Jetta",
+                "model_year": 1993,
+                "fuel_type": "Gasoline",
+                "horse_power": 115,
+                "purchase_price": 2200.20
+                }
+
+    #checks put only creates vehicles when upsert is asked for
+    response = client.put("/vehicle/3VWFA81H9PM123456", json=payload)
+    assert response.status_code == 404
+
+    response = client.put("/vehicle/3VWFA81H9PM123456?upsert=true", json=payload)
+    assert response.status_code == 201
+    assert response.json == payload
+
+    response = client.put("/vehicle/3VWFA81H9PM123456?upsert=true", json={**payload, "horse_power": 120})
+    assert response.status_code == 200
+    assert response.json["horse_power"] == 120
+
+    #checks patching onto an existing vin is rejected and leaves both vehicles intact
+    client.post("/vehicle", json={**payload, "vin": "3VWFA81H9PM123457"})
+    response = client.patch("/vehicle/3VWFA81H9PM123457", json={"vin": "3vwfa81h9pm123456"})
+    assert response.status_code == 422
+    assert response.json["error"] == "'vin' must be unique"
+    assert client.get("/vehicle/3VWFA81H9PM123457").status_code == 200
+
+    #checks patching the vin moves the vehicle
+    response = client.patch("/vehicle/3VWFA81H9PM123457", json={"vin": "3vwfa81h9pm123458"})
+    assert response.status_code == 200
+    assert response.json["vin"] == "3VWFA81H9PM123458"
+    assert client.get("/vehicle/3VWFA81H9PM123457").status_code == 404
+
+    #checks missing vehicles are reported by patch and delete
+    response = client.patch("/vehicle/3VWFA81H9PM123459", json={"model_year": 2018})
+    assert response.status_code == 404
+    response = client.delete("/vehicle/3VWFA81H9PM123459")
+    assert response.status_code == 404
+
+def test_post_reports_every_error(client):
+    '''tests the vehicle route to report all malformed attributes at once'''
+
+    payload = {
+                "vin": "3VWFA81H9PM123456",
+                "manufacturer_name": 0,
+                "model_name": "Jetta",
+                "model_year": "bad_val",
+                "fuel_type": "Gasoline",
+                "purchase_price": 2200.20,
+                "color": 0
+                }
+
+    response = client.post("/vehicle", json=payload)
+    assert response.status_code == 422
+    assert response.json["error"] == "horse_power not in request"
+    assert response.json["errors"] == [
+        "horse_power not in request",
+        "'manufacturer_name' must be a string",
+        "'model_year' must be a int",
+        "'color' must be a string",
+    ]
+
+@pytest.mark.parametrize("provider", ["json", "orjson"])
+def test_list_bytes_match_serialize(provider):
+    '''tests the column-projected list routes encode exactly what jsonify(serialize()) did'''
+
+    app = create_app({
+        "TESTING": True,
+        "SQLALCHEMY_DATABASE_URI": "sqlite:///:memory:",
+        "JSON_PROVIDER": provider,
+    })
+    db = app.extensions["sqlalchemy"]
+    with app.app_context():
+        db.create_all()
+    client = app.test_client()
+
+    payload = {
+                "vin": "3VWFA81H9PM123456",
+                "manufacturer_name": "Volkswagen",
+                "model_name": "Jetta",
+                "model_year": 1993,
+                "fuel_type": "Gasoline",
+                "horse_power": 115,
+                "purchase_price": 2200.20
+                }
+    client.post("/vehicle", json=payload)
+
+    #what jsonify produced for a list of serialize() dictionaries before the fast path
+    expected = json.dumps([payload], sort_keys=True, separators=(",", ":")).encode() + b"\n"
+
+    assert client.get("/vehicle").get_data() == expected
+    assert client.get("/vehicle?stream=json").get_data() == expected
+    assert client.get("/vehicle?stream=ndjson").get_data() == expected[1:-2] + b"\n"
+
+@pytest.mark.parametrize("provider", ["json", "orjson"])
+def test_dates_match_flask(provider):
+    '''tests both providers write dates and datetimes as flask's http dates'''
+
+    app = create_app({"TESTING": True, "SQLALCHEMY_DATABASE_URI": "sqlite:///:memory:", "JSON_PROVIDER": provider})
+    value = {"on": date(2024, 1, 2), "at": datetime(2024, 1, 2, 3, 4, 5, tzinfo=timezone.utc)}
+
+    assert app.json.dumps_bytes(value) == b'{"at":"Tue, 02 Jan 2024 03:04:05 GMT","on":"Tue, 02 Jan 2024 00:00:00 GMT"}'
+    with app.app_context():
+        assert app.json.response(value).get_data() == app.json.dumps_bytes(value) + b"\n"
+
+def test_sparse_fieldsets(app, client):
+    '''tests the vehicle routes only return the fields asked for'''
+
+    payload = {
+                "vin": "3VWFA81H9PM123456",
+                "manufacturer_name": "Volkswagen",
+                "model_name": "Jetta",
+                "model_year": 1993,
+                "fuel_type": "Gasoline",
+                "horse_power": 115,
+                "purchase_price": 2200.20
+                }
+    client.post("/vehicle", json=payload)
+    client.post("/vehicle", json={**payload, "vin": "3VWFA81H9PM123457", "color": "red"})
+
+    response = client.get("/vehicle?fields=vin,purchase_price")
+    assert response.status_code == 200
+    assert response.json[0] == {"vin": "3VWFA81H9PM123456", "purchase_price": 2200.20}
+
+    #checks pages still link onwards when the vin is not requested
+    response = client.get("/vehicle?fields=model_name&limit=1")
+    assert response.json == [{"model_name": "Jetta"}]
+    assert response.headers["X-Next-Cursor"] == "3VWFA81H9PM123456"
+
+    response = client.get("/vehicle?fields=model_name,color&stream=ndjson")
+    assert response.get_data(as_text=True).splitlines()[1] == '{"color":"red","model_name":"Jetta"}'
+
+    response = client.get("/vehicle/3VWFA81H9PM123457?fields=vin,color")
+    assert response.status_code == 200
+    assert response.json == {"vin": "3VWFA81H9PM123457", "color": "red"}
+    assert client.get("/vehicle/3VWFA81H9PM123458?fields=vin").status_code == 404
+
+    db = app.extensions["sqlalchemy"]
+    with app.app_context():
+        db.session.execute(db.text("INSERT INTO sold_vehicles (vin, purchase_price) VALUES ('3VWFA81H9PM123456', 2500.0)"))
+        db.session.commit()
+
+    response = client.get("/vehicle_sold?fields=vin")
+    assert response.json == [{"vin": "3VWFA81H9PM123456"}]
+    response = client.get("/vehicle_sold?fields=sale")
+    assert response.json == [{"sale": {"id": 1, "purchase_price": 2500.0, "insurance_policy": None, "car_damage": None}}]
+
+    #checks unknown fields are rejected
+    response = client.get("/vehicle?fields=vin,owner")
+    assert response.status_code == 400
+    assert response.json["error"] == "unknown field 'owner'"
+    assert client.get("/vehicle/3VWFA81H9PM123456?fields=").status_code == 400
+    assert client.get("/vehicle_sold?fields=owner").status_code == 400
+
+def test_vehicle_stats(app, client):
+    '''tests the rollup table follows every write and answers grouped stats'''
+
+    payload = {
+                "vin": "3VWFA81H9PM123456",
+                "manufacturer_name": "Volkswagen",
+                "model_name": "Jetta",
+                "model_year": 1993,
+                "fuel_type": "Gasoline",
+                "horse_power": 115,
+                "purchase_price": 2000.00
+                }
+    client.post("/vehicle", json=payload)
+    client.post("/vehicle", json={**payload, "vin": "3VWFA81H9PM123457", "purchase_price": 3000.00})
+    client.post("/vehicle/bulk", json=[{**payload, "vin": "1HGCM82633A004352", "manufacturer_name": "Honda", "model_year": 2003}])
+
+    response = client.get("/vehicle/stats?group_by=manufacturer_name")
+    assert response.status_code == 200
+    assert response.json == [
+        {"manufacturer_name": "Honda", "count": 1, "average_purchase_price": 2000.0},
+        {"manufacturer_name": "Volkswagen", "count": 2, "average_purchase_price": 2500.0},
+    ]
+    assert client.get("/vehicle/stats?group_by=manufacturer_name", headers={"If-None-Match": response.headers["ETag"]}).status_code == 304
+
+    #moves one vehicle to another group, reprices another and deletes the third
+    client.patch("/vehicle/3VWFA81H9PM123457", json={"fuel_type": "Diesel"})
+    client.put("/vehicle/3VWFA81H9PM123456", json={**payload, "purchase_price": 4000.00})
+    client.delete("/vehicle/1HGCM82633A004352")
+    client.put("/vehicle/5YJ3E1EA7KF317000?upsert=true", json={**payload, "vin": "5YJ3E1EA7KF317000", "fuel_type": "Diesel"})
+
+    response = client.get("/vehicle/stats")
+    assert response.json == [
+        {"manufacturer_name": "Volkswagen", "model_year": 1993, "fuel_type": "Diesel", "count": 2, "average_purchase_price": 2500.0},
+        {"manufacturer_name": "Volkswagen", "model_year": 1993, "fuel_type": "Gasoline", "count": 1, "average_purchase_price": 4000.0},
+    ]
+    assert client.get("/vehicle/stats?group_by=&fuel_type=Diesel").json == [{"count": 2, "average_purchase_price": 2500.0}]
+    assert client.get("/vehicle/stats?model_year=2003").json == []
+
+    #checks the rebuild command recovers from drift
+    db = app.extensions["sqlalchemy"]
+    with app.app_context():
+        db.session.execute(db.text("UPDATE vehicle_stats SET vehicle_count = 7"))
+        db.session.commit()
+    result = app.test_cli_runner().invoke(args=["rebuild-vehicle-stats"])
+    assert "rebuilt 2 vehicle_stats groups" in result.output
+    assert client.get("/vehicle/stats?group_by=fuel_type").json == [
+        {"fuel_type": "Diesel", "count": 2, "average_purchase_price": 2500.0},
+        {"fuel_type": "Gasoline", "count": 1, "average_purchase_price": 4000.0},
+    ]
+
+    assert client.get("/vehicle/stats?group_by=color").status_code == 400
+    assert client.get("/vehicle/stats?model_year=new").status_code == 400
+
+def test_vehicle_export(app, client):
+    '''tests exports stream every row as csv/ndjson, gzipped on request, and resume from a watermark'''
+
+    payload = {
+                "vin": "3VWFA81H9PM123456",
+                "manufacturer_name": "Volkswagen",
+                "model_name": "Jetta",
+                "model_year": 1993,
+                "fuel_type": "Gasoline",
+                "horse_power": 115,
+                "purchase_price": 2200.20
+                }
+    client.post("/vehicle", json=payload)
+    client.post("/vehicle", json={**payload, "vin": "3VWFA81H9PM123457", "fuel_type": "Diesel", "color": "red, dark"})
+    app.config["VEHICLE_EXPORT_CHUNK_SIZE"] = 1
+
+    response = client.get("/vehicle/export?fields=vin,color,purchase_price")
+    assert response.status_code == 200
+    assert response.mimetype == "text/csv"
+    assert response.is_streamed
+    assert response.get_data(as_text=True) == (
+        "vin,color,purchase_price\n"
+        "3VWFA81H9PM123456,,2200.2\n"
+        '3VWFA81H9PM123457,"red, dark",2200.2\n'
+    )
+
+    response = client.get("/vehicle/export?format=ndjson&fuel_type=Diesel")
+    rows = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+    assert [row["vin"] for row in rows] == ["3VWFA81H9PM123457"]
+    assert rows[0]["version"] == 1 and "T" in rows[0]["updated_at"]
+
+    response = client.get("/vehicle/export?format=ndjson", headers={"Accept-Encoding": "gzip"})
+    assert response.headers["Content-Encoding"] == "gzip"
+    assert len(gzip.decompress(response.get_data()).splitlines()) == 2
+
+    #checks an incremental export only returns vehicles written after the watermark
+    app.config["VEHICLE_EXPORT_WATERMARK_LAG"] = 0
+    watermark = client.get("/vehicle/export").headers["X-Export-Watermark"]
+    client.patch("/vehicle/3VWFA81H9PM123456", json={"horse_power": 120})
+    response = client.get("/vehicle/export", query_string={"fields": "vin", "since": watermark})
+    assert response.get_data(as_text=True) == "vin\n3VWFA81H9PM123456\n"
+
+    #checks a write stamped before an export started but committed after it is caught by the next run
+    app.config["VEHICLE_EXPORT_WATERMARK_LAG"] = 60
+    watermark = client.get("/vehicle/export").headers["X-Export-Watermark"]
+    db = app.extensions["sqlalchemy"]
+    Vehicle = app.extensions["models"]["Vehicle"]
+    with app.app_context():
+        db.session.execute(
+            db.update(Vehicle).where(Vehicle.vin == "3VWFA81H9PM123457").values(updated_at=utcnow() - timedelta(seconds=30))
+        )
+        db.session.commit()
+    response = client.get("/vehicle/export", query_string={"fields": "vin", "since": watermark})
+    assert "3VWFA81H9PM123457" in response.get_data(as_text=True)
+
+    with app.app_context():
+        db.session.execute(db.text("INSERT INTO sold_vehicles (id, vin, purchase_price) VALUES (1, '3VWFA81H9PM123456', 2500.0)"))
+        db.session.execute(db.text("INSERT INTO sold_vehicles (id, vin, purchase_price) VALUES (3, '3VWFA81H9PM123457', 2600.0)"))
+        db.session.commit()
+
+    response = client.get("/vehicle_sold/export?format=ndjson&fields=id,vin")
+    assert response.get_data(as_text=True).splitlines() == ['{"id":1,"vin":"3VWFA81H9PM123456"}', '{"id":3,"vin":"3VWFA81H9PM123457"}']
+    assert client.get("/vehicle_sold/export?fields=id&color=red, dark").get_data(as_text=True) == "id\n3\n"
+
+    #checks a sale numbered before the last export's newest but committed after it is caught by the next run
+    watermark = response.headers["X-Export-Watermark"]
+    Vehicle_sold = app.extensions["models"]["Vehicle_sold"]
+    with app.app_context():
+        db.session.execute(
+            db.insert(Vehicle_sold).values(id=2, vin="3VWFA81H9PM123456", purchase_price=2550.0, created_at=utcnow() - timedelta(seconds=30))
+        )
+        db.session.execute(db.update(Vehicle_sold).where(Vehicle_sold.id == 1).values(created_at=utcnow() - timedelta(hours=1)))
+        db.session.commit()
+    response = client.get("/vehicle_sold/export", query_string={"fields": "id", "since": watermark})
+    assert response.get_data(as_text=True) == "id\n2\n3\n"
+
+    assert client.get("/vehicle/export?format=xml").status_code == 400
+    assert client.get("/vehicle/export?since=yesterday").status_code == 400
+    assert client.get("/vehicle_sold/export?since=yesterday").status_code == 400
+    if export.pyarrow is None:
+        assert client.get("/vehicle/export?format=parquet").status_code == 501
+
+def test_vehicle_search(app, client):
+    '''tests ranked, typo tolerant search stays in step with every kind of write'''
+
+    payload = {
+                "model_year": 2015,
+                "fuel_type": "Gasoline",
+                "horse_power": 115,
+                "purchase_price": 2200.20
+                }
+    client.post("/vehicle", json={**payload, "vin": "3VWFA81H9PM123456", "manufacturer_name": "Affordable Motors", "model_name": "Runabout"})
+    client.post("/vehicle", json={**payload, "vin": "3VWFA81H9PM123457", "manufacturer_name": "Ford", "model_name": "Focus", "color": "blue"})
+    client.post("/vehicle/bulk", json=[
+        {**payload, "vin": "3VWFA81H9PM123458", "manufacturer_name": "Toyota", "model_name": "Corolla", "category": "sedan"},
+    ])
+
+    #checks prefix matches rank first, then typos and substrings still match
+    response = client.get("/vehicle/search?q=ford")
+    assert response.status_code == 200
+    assert [vehicle["vin"] for vehicle in response.json] == ["3VWFA81H9PM123457", "3VWFA81H9PM123456"]
+    assert [vehicle["vin"] for vehicle in client.get("/vehicle/search?q=toyta").json] == ["3VWFA81H9PM123458"]
+    assert [vehicle["vin"] for vehicle in client.get("/vehicle/search?q=roll").json] == ["3VWFA81H9PM123458"]
+    assert [vehicle["vin"] for vehicle in client.get("/vehicle/search?q=sedan").json] == ["3VWFA81H9PM123458"]
+    assert client.get("/vehicle/search?q=blue&fields=vin,color").json == [{"vin": "3VWFA81H9PM123457", "color": "blue"}]
+    assert len(client.get("/vehicle/search?q=ford&limit=1").json) == 1
+
+    #checks the index follows patches, replacements and deletes
+    client.patch("/vehicle/3VWFA81H9PM123457", json={"color": "green"})
+    assert client.get("/vehicle/search?q=blue").json == []
+    assert [vehicle["vin"] for vehicle in client.get("/vehicle/search?q=green").json] == ["3VWFA81H9PM123457"]
+
+    client.put("/vehicle/3VWFA81H9PM123458", json={**payload, "vin": "3VWFA81H9PM123458", "manufacturer_name": "Honda", "model_name": "Civic"})
+    assert client.get("/vehicle/search?q=corolla").json == []
+    assert [vehicle["vin"] for vehicle in client.get("/vehicle/search?q=civic").json] == ["3VWFA81H9PM123458"]
+
+    client.delete("/vehicle/3VWFA81H9PM123456")
+    assert [vehicle["vin"] for vehicle in client.get("/vehicle/search?q=ford").json] == ["3VWFA81H9PM123457"]
+
+    #checks renames move the entry, and renumbered vehicle rowids (VACUUM, table rebuilds) leave it alone
+    client.patch("/vehicle/3VWFA81H9PM123457", json={"vin": "3VWFA81H9PM123459"})
+    with app.app_context():
+        db = app.extensions["sqlalchemy"]
+        db.session.execute(text("UPDATE vehicles SET rowid = rowid + 100"))
+        db.session.commit()
+    client.patch("/vehicle/3VWFA81H9PM123458", json={"color": "red"})
+    assert [vehicle["vin"] for vehicle in client.get("/vehicle/search?q=ford").json] == ["3VWFA81H9PM123459"]
+    assert [vehicle["vin"] for vehicle in client.get("/vehicle/search?q=civic").json] == ["3VWFA81H9PM123458"]
+
+    assert client.get("/vehicle/search?q=fo").status_code == 400
+    assert client.get("/vehicle/search").status_code == 400
+    assert client.get("/vehicle/search?q=ford&limit=0").status_code == 400
+
+def test_vehicle_vin_prefix_and_batch_get(app, client):
+    '''tests vin prefix range scans and resolving many vins in one request'''
+
+    payload = {
+                "manufacturer_name": "Volkswagen",
+                "model_name": "Jetta",
+                "model_year": 1993,
+                "fuel_type": "Gasoline",
+                "horse_power": 115,
+                "purchase_price": 2200.20
+                }
+    for vin in ["3VWFA81H9PM123456", "3VWFA81H9PM123457", "3VWGA81H9PM123458", "1HGCM82633A004352"]:
+        client.post("/vehicle", json={**payload, "vin": vin})
+
+    response = client.get("/vehicle?vin_prefix=3vwf&fields=vin")
+    assert response.json == [{"vin": "3VWFA81H9PM123456"}, {"vin": "3VWFA81H9PM123457"}]
+    assert [vehicle["vin"] for vehicle in client.get("/vehicle?vin_prefix=3VW&limit=2&after=3VWFA81H9PM123457").json] == ["3VWGA81H9PM123458"]
+    assert client.get("/vehicle?vin_prefix=3VWZ").json == []
+    assert client.get("/vehicle?vin_prefix=3VW%25").status_code == 400
+
+    #checks sqlite answers prefixes from the primary key index
+    db = app.extensions["sqlalchemy"]
+    with app.app_context():
+        plan = db.session.execute(db.text(
+            "EXPLAIN QUERY PLAN SELECT vin FROM vehicles WHERE vin >= '3VWF' AND vin < '3VWG' ORDER BY vin"
+        )).all()
+    assert "sqlite_autoindex_vehicles_1" in plan[0][3] and "vin>? AND vin<?" in plan[0][3]
+
+    app.config["VEHICLE_BATCH_GET_CHUNK_SIZE"] = 2
+    response = client.post("/vehicle/batch-get?fields=vin,model_year", json=["1hgcm82633a004352", "NOPE", "3VWFA81H9PM123456", "3VWGA81H9PM123458", "1HGCM82633A004352"])
+    assert response.status_code == 200
+    assert response.json == {
+        "vehicles": [
+            {"vin": "1HGCM82633A004352", "model_year": 1993},
+            {"vin": "3VWFA81H9PM123456", "model_year": 1993},
+            {"vin": "3VWGA81H9PM123458", "model_year": 1993},
+        ],
+        "missing": ["NOPE"],
+    }
+
+    app.config["VEHICLE_BATCH_GET_MAX_VINS"] = 2
+    assert client.post("/vehicle/batch-get", json=["A", "B", "C"]).status_code == 400
+    assert client.post("/vehicle/batch-get", json={"vins": ["A"]}).status_code == 400
+    assert client.post("/vehicle/batch-get", json=[1]).status_code == 400
+
+def test_vehicle_changes(app, client):
+    '''tests every write lands in the change feed, in order, as pages or server-sent events'''
+
+    payload = {
+                "manufacturer_name": "Volkswagen",
+                "model_name": "Jetta",
+                "model_year": 1993,
+                "fuel_type": "Gasoline",
+                "horse_power": 115,
+                "purchase_price": 2200.20
+                }
+    client.post("/vehicle", json={**payload, "vin": "3VWFA81H9PM123456"})
+    client.post("/vehicle/bulk", json=[{**payload, "vin": "3VWFA81H9PM123457"}])
+    client.put("/vehicle/3VWFA81H9PM123456", json={**payload, "vin": "3VWFA81H9PM123456", "horse_power": 120})
+    client.patch("/vehicle/3VWFA81H9PM123457", json={"vin": "3VWFA81H9PM123458"})
+    client.delete("/vehicle/3VWFA81H9PM123456")
+
+    response = client.get("/vehicle/changes?fields=vin,horse_power")
+    assert response.status_code == 200
+    assert [(change["id"], change["vin"], change["operation"], change["version"]) for change in response.json] == [
+        (1, "3VWFA81H9PM123456", "insert", 1),
+        (2, "3VWFA81H9PM123457", "insert", 1),
+        (3, "3VWFA81H9PM123456", "update", 2),
+        (4, "3VWFA81H9PM123457", "delete", None),
+        (5, "3VWFA81H9PM123458", "insert", 2),
+        (6, "3VWFA81H9PM123456", "delete", None),
+    ]
+    assert response.json[4]["vehicle"] == {"vin": "3VWFA81H9PM123458", "horse_power": 115}
+    assert response.json[0]["vehicle"] is None
+    assert response.headers["X-Next-Cursor"] == "6"
+
+    #checks pages follow the cursor and an empty page keeps it
+    response = client.get("/vehicle/changes?since=2&limit=2")
+    assert [change["id"] for change in response.json] == [3, 4]
+    assert response.headers["X-Next-Cursor"] == "4"
+    assert "since=4" in response.headers["Link"]
+    response = client.get("/vehicle/changes?since=6")
+    assert response.json == [] and response.headers["X-Next-Cursor"] == "6"
+
+    #checks an sse stream replays from Last-Event-ID, then closes once it has waited VEHICLE_CHANGES_SSE_TIMEOUT
+    app.config["VEHICLE_CHANGES_POLL_INTERVAL"] = 0.01
+    app.config["VEHICLE_CHANGES_SSE_TIMEOUT"] = 0.05
+    app.config["VEHICLE_CHANGES_SSE_MAX_STREAMS"] = 1
+    response = client.get("/vehicle/changes", headers={"Accept": "text/event-stream", "Last-Event-ID": "4"})
+    assert response.mimetype == "text/event-stream"
+
+    #a second stream is over the worker's cap until the first one closes
+    busy = client.get("/vehicle/changes?stream=sse&since=2")
+    assert busy.status_code == 503 and busy.headers["Retry-After"] == "1"
+    assert busy.headers["Link"] == '</vehicle/changes?since=2>; rel="alternate"'
+    assert f'vehicle_changes_sse_streams{{worker="{os.getpid()}"}} 1' in client.get("/metrics").get_data(as_text=True)
+
+    body = response.get_data(as_text=True)
+    response.close()
+    assert body.startswith("retry: 10\n\nid: 5\nevent: insert\ndata: {")
+    assert "id: 6\nevent: delete\n" in body and ": keepalive" in body
+    assert client.get("/vehicle/changes?stream=sse&since=6").status_code == 200
+
+    assert client.get("/vehicle/changes?since=-1").status_code == 400
+    assert client.get("/vehicle/changes?since=abc").status_code == 400
+
+    #checks pruned cursors are told to resync
+    result = app.test_cli_runner().invoke(args=["prune-vehicle-changes", "--days", "0"])
+    assert "pruned 6 vehicle changes" in result.output
+    assert client.get("/vehicle/changes?since=3").status_code == 410
+    assert client.get("/vehicle/changes?since=6").json == []
@@ -0,0 +1,47 @@
+from schema import Field, Schema, VEHICLE_SCHEMA
+
+
+payload = {
+            "vin": "3VWFA81H9PM123456",
+            "manufacturer_name": "Volkswagen",
+            "model_name": "Jetta",
+            "model_year": 1993,
+            "fuel_type": "Gasoline",
+            "horse_power": 115,
+            "purchase_price": 2200.20
+            }
+
+
+def test_valid_vehicle():
+    '''tests a complete vehicle (with or without its optional attributes) passes'''
+
+    assert VEHICLE_SCHEMA.validate(payload) is None
+    assert VEHICLE_SCHEMA.validate({**payload, "color": "red", "category": None}) is None
+    assert VEHICLE_SCHEMA.validate({**payload, "purchase_price": 2200}) is None
+
+def test_partial_vehicle():
+    '''tests partial records only check the attributes they carry'''
+
+    assert VEHICLE_SCHEMA.validate({"model_year": 2018}, partial=True) is None
+    assert VEHICLE_SCHEMA.validate({"model_year": "bad_val"}, partial=True) == ["'model_year' must be a int"]
+
+def test_non_object_vehicle():
+    '''tests records that are not json objects are rejected outright'''
+
+    assert VEHICLE_SCHEMA.validate([payload]) == ["vehicle must be a json object"]
+
+def test_validate_many():
+    '''tests batches report errors for the invalid records only'''
+
+    records = [payload, {**payload, "horse_power": "bad_val"}, payload, None]
+    assert VEHICLE_SCHEMA.validate_many(records) == {
+        1: ["'horse_power' must be a int"],
+        3: ["vehicle must be a json object"],
+    }
+
+def test_custom_schema():
+    '''tests schemas other than the vehicle one compile too'''
+
+    schema = Schema(Field("id", int), Field("note", str, required=False))
+    assert schema.validate({"id": 1}) is None
+    assert schema.validate({"note": 1}) == ["id not in request", "'note' must be a string"]